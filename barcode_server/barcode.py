@@ -1,28 +1,111 @@
 import asyncio
+import itertools
 import logging
+import os
+import random
+import re
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Tuple, Set, Dict
 
 import evdev
 from evdev import *
 
 from barcode_server.config import AppConfig
+from barcode_server.device_registry import DeviceRegistry, DeviceMetadata
+from barcode_server.dispatch import EventDispatcher
+from barcode_server.hotplug import DeviceNodeWatcher
+from barcode_server.keyboard_layout import KeyboardLayout, load_keyboard_layout
 from barcode_server.keyevent_reader import KeyEventReader
-from barcode_server.stats import SCAN_COUNT, DEVICES_COUNT, DEVICE_DETECTION_TIME
+from barcode_server.stats import SCAN_COUNT, DEVICES_COUNT, DEVICE_DETECTION_TIME, observe_scan
 
 LOGGER = logging.getLogger(__name__)
 
+DEVICE_DIRECTORY = "/dev/input"
+# time between device scans, if hotplug detection is not available
+DEVICE_POLL_INTERVAL = 1
+# time between full device scans, to catch up on missed hotplug events
+DEVICE_RESCAN_INTERVAL = 60
+
+# sequence numbers of barcode events, seeded with the current time in microseconds,
+# so they keep increasing across restarts
+_event_sequence = itertools.count(time.time_ns() // 1000)
+# random part of the ids of all events of this process, so events of different instances can't collide
+_event_id_node = random.getrandbits(62)
+
+
+def datetime_to_timestamp_us(value: datetime) -> int:
+    """
+    :param value: a date, naive dates are considered to be local time
+    :return: microseconds since the epoch
+    """
+    return round(value.replace(microsecond=0).timestamp()) * 1000000 + value.microsecond
+
 
 class BarcodeEvent:
+    """
+    A scanned barcode. Events may be queued for a long time, so they are kept compact: the device is
+    an immutable snapshot shared by all events of the device, the date is stored as an integer and
+    the id and the serialized representations are only created when needed.
+    """
 
-    def __init__(self, input_device: InputDevice, barcode: str, date: datetime = None):
-        self.id = str(uuid.uuid4())
-        self.date = date if date is not None else datetime.now()
-        self.device = input_device
-        self.input_device = self.device
+    __slots__ = ("seq", "timestamp_us", "_tz", "_id", "input_device", "barcode", "first_key_time", "enter_time",
+                 "enqueue_times", "payloads")
+
+    def __init__(self, input_device: InputDevice or DeviceMetadata, barcode: str, date: datetime = None,
+                 seq: int = None, first_key_time: float = None, enter_time: float = None):
+        # monotonically increasing number, used by clients to resume after the last event they received
+        self.seq = seq if seq is not None else next(_event_sequence)
+        if date is None:
+            # microseconds since the epoch
+            self.timestamp_us = time.time_ns() // 1000
+            self._tz = None
+        else:
+            self.date = date
+        self._id = None
+        # don't keep the device (and its file descriptor) alive for as long as the event is queued
+        self.input_device = DeviceMetadata.intern(input_device)
         self.barcode = barcode
+        # time.time() of the first key and the ENTER key of the barcode, if known
+        self.first_key_time = first_key_time
+        self.enter_time = enter_time
+        # notifier type -> time.time() when the event was added to the queue of a notifier of this type
+        self.enqueue_times = None
+        # serialized representations of this event, keyed by (format, server id),
+        # so the event is only serialized once no matter how many notifiers send it
+        self.payloads = None
+
+    @property
+    def id(self) -> str:
+        """
+        :return: unique id of this event, formatted like a UUIDv7, so ids sort by time.
+                 It is derived from the sequence number and a random number of this process.
+        """
+        if self._id is None:
+            milliseconds, microseconds = divmod(self.seq, 1000)
+            self._id = str(uuid.UUID(int=(milliseconds & 0xffffffffffff) << 80 | 0x7 << 76 | microseconds << 64
+                                         | 0x2 << 62 | _event_id_node))
+        return self._id
+
+    @id.setter
+    def id(self, value: str):
+        self._id = value
+
+    @property
+    def device(self) -> DeviceMetadata:
+        return self.input_device
+
+    @property
+    def date(self) -> datetime:
+        seconds, microseconds = divmod(self.timestamp_us, 1000000)
+        return datetime.fromtimestamp(seconds, self._tz).replace(microsecond=microseconds)
+
+    @date.setter
+    def date(self, value: datetime):
+        self.timestamp_us = datetime_to_timestamp_us(value)
+        self._tz = value.tzinfo
 
 
 class BarcodeReader:
@@ -32,18 +115,21 @@ class BarcodeReader:
 
     def __init__(self, config: AppConfig):
         self.config = config
-        self.devices = {}
-        self.listeners = set()
+        self.registry = DeviceRegistry()
+        self.dispatcher = EventDispatcher()
 
-        self._keyevent_reader = KeyEventReader()
+        self._default_keyboard_layout, self._keyboard_layouts = self._load_keyboard_layouts(config)
 
         self._main_task = None
+        self._device_watcher = None
+        # device path -> reader task, each task owns the decoder state of its device
         self._device_tasks = {}
 
     async def start(self):
         """
         Start detecting and reading barcode scanner devices
         """
+        await self.dispatcher.start()
         self._main_task = asyncio.create_task(self._detect_and_read())
 
     async def stop(self):
@@ -56,115 +142,268 @@ class BarcodeReader:
         for device_path, t in self._device_tasks.items():
             t.cancel()
         self._device_tasks.clear()
+        self.registry.clear()
         self._main_task.cancel()
         self._main_task = None
+        await self.dispatcher.stop()
 
     async def _detect_and_read(self):
         """
         Detect barcode scanner devices and start readers for them
         """
-        while True:
-            try:
-                self.devices = self._find_devices(self.config.DEVICE_PATTERNS.value, self.config.DEVICE_PATHS.value)
-                DEVICES_COUNT.set(len(self.devices))
-
-                for path, d in self.devices.items():
-                    if path in self._device_tasks:
-                        continue
-                    LOGGER.info(
-                        f"Reading: {d.path}: Name: {d.name}, "
-                        f"Vendor: {d.info.vendor:04x}, Product: {d.info.product:04x}")
-                    task = asyncio.create_task(self._start_reader(d))
-                    self._device_tasks[path] = task
-
-                await asyncio.sleep(1)
-            except Exception as e:
-                logging.exception(e)
-                await asyncio.sleep(10)
-
-    async def _start_reader(self, input_device):
-        """
-        Start a reader for a specific device
+        watcher = DeviceNodeWatcher(self._watched_directories())
+        if not watcher.start():
+            LOGGER.warning(f"Device hotplug detection is not available, polling every {DEVICE_POLL_INTERVAL}s")
+            watcher = None
+        self._device_watcher = watcher
+
+        try:
+            # None: check all devices
+            changed_paths = None
+            while True:
+                try:
+                    self._update_devices(changed_paths)
+
+                    if watcher is None:
+                        await asyncio.sleep(DEVICE_POLL_INTERVAL)
+                        changed_paths = None
+                    else:
+                        changed_paths = await watcher.wait_for_changes(DEVICE_RESCAN_INTERVAL)
+                except Exception as e:
+                    logging.exception(e)
+                    await asyncio.sleep(10)
+                    changed_paths = None
+        finally:
+            self._device_watcher = None
+            if watcher is not None:
+                watcher.close()
+
+    def _watched_directories(self) -> List[Path]:
+        """
+        :return: directories that contain the device nodes of interest
+        """
+        directories = {Path(DEVICE_DIRECTORY)}
+        for path in self.config.DEVICE_PATHS.value:
+            directories.add(Path(path).parent)
+        return list(directories)
+
+    @staticmethod
+    def _list_device_paths() -> List[str]:
+        """
+        :return: paths of all input device nodes in the system
+        """
+        return evdev.list_devices(DEVICE_DIRECTORY)
+
+    @staticmethod
+    def _open_device(path: str) -> InputDevice:
+        return evdev.InputDevice(path)
+
+    @DEVICE_DETECTION_TIME.time()
+    def _update_devices(self, paths: Set[str] = None):
+        """
+        Updates the list of devices and starts readers for new ones.
+        Only device nodes that were not seen before are opened and matched.
+        :param paths: paths of the device nodes that changed, None to check all of them
+        """
+        configured_paths = set(map(str, self.config.DEVICE_PATHS.value))
+        if paths is None:
+            paths = set(self._list_device_paths()) | set(self.registry.paths)
+            for path in configured_paths:
+                if Path(path).exists():
+                    paths.add(path)
+                else:
+                    logging.warning(f"Path doesn't exist: {path}")
+        else:
+            paths = set(filter(lambda x: x in configured_paths or Path(x).name.startswith("event"), paths))
+
+        for path in paths:
+            self._update_device(path, path in configured_paths)
+        DEVICES_COUNT.set(len(self.devices))
+
+    def _update_device(self, path: str, configured: bool):
+        """
+        Checks a single device node, adding or removing the device if necessary
+        :param path: path of the device node
+        :param configured: whether the path was configured manually
+        """
+        try:
+            node = os.stat(path).st_ino
+        except OSError:
+            node = None
+
+        if node is not None and self.registry.is_known(path, node):
+            # already checked
+            return
+
+        # the node was removed or replaced, so a running reader is reading from a stale handle
+        self._stop_reader(path)
+        if node is None:
+            if self.registry.remove(path) is not None:
+                LOGGER.info(f"Device removed: {path}")
+            return
+
+        try:
+            input_device = self._open_device(path)
+        except OSError as e:
+            # f.ex. permissions were not set up yet, retried on the next change of the node
+            LOGGER.debug(f"Cannot open {path}: {e}")
+            self.registry.remove(path)
+            return
+
+        matching = configured or any(map(lambda x: x.match(input_device.name), self.config.DEVICE_PATTERNS.value))
+        device = self.registry.add(path, node, input_device, matching)
+        if not matching:
+            # only devices that are read from are kept open
+            input_device.close()
+            return
+
+        LOGGER.info(
+            f"Reading: {device.path}: Name: {device.name}, "
+            f"Vendor: {device.info.vendor:04x}, Product: {device.info.product:04x}, "
+            f"Layout: {self._find_keyboard_layout(device).name}")
+        self._device_tasks[path] = asyncio.create_task(self._start_reader(input_device, device))
+
+    def _stop_reader(self, path: str):
+        task = self._device_tasks.pop(path, None)
+        if task is not None:
+            task.cancel()
+
+    @property
+    def devices(self) -> Dict[str, DeviceMetadata]:
+        """
+        :return: device path -> metadata of all devices barcodes are read from
+        """
+        return self.registry.devices
+
+    async def _start_reader(self, input_device: InputDevice, device: DeviceMetadata):
+        """
+        Start a reader for a specific device. The reader takes ownership of the input device.
         :param input_device: the input device
+        :param device: metadata of the input device, attached to its events
         """
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+        # every device gets its own decoder, so concurrent scans on multiple
+        # devices can not interfere with each other
+        keyevent_reader = KeyEventReader(self._find_keyboard_layout(device))
         try:
             # become the sole recipient of all incoming input events
             input_device.grab()
+            # multiplex the device file descriptor on the event loop instead of
+            # blocking a thread per device
+            loop.add_reader(input_device.fd, self._on_device_readable, input_device, keyevent_reader, lines)
             while True:
-                barcode = await self._read_line(input_device)
+                line = await lines.get()
+                if isinstance(line, Exception):
+                    raise line
+                barcode, first_key_time, enter_time = line
                 if barcode is not None and len(barcode) > 0:
-                    event = BarcodeEvent(input_device, barcode)
-                    asyncio.create_task(self._notify_listeners(event))
+                    event = BarcodeEvent(device, barcode, first_key_time=first_key_time, enter_time=enter_time)
+                    await self._notify_listeners(event)
         except Exception as e:
             LOGGER.exception(e)
-            self._device_tasks.pop(input_device.path)
+            path = input_device.path
+            if self._device_tasks.get(path) is asyncio.current_task():
+                self._device_tasks.pop(path)
+                # check the device node again on the next detection round
+                self.registry.invalidate(path)
+                if self._device_watcher is not None:
+                    asyncio.get_running_loop().call_later(
+                        DEVICE_POLL_INTERVAL, self._device_watcher.add_change, path)
         finally:
+            try:
+                loop.remove_reader(input_device.fd)
+            except Exception:
+                pass
             try:
                 # release device
                 input_device.ungrab()
-            except Exception as e:
+            except Exception:
+                pass
+            try:
+                input_device.close()
+            except Exception:
                 pass
 
     @staticmethod
-    @DEVICE_DETECTION_TIME.time()
-    def _find_devices(patterns: List, paths: List[str]) -> Dict[str, InputDevice]:
+    def _on_device_readable(input_device: InputDevice, keyevent_reader: KeyEventReader, lines: asyncio.Queue):
         """
-        # Finds the input device with the name ".*Barcode Reader.*".
-        # Could and should be parameterized, of course. Device name as cmd line parameter, perhaps?
-        :param patterns: list of patterns to match the device name against
-        :return: Map of ("Device Path" -> InputDevice) items
+        Called by the event loop whenever the file descriptor of the given device is readable.
+        Reads all pending input events in a single batch, so no event is skipped, and
+        puts finished lines into the given queue.
+        :param input_device: the device to read from
+        :param keyevent_reader: the decoder of this device
+        :param lines: queue to put (line, first key time, ENTER key time) items (or a fatal read error) into
         """
-        result = {}
-        # find devices
-        devices = evdev.list_devices()
-        # create InputDevice instances
-        devices = [evdev.InputDevice(fn) for fn in devices]
+        try:
+            events = list(input_device.read())
+        except BlockingIOError:
+            # spurious wakeup, nothing to read
+            return
+        except OSError as ex:
+            # the device is gone (f.ex. unplugged), stop watching it
+            asyncio.get_running_loop().remove_reader(input_device.fd)
+            lines.put_nowait(ex)
+            return
 
-        # filter by device name
-        devices = list(filter(lambda d: any(map(lambda y: y.match(d.name), patterns)), devices))
+        for event in events:
+            line = keyevent_reader.process_event(event)
+            if line is not None:
+                lines.put_nowait((line, keyevent_reader.line_start_time, keyevent_reader.line_end_time))
 
-        # add manually defined paths
-        for path in paths:
-            try:
-                if Path(path).exists():
-                    devices.append(evdev.InputDevice(path))
-                else:
-                    logging.warning(f"Path doesn't exist: {path}")
-            except Exception as e:
-                logging.exception(e)
+    @staticmethod
+    def _load_keyboard_layouts(config: AppConfig) -> Tuple[KeyboardLayout, List[Tuple[re.Pattern, KeyboardLayout]]]:
+        """
+        Loads and compiles all configured keyboard layouts
+        :param config: app config
+        :return: tuple of (default layout, list of (device name pattern, layout) items)
+        """
+        search_paths = []
+        if config.KEYBOARD_LAYOUTS_PATH.value is not None:
+            search_paths.append(config.KEYBOARD_LAYOUTS_PATH.value)
+
+        compiled = {}
 
-        for d in devices:
-            result[d.path] = d
+        def load(name: str) -> KeyboardLayout:
+            if name not in compiled:
+                compiled[name] = load_keyboard_layout(name, search_paths)
+            return compiled[name]
 
-        return result
+        default_layout = load(config.KEYBOARD_LAYOUT.value)
+        layouts = list(map(
+            lambda x: (re.compile(x[0], flags=re.IGNORECASE), load(x[1])),
+            config.KEYBOARD_LAYOUTS.value.items()
+        ))
+        return default_layout, layouts
 
-    async def _read_line(self, input_device: InputDevice) -> str or None:
+    def _find_keyboard_layout(self, input_device: InputDevice) -> KeyboardLayout:
         """
-        Read a single line (ENTER stops input) from the given device
-        :param input_device: the device to listen on
-        :return: a barcode
+        Finds the keyboard layout to use for the given device
+        :param input_device: the input device
+        :return: the first layout whose device name pattern matches, or the default layout
         """
-        # Using a thread executor here is a workaround for
-        # input_device.async_read_loop() skipping input events sometimes,
-        # so we use a synchronous method instead.
-        # While not perfect, it has a much higher success rate.
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, self._keyevent_reader.read_line, input_device)
-        return result
+        for pattern, layout in self._keyboard_layouts:
+            if pattern.match(input_device.name):
+                return layout
+        return self._default_keyboard_layout
+
+    @property
+    def listeners(self) -> List[callable]:
+        return self.dispatcher.listeners
 
     def add_listener(self, listener: callable):
         """
         Add a barcode event listener
-        :param listener: async callable taking two arguments
+        :param listener: async callable taking the barcode event as its only argument
         """
-        self.listeners.add(listener)
+        self.dispatcher.add_listener(listener)
 
     async def _notify_listeners(self, event: BarcodeEvent):
         """
-        Notifies all listeners about the scanned barcode
+        Notifies all listeners about the scanned barcode, in the order of the scans
         :param event: barcode event
         """
         SCAN_COUNT.inc()
+        observe_scan(event)
         LOGGER.info(f"{event.input_device.name} ({event.input_device.path}): {event.barcode}")
-        for listener in self.listeners:
-            asyncio.create_task(listener(event))
+        await self.dispatcher.dispatch(event)
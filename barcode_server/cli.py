@@ -6,11 +6,15 @@ import sys
 
 import click
 from container_app_conf.formatter.toml import TomlFormatter
-from prometheus_client import start_http_server
+from prometheus_client import start_http_server, CollectorRegistry
 
 parent_dir = os.path.abspath(os.path.join(os.path.abspath(__file__), "..", ".."))
 sys.path.append(parent_dir)
 
+# the fake devices and notification targets of the bench command are not part of the package,
+# they are only available in a checkout of the repository
+BENCHMARKS_AVAILABLE = os.path.exists(os.path.join(parent_dir, "benchmarks", "pipeline.py"))
+
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 LOGGER = logging.getLogger(__name__)
 
@@ -51,6 +55,7 @@ def c_run():
     """
     from barcode_server.barcode import BarcodeReader
     from barcode_server.config import AppConfig
+    from barcode_server.stats import configure_latency_buckets
     from barcode_server.webserver import Webserver
 
     signal.signal(signal.SIGINT, signal_handler)
@@ -65,10 +70,47 @@ def c_run():
     LOGGER.info(f"Instance ID: {config.INSTANCE_ID.value}")
 
     barcode_reader = BarcodeReader(config)
+    configure_latency_buckets(config.STATS_LATENCY_BUCKETS.value)
+
+    if config.SERVER_PROCESSES.value > 0:
+        from barcode_server.ipc import EventPublisher, DeliveryProcesses, reader_socket_path
+
+        # this process only reads the devices, the webserver and notifiers run in separate processes
+        socket_path = reader_socket_path(config)
+        publisher = EventPublisher(barcode_reader, socket_path,
+                                   private_directory=config.SERVER_READER_SOCKET.value is None)
+        LOGGER.info(f"Starting {config.SERVER_PROCESSES.value} delivery processes...")
+        delivery_processes = DeliveryProcesses(socket_path, log_level, config.SERVER_PROCESSES.value)
+        delivery_processes.start(config)
+
+        # the statistics of all processes are exported by this one
+        if config.STATS_PORT.value is not None:
+            LOGGER.info("Starting statistics webserver...")
+            registry = CollectorRegistry()
+            registry.register(publisher.metrics)
+            start_http_server(config.STATS_PORT.value, registry=registry)
+
+        tasks = asyncio.gather(
+            publisher.start(),
+            barcode_reader.start(),
+        )
+        loop.run_until_complete(tasks)
+        loop.create_task(delivery_processes.supervise())
+        # shut down properly, so the socket and its directory are removed
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signum, loop.stop)
+        try:
+            loop.run_forever()
+        finally:
+            LOGGER.info("Exiting...")
+            delivery_processes.stop()
+            loop.run_until_complete(publisher.stop())
+        return
+
     webserver = Webserver(config, barcode_reader)
 
     # start prometheus server
-    if config.STATS_PORT.value is not None:
+    if config.STATS_PORT.value is not None and not config.STATS_WEBSERVER.value:
         LOGGER.info("Starting statistics webserver...")
         start_http_server(config.STATS_PORT.value)
 
@@ -91,5 +133,39 @@ def c_config():
     click.echo(config.print(TomlFormatter()))
 
 
+@click.command(name="bench")
+@click.option("--scans", default=1000, show_default=True, help="Number of scans to emit")
+@click.option("--devices", default=4, show_default=True, help="Number of fake devices emitting scans")
+@click.option("--sink", "sinks", multiple=True, type=click.Choice(["http", "mqtt", "websocket", "unix"]),
+              help="Notification target to benchmark, can be given multiple times  [default: all]")
+@click.option("--output", "-o", default="bench.json", show_default=True, type=click.Path(dir_okay=False),
+              help="File to write the results to, as json")
+def c_bench(scans: int, devices: int, sinks: tuple, output: str):
+    """
+    Benchmark the scan pipeline of barcode-server using fake devices and local notification targets
+    """
+    import orjson
+    from barcode_server.config import AppConfig
+    from benchmarks.pipeline import run_benchmark
+
+    config = AppConfig()
+    results = loop.run_until_complete(run_benchmark(
+        config, scans=scans, device_count=devices, sinks=list(sinks) if len(sinks) > 0 else None))
+
+    with open(output, "wb") as file:
+        file.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+
+    stages = [("decode", results["stages"]["decode"]), ("notify", results["stages"]["notify"])]
+    stages += list(map(lambda x: (f"deliver/{x[0]}", x[1]), results["stages"]["deliver"].items()))
+    click.echo(f"{'stage':<20} {'events/s':>10} {'p50':>10} {'p90':>10} {'p99':>10} {'max':>10}")
+    for name, stage in stages:
+        click.echo(f"{name:<20} {stage['events_per_second']:>10.1f} " + " ".join(map(
+            lambda x: f"{stage.get(x, 0):>7.2f} ms", ["p50_ms", "p90_ms", "p99_ms", "max_ms"])))
+    click.echo(f"Results written to {output}")
+
+
+if BENCHMARKS_AVAILABLE:
+    cli.add_command(c_bench)
+
 if __name__ == '__main__':
     cli()
@@ -18,7 +18,9 @@ import uuid
 
 from container_app_conf import ConfigBase
 from container_app_conf.entry.bool import BoolConfigEntry
-from container_app_conf.entry.file import FileConfigEntry
+from container_app_conf.entry.dict import DictConfigEntry
+from container_app_conf.entry.file import FileConfigEntry, DirectoryConfigEntry
+from container_app_conf.entry.float import FloatConfigEntry
 from container_app_conf.entry.int import IntConfigEntry
 from container_app_conf.entry.list import ListConfigEntry
 from container_app_conf.entry.regex import RegexConfigEntry
@@ -28,6 +30,7 @@ from container_app_conf.source.env_source import EnvSource
 from container_app_conf.source.toml_source import TomlSource
 from container_app_conf.source.yaml_source import YamlSource
 from py_range_parse import Range
+from voluptuous import Schema
 
 from barcode_server.const import *
 
@@ -92,6 +95,50 @@ class AppConfig(ConfigBase):
         secret=True
     )
 
+    SERVER_CLIENT_IDLE_TIMEOUT = TimeDeltaConfigEntry(
+        description="Time after which the event queue of a disconnected websocket client is removed",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_SERVER,
+            "client_idle_timeout"
+        ],
+        default="2h",
+    )
+
+    SERVER_REPLAY_BUFFER_SIZE = IntConfigEntry(
+        description="Number of recent events kept for websocket clients resuming with the Last-Event-Seq header",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_SERVER,
+            "replay_buffer_size"
+        ],
+        default=10000,
+        range=Range(0, 10000000),
+    )
+
+    SERVER_PROCESSES = IntConfigEntry(
+        description="Number of processes running the webserver and the notifiers, next to a separate process "
+                    "reading the devices. 0 to run everything in a single process.",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_SERVER,
+            "processes"
+        ],
+        default=0,
+        range=Range(0, 256),
+    )
+
+    SERVER_READER_SOCKET = StringConfigEntry(
+        description="Unix socket the reader process streams events to the other processes on, "
+                    "defaults to a socket in a new directory only accessible by the current user",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_SERVER,
+            "reader_socket"
+        ],
+        required=False,
+    )
+
     DROP_EVENT_QUEUE_AFTER = TimeDeltaConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -108,6 +155,91 @@ class AppConfig(ConfigBase):
         default="2s",
     )
 
+    MAX_IN_FLIGHT = IntConfigEntry(
+        description="Maximum number of events a notifier sends concurrently",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            "max_in_flight"
+        ],
+        default=1,
+        range=Range(1, 1000),
+    )
+
+    PRESERVE_DEVICE_ORDER = BoolConfigEntry(
+        description="Whether events of the same device are delivered in order, when sending events concurrently",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            "preserve_device_order"
+        ],
+        default=True,
+    )
+
+    EVENT_QUEUE_MAX_SIZE = IntConfigEntry(
+        description="Maximum number of events queued in memory per notifier, 0 for no limit",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_EVENT_QUEUE,
+            "max_size"
+        ],
+        default=10000,
+        range=Range(0, 10000000),
+    )
+
+    EVENT_QUEUE_OVERFLOW_POLICY = StringConfigEntry(
+        description="What to do with new events when the queue of a notifier is full: "
+                    "drop-oldest, drop-newest or spill (to the event queue path)",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_EVENT_QUEUE,
+            "overflow_policy"
+        ],
+        regex="drop-oldest|drop-newest|spill",
+        default="drop-oldest",
+        required=True
+    )
+
+    EVENT_QUEUE_PATH = DirectoryConfigEntry(
+        description="Directory to persist the event queues of the HTTP and MQTT notifiers in, "
+                    "as well as events spilled by the overflow policy",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_EVENT_QUEUE,
+            "path"
+        ],
+        required=False
+    )
+
+    EVENT_QUEUE_GROUP_COMMIT = BoolConfigEntry(
+        description="Whether to sync multiple queued events to disk at once, instead of every event individually",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_EVENT_QUEUE,
+            "group_commit"
+        ],
+        default=True,
+    )
+
+    EVENT_QUEUE_COMMIT_DELAY = TimeDeltaConfigEntry(
+        description="Additional time to collect queued events before syncing them to disk together",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_EVENT_QUEUE,
+            "commit_delay"
+        ],
+        default="0s",
+    )
+
+    EVENT_QUEUE_SEGMENT_SIZE = IntConfigEntry(
+        description="Size in bytes after which a new event queue segment file is started",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_EVENT_QUEUE,
+            "segment_size"
+        ],
+        default=16 * 1024 * 1024,
+        range=Range(1024, 1024 * 1024 * 1024),
+    )
+
     HTTP_METHOD = StringConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -138,6 +270,126 @@ class AppConfig(ConfigBase):
         default=[]
     )
 
+    HTTP_POOL_SIZE = IntConfigEntry(
+        description="Maximum number of simultaneous connections to the HTTP target",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "pool_size"
+        ],
+        default=10,
+        range=Range(1, 1000),
+    )
+
+    HTTP_KEEPALIVE_TIMEOUT = TimeDeltaConfigEntry(
+        description="Time to keep idle connections to the HTTP target open",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "keepalive_timeout"
+        ],
+        default="60s",
+    )
+
+    HTTP_DNS_CACHE_TTL = TimeDeltaConfigEntry(
+        description="Time to cache DNS lookups of the HTTP target",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "dns_cache_ttl"
+        ],
+        default="5m",
+    )
+
+    HTTP_BATCH_SIZE = IntConfigEntry(
+        description="Maximum number of events to send in a single request, as a JSON array. "
+                    "1 sends every event individually. Batches are sent one at a time, ignoring max_in_flight.",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "batch_size"
+        ],
+        default=1,
+        range=Range(1, 10000),
+    )
+
+    HTTP_BATCH_TIMEOUT = TimeDeltaConfigEntry(
+        description="Maximum time to wait for more events to fill a batch",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "batch_timeout"
+        ],
+        default="0.1s",
+    )
+
+    HTTP_RETRY_INITIAL_DELAY = TimeDeltaConfigEntry(
+        description="Time to wait after the first failed attempt to notify the HTTP target, defaults to retry_interval",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            CONFIG_NODE_RETRY,
+            "initial_delay"
+        ],
+        required=False
+    )
+
+    HTTP_RETRY_MAX_DELAY = TimeDeltaConfigEntry(
+        description="Maximum time to wait between attempts to notify the HTTP target",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            CONFIG_NODE_RETRY,
+            "max_delay"
+        ],
+        default="5m",
+    )
+
+    HTTP_RETRY_MULTIPLIER = FloatConfigEntry(
+        description="Factor the time between attempts to notify the HTTP target grows by with every failure",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            CONFIG_NODE_RETRY,
+            "multiplier"
+        ],
+        default=2.0,
+    )
+
+    HTTP_RETRY_JITTER = FloatConfigEntry(
+        description="Fraction of the time between attempts to notify the HTTP target that is randomized",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            CONFIG_NODE_RETRY,
+            "jitter"
+        ],
+        default=0.2,
+    )
+
+    HTTP_CIRCUIT_BREAKER_FAILURE_THRESHOLD = IntConfigEntry(
+        description="Number of consecutive failures after which notifying the HTTP target is paused, 0 to disable",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            CONFIG_NODE_CIRCUIT_BREAKER,
+            "failure_threshold"
+        ],
+        default=5,
+        range=Range(0, 1000),
+    )
+
+    HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT = TimeDeltaConfigEntry(
+        description="Time to pause notifying the HTTP target, before probing it again",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            CONFIG_NODE_CIRCUIT_BREAKER,
+            "reset_timeout"
+        ],
+        default="30s",
+    )
+
     MQTT_HOST = StringConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -213,6 +465,135 @@ class AppConfig(ConfigBase):
         required=True
     )
 
+    MQTT_RETRY_INITIAL_DELAY = TimeDeltaConfigEntry(
+        description="Time to wait after the first failed attempt to notify the MQTT target, defaults to retry_interval",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_MQTT,
+            CONFIG_NODE_RETRY,
+            "initial_delay"
+        ],
+        required=False
+    )
+
+    MQTT_RETRY_MAX_DELAY = TimeDeltaConfigEntry(
+        description="Maximum time to wait between attempts to notify the MQTT target",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_MQTT,
+            CONFIG_NODE_RETRY,
+            "max_delay"
+        ],
+        default="5m",
+    )
+
+    MQTT_RETRY_MULTIPLIER = FloatConfigEntry(
+        description="Factor the time between attempts to notify the MQTT target grows by with every failure",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_MQTT,
+            CONFIG_NODE_RETRY,
+            "multiplier"
+        ],
+        default=2.0,
+    )
+
+    MQTT_RETRY_JITTER = FloatConfigEntry(
+        description="Fraction of the time between attempts to notify the MQTT target that is randomized",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_MQTT,
+            CONFIG_NODE_RETRY,
+            "jitter"
+        ],
+        default=0.2,
+    )
+
+    MQTT_CIRCUIT_BREAKER_FAILURE_THRESHOLD = IntConfigEntry(
+        description="Number of consecutive failures after which notifying the MQTT target is paused, 0 to disable",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_MQTT,
+            CONFIG_NODE_CIRCUIT_BREAKER,
+            "failure_threshold"
+        ],
+        default=5,
+        range=Range(0, 1000),
+    )
+
+    MQTT_CIRCUIT_BREAKER_RESET_TIMEOUT = TimeDeltaConfigEntry(
+        description="Time to pause notifying the MQTT target, before probing it again",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_MQTT,
+            CONFIG_NODE_CIRCUIT_BREAKER,
+            "reset_timeout"
+        ],
+        default="30s",
+    )
+
+    UNIX_SOCKET_PATH = StringConfigEntry(
+        description="Unix socket to stream events to local subscribers on",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_UNIX_SOCKET,
+            "path"
+        ],
+        required=False,
+    )
+
+    UNIX_SOCKET_MODE = StringConfigEntry(
+        description="Permissions of the Unix socket as an octal number, subscribers need write permission",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_UNIX_SOCKET,
+            "mode"
+        ],
+        regex="[0-7]{3,4}",
+        default="660",
+    )
+
+    HISTORY_PATH = StringConfigEntry(
+        description="SQLite database file to record all scanned events in, so they can be queried at /events",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HISTORY,
+            "path"
+        ],
+        required=False,
+    )
+
+    HISTORY_RETENTION = TimeDeltaConfigEntry(
+        description="Time after which recorded events are deleted",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HISTORY,
+            "retention"
+        ],
+        default="30d",
+    )
+
+    HISTORY_BATCH_SIZE = IntConfigEntry(
+        description="Number of recorded events after which they are inserted right away",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HISTORY,
+            "batch_size"
+        ],
+        default=500,
+        range=Range(1, 100000),
+    )
+
+    HISTORY_FLUSH_INTERVAL = TimeDeltaConfigEntry(
+        description="Maximum time recorded events are collected before they are inserted",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HISTORY,
+            "flush_interval"
+        ],
+        default="1s",
+    )
+
     DEVICE_PATTERNS = ListConfigEntry(
         item_type=RegexConfigEntry,
         item_args={
@@ -234,6 +615,38 @@ class AppConfig(ConfigBase):
         default=[]
     )
 
+    KEYBOARD_LAYOUT = StringConfigEntry(
+        description="Keyboard layout of devices without a more specific layout",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_KEYBOARD,
+            "layout"
+        ],
+        default="us",
+        required=True
+    )
+
+    KEYBOARD_LAYOUTS = DictConfigEntry(
+        description="Keyboard layouts per device name pattern",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_KEYBOARD,
+            "layouts"
+        ],
+        schema=Schema({str: str}),
+        default={}
+    )
+
+    KEYBOARD_LAYOUTS_PATH = DirectoryConfigEntry(
+        description="Directory containing additional keyboard layout files",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_KEYBOARD,
+            "layouts_path"
+        ],
+        required=False
+    )
+
     STATS_PORT = IntConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -244,7 +657,40 @@ class AppConfig(ConfigBase):
         required=False
     )
 
+    STATS_WEBSERVER = BoolConfigEntry(
+        description="Whether to serve statistics at /metrics of the webserver, instead of a separate port",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_STATS,
+            "webserver"
+        ],
+        default=False,
+    )
+
+    STATS_CACHE_DURATION = TimeDeltaConfigEntry(
+        description="Time for which statistics served by the webserver are cached, before they are collected again",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_STATS,
+            "cache_duration"
+        ],
+        default="1s",
+    )
+
+    STATS_LATENCY_BUCKETS = ListConfigEntry(
+        item_type=FloatConfigEntry,
+        description="Upper bounds of the buckets of the scan latency histograms, in seconds",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_STATS,
+            "latency_buckets"
+        ],
+        default=DEFAULT_LATENCY_BUCKETS,
+    )
+
     def validate(self):
         super(AppConfig, self).validate()
         if len(self.DEVICE_PATHS.value) == len(self.DEVICE_PATTERNS.value) == 0:
             raise AssertionError("You must provide at least one device pattern or device_path!")
+        if self.EVENT_QUEUE_OVERFLOW_POLICY.value == "spill" and self.EVENT_QUEUE_PATH.value is None:
+            raise AssertionError("The spill overflow policy requires an event_queue path!")
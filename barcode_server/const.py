@@ -15,6 +15,7 @@
 
 Client_Id = "Client-ID"
 Drop_Event_Queue = "Drop-Event-Queue"
+Last_Event_Seq = "Last-Event-Seq"
 X_Auth_Token = "X-Auth-Token"
 
 CONFIG_NODE_ROOT = "barcode_server"
@@ -22,6 +23,12 @@ CONFIG_NODE_ROOT = "barcode_server"
 CONFIG_NODE_SERVER = "server"
 CONFIG_NODE_HTTP = "http"
 CONFIG_NODE_MQTT = "mqtt"
+CONFIG_NODE_UNIX_SOCKET = "unix_socket"
+CONFIG_NODE_HISTORY = "history"
+CONFIG_NODE_KEYBOARD = "keyboard"
+CONFIG_NODE_EVENT_QUEUE = "event_queue"
+CONFIG_NODE_RETRY = "retry"
+CONFIG_NODE_CIRCUIT_BREAKER = "circuit_breaker"
 
 CONFIG_NODE_STATS = "stats"
 CONFIG_NODE_PORT = "port"
@@ -29,4 +36,8 @@ CONFIG_NODE_PORT = "port"
 DEFAULT_SERVER_HOST = "127.0.0.1"
 DEFAULT_SERVER_PORT = 9654
 
+DEFAULT_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
 ENDPOINT_DEVICES = "devices"
+ENDPOINT_METRICS = "metrics"
+ENDPOINT_EVENTS = "events"
@@ -0,0 +1,162 @@
+import logging
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+from evdev import InputDevice
+from evdev.device import DeviceInfo
+
+LOGGER = logging.getLogger(__name__)
+
+# (identity, name) -> metadata, so events of the same device share a single snapshot
+_interned: 'weakref.WeakValueDictionary[tuple, DeviceMetadata]' = weakref.WeakValueDictionary()
+
+
+class DeviceMetadata:
+    """
+    Immutable snapshot of the metadata of an input device, captured once when the device is detected.
+    Used in place of the InputDevice wherever the device is only described, not read from.
+    """
+
+    __slots__ = ("name", "path", "phys", "info", "dict", "__weakref__")
+
+    def __init__(self, name: str, path: str, vendor: int, product: int, phys: str = "", bustype: int = 0,
+                 version: int = 0):
+        self.name = name
+        self.path = path
+        self.phys = phys
+        self.info = DeviceInfo(bustype=bustype, vendor=vendor, product=product, version=version)
+
+        from barcode_server.util import input_device_to_dict
+        # precomputed, since it is needed for every event of this device
+        self.dict = None
+        self.dict = input_device_to_dict(self)
+
+    @staticmethod
+    def from_input_device(input_device: InputDevice) -> 'DeviceMetadata':
+        info = input_device.info
+        return DeviceMetadata(
+            name=input_device.name,
+            path=input_device.path,
+            vendor=info.vendor,
+            product=info.product,
+            phys=getattr(input_device, "phys", ""),
+            bustype=info.bustype if hasattr(info, "bustype") else 0,
+            version=info.version if hasattr(info, "version") else 0,
+        )
+
+    @staticmethod
+    def intern(input_device: InputDevice) -> 'DeviceMetadata':
+        """
+        :param input_device: the device
+        :return: metadata of the given device, shared with all other callers for the same device
+        """
+        if isinstance(input_device, DeviceMetadata):
+            return input_device
+        metadata = DeviceMetadata.from_input_device(input_device)
+        return _interned.setdefault((metadata.identity, metadata.name), metadata)
+
+    @property
+    def identity(self) -> Tuple[str, int, int, str]:
+        """
+        :return: tuple of (path, vendor, product, phys), identifying the device plugged into a specific port
+        """
+        return self.path, self.info.vendor, self.info.product, self.phys
+
+
+class DeviceRegistry:
+    """
+    Keeps track of all device nodes that were checked, so a node is only opened again once it changed.
+    Caches the metadata of all matching devices, as well as their serialized representation.
+    """
+
+    def __init__(self):
+        # device node path -> (inode, metadata) of all checked nodes, matching or not
+        self._nodes: Dict[str, Tuple[int, DeviceMetadata]] = {}
+        # device node path -> metadata of matching devices
+        self._devices: Dict[str, DeviceMetadata] = {}
+        self._devices_json: Optional[bytes] = None
+
+    @property
+    def devices(self) -> Dict[str, DeviceMetadata]:
+        """
+        :return: device node path -> metadata of all matching devices
+        """
+        return self._devices
+
+    @property
+    def paths(self) -> List[str]:
+        """
+        :return: paths of all checked device nodes
+        """
+        return list(self._nodes.keys())
+
+    def is_known(self, path: str, node: int) -> bool:
+        """
+        :param path: path of a device node
+        :param node: current inode of the device node
+        :return: True if the node was already checked and didn't change since
+        """
+        entry = self._nodes.get(path, None)
+        return entry is not None and entry[0] == node
+
+    def add(self, path: str, node: int, input_device: InputDevice, matching: bool) -> DeviceMetadata:
+        """
+        Registers a checked device node
+        :param path: path of the device node
+        :param node: inode of the device node
+        :param input_device: the opened device
+        :param matching: whether barcodes should be read from the device
+        :return: metadata of the device
+        """
+        metadata = DeviceMetadata.from_input_device(input_device)
+        previous = self._nodes.get(path, (None, None))[1]
+        if previous is not None and previous.identity == metadata.identity and previous.name == metadata.name:
+            # the node changed, but the same device is behind it, so keep its cached representation
+            metadata = previous
+
+        self._nodes[path] = (node, metadata)
+        if matching:
+            if self._devices.get(path, None) is not metadata:
+                self._devices[path] = metadata
+                self._devices_json = None
+        elif self._devices.pop(path, None) is not None:
+            self._devices_json = None
+        return metadata
+
+    def invalidate(self, path: str):
+        """
+        Marks a device node as changed, so it is checked again, while keeping its metadata
+        in case the same device turns up again
+        :param path: path of the device node
+        """
+        entry = self._nodes.get(path, None)
+        if entry is not None:
+            self._nodes[path] = (None, entry[1])
+        if self._devices.pop(path, None) is not None:
+            self._devices_json = None
+
+    def remove(self, path: str) -> Optional[DeviceMetadata]:
+        """
+        Forgets a device node, so it is checked again on its next change
+        :param path: path of the device node
+        :return: metadata of the device, if it was a matching one
+        """
+        self._nodes.pop(path, None)
+        metadata = self._devices.pop(path, None)
+        if metadata is not None:
+            self._devices_json = None
+        return metadata
+
+    def clear(self):
+        self._nodes.clear()
+        self._devices.clear()
+        self._devices_json = None
+
+    def devices_json(self) -> bytes:
+        """
+        :return: json array of all matching devices
+        """
+        if self._devices_json is None:
+            import orjson
+            self._devices_json = orjson.dumps(list(map(lambda x: x.dict, self._devices.values())))
+        return self._devices_json
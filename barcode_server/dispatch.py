@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional, Tuple, Callable, Awaitable
+
+from barcode_server.stats import DISPATCH_QUEUE_TIME, DISPATCH_LISTENER_TIME, DISPATCH_LISTENER_ERRORS, \
+    DISPATCH_QUEUE_DEPTH
+
+LOGGER = logging.getLogger(__name__)
+
+# maximum number of events waiting to be dispatched, before readers have to wait
+DEFAULT_QUEUE_SIZE = 1024
+
+Listener = Callable[[object], Awaitable]
+
+
+class EventDispatcher:
+    """
+    Delivers barcode events to all listeners, in the order they were scanned.
+
+    Events are put into a bounded queue, which is processed by a single consumer task. The consumer
+    awaits each listener in turn before taking the next event, so no task is created per event, and
+    an event is only handed to the listeners once all earlier events were handed to them.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_QUEUE_SIZE):
+        """
+        :param max_size: maximum number of events waiting to be dispatched
+        """
+        # (event, time.perf_counter() when it was queued) items
+        self._queue: asyncio.Queue = asyncio.Queue(max_size)
+        # (listener, its processing time metric, its error metric) items
+        self._listeners: List[Tuple[Listener, object, object]] = []
+        self._task: Optional[asyncio.Task] = None
+        DISPATCH_QUEUE_DEPTH.set_function(self._queue.qsize)
+
+    def add_listener(self, listener: Listener):
+        """
+        Adds a listener, which is called with every event
+        :param listener: async callable taking the event as its only argument
+        """
+        if any(map(lambda x: x[0] == listener, self._listeners)):
+            return
+        name = getattr(listener, "__qualname__", type(listener).__name__)
+        self._listeners.append((
+            listener,
+            DISPATCH_LISTENER_TIME.labels(listener=name),
+            DISPATCH_LISTENER_ERRORS.labels(listener=name),
+        ))
+
+    @property
+    def listeners(self) -> List[Listener]:
+        return list(map(lambda x: x[0], self._listeners))
+
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        """
+        Starts the consumer of the dispatch queue
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the consumer, events that were not dispatched yet are dropped
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def dispatch(self, event):
+        """
+        Queues an event for all listeners, waiting if too many events are queued already
+        :param event: barcode event
+        """
+        await self._queue.put((event, time.perf_counter()))
+
+    async def join(self):
+        """
+        Waits until all queued events were handed to all listeners
+        """
+        await self._queue.join()
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            event, queued = await queue.get()
+            start = time.perf_counter()
+            DISPATCH_QUEUE_TIME.observe(start - queued)
+            for listener, listener_time, listener_errors in self._listeners:
+                try:
+                    await listener(event)
+                except Exception as ex:
+                    listener_errors.inc()
+                    LOGGER.exception(ex)
+                end = time.perf_counter()
+                listener_time.observe(end - start)
+                start = end
+            queue.task_done()
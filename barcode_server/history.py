@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.stats import HISTORY_INSERT_TIME, HISTORY_PENDING_EVENTS, HISTORY_DELETED_EVENTS, \
+    HISTORY_DROPPED_EVENTS
+from barcode_server.util import barcode_event_to_json
+
+LOGGER = logging.getLogger(__name__)
+
+# maximum number of events returned by a single query
+MAX_QUERY_LIMIT = 1000
+# time between applications of the retention policy, in seconds
+RETENTION_INTERVAL = 60
+# number of batches kept in memory while inserting fails, above which the oldest events are dropped
+MAX_PENDING_BATCHES = 100
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        timestamp_us INTEGER NOT NULL,
+        device_path TEXT NOT NULL,
+        device_name TEXT NOT NULL,
+        barcode TEXT NOT NULL,
+        event BLOB NOT NULL
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS events_event_id ON events (event_id)",
+    "CREATE INDEX IF NOT EXISTS events_barcode ON events (barcode, id)",
+    "CREATE INDEX IF NOT EXISTS events_device ON events (device_path, id)",
+    "CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp_us)",
+]
+
+
+class EventHistory:
+    """
+    Keeps all scanned events in a SQLite database, so they can be queried later on.
+
+    Events are collected in memory and inserted in batches by a single background thread, so recording
+    an event never waits for the database. The database uses write-ahead logging, so queries,
+    which use a connection of their own, don't block inserts and vice versa.
+    Events are ordered by the id of their row, which increases in the order they were recorded in and is used
+    as the cursor to page through results. Unlike sequence numbers, it doesn't depend on the clock.
+    """
+
+    def __init__(self, path: str, server_id: str, retention: Optional[timedelta] = None, batch_size: int = 500,
+                 flush_interval: timedelta = timedelta(seconds=1), writer: bool = True):
+        """
+        :param path: path of the database file
+        :param server_id: server instance id, part of the stored json representation of events
+        :param retention: time after which events are deleted, None to keep them forever
+        :param batch_size: number of events after which they are inserted right away
+        :param flush_interval: maximum time events are collected before they are inserted
+        :param writer: whether this instance records events and applies the retention policy,
+                       instead of only querying the database
+        """
+        self.path = path
+        self.server_id = server_id
+        self.retention = retention
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writer = writer
+
+        self._pending: List[BarcodeEvent] = []
+        self._flush_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # sqlite connections may only be used by the thread that created them
+        self._write_executor: Optional[ThreadPoolExecutor] = None
+        self._read_executor: Optional[ThreadPoolExecutor] = None
+        self._write_connection: Optional[sqlite3.Connection] = None
+        self._read_connection: Optional[sqlite3.Connection] = None
+
+    async def start(self):
+        """
+        Opens the database and starts inserting recorded events
+        """
+        loop = asyncio.get_running_loop()
+        if self.writer:
+            # only the writer sets up the database, so processes that only query it don't race to do so
+            self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-write")
+            self._write_connection = await loop.run_in_executor(self._write_executor, self._connect, True)
+        self._read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-read")
+        self._read_connection = await loop.run_in_executor(self._read_executor, self._connect, False)
+        if self.writer:
+            self._task = asyncio.create_task(self._flush_loop())
+        LOGGER.info(f"Recording event history in {self.path}")
+
+    async def stop(self):
+        """
+        Inserts all pending events and closes the database
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        loop = asyncio.get_running_loop()
+        if self._write_executor is not None:
+            try:
+                await self.flush()
+            except Exception as ex:
+                LOGGER.exception(ex)
+            await loop.run_in_executor(self._write_executor, self._write_connection.close)
+            self._write_executor.shutdown()
+            self._write_executor = None
+        if self._read_executor is not None:
+            await loop.run_in_executor(self._read_executor, self._read_connection.close)
+            self._read_executor.shutdown()
+            self._read_executor = None
+
+    def _connect(self, create: bool) -> sqlite3.Connection:
+        """
+        :param create: whether to set up the database and create the schema, which only the writer does
+        :return: a connection to the database
+        """
+        connection = sqlite3.connect(self.path)
+        if create:
+            # readers see a consistent snapshot and never block the writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            # in WAL mode, the database is still consistent after a power loss, only the latest events may be lost
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+        return connection
+
+    def add(self, event: BarcodeEvent):
+        """
+        Records an event, it is inserted into the database in the background
+        :param event: barcode event
+        """
+        self._pending.append(event)
+        HISTORY_PENDING_EVENTS.inc()
+        if len(self._pending) >= self.batch_size:
+            self._flush_requested.set()
+
+    async def flush(self):
+        """
+        Inserts all pending events
+        """
+        if len(self._pending) <= 0:
+            return
+        events = self._pending
+        self._pending = []
+        # serialized on the event loop, the json is usually cached on the event already
+        rows = list(map(lambda x: (
+            x.id, x.seq, x.timestamp_us, x.input_device.path, x.input_device.name, x.barcode,
+            barcode_event_to_json(self.server_id, x)
+        ), events))
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._write_executor, self._insert, rows)
+        except Exception:
+            # f.ex. the database is locked or the disk is full, so try again with the next batch
+            self._pending = events + self._pending
+            self._drop_excess_pending()
+            raise
+        HISTORY_PENDING_EVENTS.dec(len(rows))
+
+    def _drop_excess_pending(self):
+        """
+        Drops the oldest pending events, if too many of them could not be inserted
+        """
+        excess = len(self._pending) - self.batch_size * MAX_PENDING_BATCHES
+        if excess <= 0:
+            return
+        LOGGER.warning(f"Dropping {excess} events that could not be recorded in the history")
+        del self._pending[:excess]
+        HISTORY_PENDING_EVENTS.dec(excess)
+        HISTORY_DROPPED_EVENTS.inc(excess)
+
+    def _insert(self, rows: List[tuple]):
+        start = time.perf_counter()
+        with self._write_connection:
+            # an event that was already recorded is not recorded again
+            self._write_connection.executemany(
+                "INSERT OR IGNORE INTO events (event_id, seq, timestamp_us, device_path, device_name, barcode, event) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        HISTORY_INSERT_TIME.observe(time.perf_counter() - start)
+
+    async def apply_retention(self) -> int:
+        """
+        Deletes all events older than the retention period
+        :return: number of deleted events
+        """
+        if self.retention is None:
+            return 0
+        cutoff = time.time_ns() // 1000 - self.retention // timedelta(microseconds=1)
+        count = await asyncio.get_running_loop().run_in_executor(self._write_executor, self._delete_before, cutoff)
+        if count > 0:
+            LOGGER.debug(f"Deleted {count} events from the history")
+            HISTORY_DELETED_EVENTS.inc(count)
+        return count
+
+    def _delete_before(self, timestamp_us: int) -> int:
+        with self._write_connection:
+            return self._write_connection.execute("DELETE FROM events WHERE timestamp_us < ?", (timestamp_us,)).rowcount
+
+    async def _flush_loop(self):
+        """
+        Inserts pending events whenever a batch is full or the flush interval passed,
+        and applies the retention policy from time to time
+        """
+        loop = asyncio.get_running_loop()
+        next_retention = loop.time()
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval.total_seconds())
+                except asyncio.TimeoutError:
+                    pass
+                self._flush_requested.clear()
+                await self.flush()
+                if loop.time() >= next_retention:
+                    next_retention = loop.time() + RETENTION_INTERVAL
+                    await self.apply_retention()
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                LOGGER.exception(ex)
+
+    async def query(self, barcode: str = None, device: str = None, since: int = None, until: int = None,
+                    cursor: int = None, limit: int = 100) -> Tuple[List[bytes], Optional[int]]:
+        """
+        Finds recorded events, newest first
+        :param barcode: only events with this barcode
+        :param device: only events of the device with this path
+        :param since: only events at or after this time, in microseconds since the epoch
+        :param until: only events before this time, in microseconds since the epoch
+        :param cursor: only events before this one, as returned by the previous query
+        :param limit: maximum number of events to return
+        :return: tuple of (json representations of the events, cursor of the next page or None if there is none)
+        """
+        if self.writer:
+            # so recently scanned events are found as well
+            await self.flush()
+
+        conditions = []
+        parameters = []
+        for condition, value in [
+            ("barcode = ?", barcode),
+            ("device_path = ?", device),
+            ("timestamp_us >= ?", since),
+            ("timestamp_us < ?", until),
+            ("id < ?", cursor),
+        ]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        # the matching rows are found using the indexes only, so a wide time range, whose rows have to be sorted,
+        # doesn't read the events of all of them
+        ids = "SELECT id FROM events"
+        if len(conditions) > 0:
+            ids += " WHERE " + " AND ".join(conditions)
+        # one more than requested, to know whether there is another page
+        ids += " ORDER BY id DESC LIMIT ?"
+        sql = f"SELECT id, event FROM events WHERE id IN ({ids}) ORDER BY id DESC"
+        limit = max(1, min(limit, MAX_QUERY_LIMIT))
+        parameters.append(limit + 1)
+
+        rows = await asyncio.get_running_loop().run_in_executor(
+            self._read_executor, lambda: self._read_connection.execute(sql, parameters).fetchall())
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return list(map(lambda x: x[1], rows[:limit])), next_cursor
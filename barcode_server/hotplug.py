@@ -0,0 +1,199 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# see inotify(7)
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class DeviceNodeWatcher:
+    """
+    Watches directories for added, removed and changed device nodes using inotify,
+    so device detection only has to look at the nodes that actually changed.
+
+    Directories that don't exist yet (f.ex. /dev/input/by-id before the first device
+    was plugged in) are watched as soon as they are created.
+    """
+
+    def __init__(self, directories: List[Path]):
+        """
+        :param directories: directories containing the device nodes of interest
+        """
+        self.directories = set(map(Path, directories))
+
+        self._libc = None
+        self._fd = None
+        # watch descriptor -> (watched directory, whether changes of its files are reported)
+        self._watches: Dict[int, Tuple[Path, bool]] = {}
+        self._changes: Set[str] = set()
+        self._full_scan_required = False
+        self._changed = asyncio.Event()
+
+    def start(self) -> bool:
+        """
+        Starts watching the directories
+        :return: True if inotify is available, False otherwise
+        """
+        libc = _load_libc()
+        if libc is None:
+            return False
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            LOGGER.warning(f"Cannot initialize inotify: {os.strerror(ctypes.get_errno())}")
+            return False
+
+        self._libc = libc
+        self._fd = fd
+        self._watch_directories()
+        asyncio.get_running_loop().add_reader(self._fd, self._on_readable)
+        return True
+
+    def close(self):
+        """
+        Stops watching the directories
+        """
+        if self._fd is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self._watches.clear()
+
+    def add_change(self, path: str):
+        """
+        Reports a change of the given device node, as if it was detected by inotify
+        :param path: path of the device node
+        """
+        self._changes.add(path)
+        self._changed.set()
+
+    async def wait_for_changes(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Waits until device nodes were added, removed or changed
+        :param timeout: maximum time to wait in seconds
+        :return: paths of the changed device nodes, or None if all devices need to be rescanned,
+                 because changes might have been missed or the timeout elapsed
+        """
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        self._changed.clear()
+        changes, self._changes = self._changes, set()
+        if self._full_scan_required:
+            self._full_scan_required = False
+            return None
+        return changes
+
+    def _watch_directories(self) -> bool:
+        """
+        Adds watches for all directories that are not watched yet. Directories that don't exist
+        are replaced by their closest existing parent, to detect their creation.
+        :return: True if a new watch was added for one of the directories
+        """
+        watched = set(map(lambda x: x[0], filter(lambda x: x[1], self._watches.values())))
+        added = False
+        for directory in self.directories - watched:
+            if self._add_watch(directory, True):
+                added = True
+                continue
+
+            parent = directory.parent
+            while parent != parent.parent and not parent.exists():
+                parent = parent.parent
+            self._add_watch(parent, False)
+
+        return added
+
+    def _add_watch(self, directory: Path, report_changes: bool) -> bool:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            return False
+        if wd not in self._watches or report_changes:
+            self._watches[wd] = (directory, report_changes)
+        return True
+
+    def _on_readable(self):
+        """
+        Called by the event loop when inotify events can be read
+        """
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except OSError as ex:
+                LOGGER.exception(ex)
+                break
+            if len(data) <= 0:
+                break
+            self._process_events(data)
+
+        if len(self._changes) > 0 or self._full_scan_required:
+            self._changed.set()
+
+    def _process_events(self, data: bytes):
+        directories_changed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost
+                self._full_scan_required = True
+                continue
+
+            if mask & IN_IGNORED:
+                # the watched directory was removed
+                self._watches.pop(wd, None)
+                directories_changed = True
+                continue
+
+            if mask & IN_ISDIR:
+                directories_changed = True
+                continue
+
+            directory, report_changes = self._watches.get(wd, (None, False))
+            if report_changes and len(name) > 0:
+                self._changes.add(str(directory / name))
+
+        if directories_changed and self._watch_directories():
+            # nodes might have been created before the new directory was watched
+            self._full_scan_required = True
@@ -0,0 +1,503 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import orjson
+from container_app_conf.source.env_source import EnvSource
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.metrics_core import Metric
+from prometheus_client.openmetrics.exposition import generate_latest
+from prometheus_client.openmetrics.parser import text_string_to_metric_families
+from prometheus_client.registry import Collector
+
+from barcode_server.barcode import BarcodeEvent, BarcodeReader
+from barcode_server.config import AppConfig
+from barcode_server.device_registry import DeviceMetadata
+from barcode_server.dispatch import EventDispatcher
+from barcode_server.stats import DELIVERY_PROCESS_RESTARTS
+from barcode_server.util import bind_unix_socket, remove_unix_socket
+
+LOGGER = logging.getLogger(__name__)
+
+# frame header: frame type, payload length
+FRAME_HEADER = struct.Struct(">BI")
+FRAME_EVENT = 1
+FRAME_DEVICES = 2
+FRAME_METRICS = 3
+# header of the payload of a metrics frame: number of the delivery process
+METRICS_HEADER = struct.Struct(">H")
+
+# number of bytes buffered for a delivery process, above which it is disconnected
+WRITE_BUFFER_LIMIT = 16 * 1024 * 1024
+# time between checks for changed devices, in seconds
+DEVICE_SYNC_INTERVAL = 1
+# time between reports of the statistics of a delivery process to the reader process, in seconds
+METRICS_REPORT_INTERVAL = 1
+# time between attempts to connect to the reader process, in seconds
+RECONNECT_INTERVAL = 1
+# time between checks whether all delivery processes are still running, in seconds
+SUPERVISE_INTERVAL = 1
+
+
+def _frame(frame_type: int, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(frame_type, len(payload)) + payload
+
+
+def encode_event_frame(event: BarcodeEvent) -> bytes:
+    """
+    Serializes an event into a frame, so it can be restored by a RemoteBarcodeReader
+    :param event: the event to serialize
+    :return: frame
+    """
+    device = event.input_device
+    info = device.info
+    return _frame(FRAME_EVENT, orjson.dumps({
+        "id": event.id,
+        "seq": event.seq,
+        "timestamp_us": event.timestamp_us,
+        "first_key_time": event.first_key_time,
+        "enter_time": event.enter_time,
+        "device": [device.name, device.path, info.vendor, info.product, device.phys, info.bustype, info.version],
+        "barcode": event.barcode,
+    }))
+
+
+class DeliveryProcessMetrics(Collector):
+    """
+    Collects the statistics of the reader process together with those reported by the delivery processes,
+    so all of them can be exported by the reader process. Every sample is labeled with the process it belongs to.
+    """
+
+    def __init__(self, registry: CollectorRegistry = REGISTRY):
+        """
+        :param registry: registry of the statistics of the reader process
+        """
+        self.registry = registry
+        # connection -> number of the delivery process, its statistics in the OpenMetrics format
+        self._reports: Dict[object, Tuple[int, bytes]] = {}
+
+    def update(self, connection: object, index: int, metrics: bytes):
+        """
+        :param connection: connection of the delivery process
+        :param index: number of the delivery process
+        :param metrics: statistics of the delivery process in the OpenMetrics format
+        """
+        self._reports[connection] = (index, metrics)
+
+    def remove(self, connection: object):
+        """
+        :param connection: connection of a delivery process that disconnected
+        """
+        self._reports.pop(connection, None)
+
+    def collect(self):
+        # called by the exporter thread, the reports are only parsed here to keep the event loop free
+        sources = [("reader", self.registry.collect())]
+        for index, metrics in sorted(list(self._reports.values()), key=lambda x: x[0]):
+            sources.append((str(index), text_string_to_metric_families(metrics.decode())))
+
+        families: Dict[str, Metric] = {}
+        for process, source in sources:
+            for family in source:
+                merged = families.get(family.name, None)
+                if merged is None:
+                    merged = Metric(family.name, family.documentation, family.type, family.unit)
+                    families[family.name] = merged
+                for sample in family.samples:
+                    merged.samples.append(sample._replace(labels={**sample.labels, "process": process}))
+        return families.values()
+
+
+class _PublisherProtocol(asyncio.Protocol):
+
+    def __init__(self, publisher: 'EventPublisher'):
+        self.publisher = publisher
+        self.transport: Optional[asyncio.Transport] = None
+        self._buffer = bytearray()
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.publisher._on_connected(transport)
+
+    def data_received(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= FRAME_HEADER.size:
+            frame_type, length = FRAME_HEADER.unpack_from(self._buffer)
+            end = FRAME_HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            payload = bytes(self._buffer[FRAME_HEADER.size:end])
+            del self._buffer[:end]
+            self.publisher._on_frame(self.transport, frame_type, payload)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.publisher._on_disconnected(self.transport)
+
+
+class EventPublisher:
+    """
+    Streams the events of the barcode reader to the delivery processes connected to a Unix socket.
+    Frames are written to all connections without waiting for them to be sent, so reading
+    barcodes never has to wait for the delivery processes.
+    """
+
+    def __init__(self, barcode_reader: BarcodeReader, path: str, private_directory: bool = False):
+        """
+        :param barcode_reader: the reader to publish the events of
+        :param path: path of the Unix socket to listen on
+        :param private_directory: whether the socket is in a directory created just for it, which is removed on stop
+        """
+        self.barcode_reader = barcode_reader
+        self.path = path
+        self.private_directory = private_directory
+        self.metrics = DeliveryProcessMetrics()
+        self._transports: Set[asyncio.Transport] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._device_sync_task: Optional[asyncio.Task] = None
+        # devices sent to the delivery processes last
+        self._devices_json: Optional[bytes] = None
+        barcode_reader.add_listener(self.publish)
+
+    async def start(self):
+        # only processes of the same user may receive events
+        self._server = await asyncio.get_running_loop().create_unix_server(
+            lambda: _PublisherProtocol(self), sock=bind_unix_socket(self.path, 0o600))
+        self._device_sync_task = asyncio.create_task(self._device_sync_loop())
+        LOGGER.info(f"Publishing events on {self.path}")
+
+    async def stop(self):
+        if self._device_sync_task is not None:
+            self._device_sync_task.cancel()
+            self._device_sync_task = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for transport in list(self._transports):
+            transport.close()
+        self._transports.clear()
+        try:
+            remove_unix_socket(self.path)
+        except FileExistsError as ex:
+            LOGGER.warning(ex)
+        if self.private_directory:
+            shutil.rmtree(Path(self.path).parent, ignore_errors=True)
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._transports)
+
+    async def publish(self, event: BarcodeEvent):
+        """
+        Sends an event to all connected delivery processes
+        :param event: barcode event
+        """
+        if len(self._transports) > 0:
+            self._write(encode_event_frame(event))
+
+    def _on_connected(self, transport: asyncio.Transport):
+        LOGGER.info("Delivery process connected")
+        self._transports.add(transport)
+        transport.write(_frame(FRAME_DEVICES, self.barcode_reader.registry.devices_json()))
+
+    def _on_disconnected(self, transport: asyncio.Transport):
+        LOGGER.info("Delivery process disconnected")
+        self._transports.discard(transport)
+        self.metrics.remove(transport)
+
+    def _on_frame(self, transport: asyncio.Transport, frame_type: int, payload: bytes):
+        if frame_type == FRAME_METRICS:
+            index, = METRICS_HEADER.unpack_from(payload)
+            self.metrics.update(transport, index, payload[METRICS_HEADER.size:])
+        else:
+            LOGGER.warning(f"Ignoring frame of unknown type: {frame_type}")
+
+    def _write(self, frame: bytes):
+        for transport in list(self._transports):
+            if transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                LOGGER.warning("Delivery process is too far behind, disconnecting it")
+                self._transports.discard(transport)
+                transport.abort()
+                continue
+            transport.write(frame)
+
+    async def _device_sync_loop(self):
+        """
+        Periodically sends the matching devices to all delivery processes, if they changed
+        """
+        while True:
+            await asyncio.sleep(DEVICE_SYNC_INTERVAL)
+            devices_json = self.barcode_reader.registry.devices_json()
+            # the registry caches its representation until the devices change
+            if devices_json is not self._devices_json:
+                self._devices_json = devices_json
+                self._write(_frame(FRAME_DEVICES, devices_json))
+
+
+class RemoteDeviceRegistry:
+    """
+    Devices of the reader process, as far as the webserver needs to know about them
+    """
+
+    def __init__(self):
+        self._devices_json = b"[]"
+
+    def devices_json(self) -> bytes:
+        """
+        :return: json array of all matching devices
+        """
+        return self._devices_json
+
+    def update(self, devices_json: bytes):
+        """
+        :param devices_json: json array of all matching devices, as sent by the reader process
+        """
+        self._devices_json = devices_json
+
+
+class RemoteBarcodeReader:
+    """
+    Used in place of the BarcodeReader in delivery processes, receiving the events read by the reader process
+    """
+
+    def __init__(self, path: str, index: Optional[int] = None):
+        """
+        :param path: path of the Unix socket of the reader process
+        :param index: number of the delivery process, to report its statistics to the reader process,
+                      None to not report them
+        """
+        self.path = path
+        self.index = index
+        self.registry = RemoteDeviceRegistry()
+        self.dispatcher = EventDispatcher()
+        # device fields -> metadata, so events of the same device share a single snapshot
+        self._devices: Dict[Tuple, DeviceMetadata] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def listeners(self) -> List[callable]:
+        return self.dispatcher.listeners
+
+    def add_listener(self, listener: callable):
+        """
+        Add a barcode event listener
+        :param listener: async callable taking the barcode event as its only argument
+        """
+        self.dispatcher.add_listener(listener)
+
+    async def start(self):
+        """
+        Start receiving events from the reader process
+        """
+        await self.dispatcher.start()
+        self._task = asyncio.create_task(self._receive_loop())
+
+    async def stop(self):
+        """
+        Stop receiving events from the reader process
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        await self.dispatcher.stop()
+
+    async def _receive_loop(self):
+        """
+        Receives events from the reader process, reconnecting whenever the connection is lost
+        """
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as ex:
+                LOGGER.debug(f"Reader process is not available: {ex}")
+                await asyncio.sleep(RECONNECT_INTERVAL)
+                continue
+
+            LOGGER.info(f"Connected to reader process: {self.path}")
+            report_task = None
+            if self.index is not None:
+                report_task = asyncio.create_task(self._report_metrics(writer))
+            try:
+                await self._receive(reader)
+            except (asyncio.IncompleteReadError, ConnectionError) as ex:
+                LOGGER.warning(f"Lost connection to reader process: {ex}")
+            finally:
+                if report_task is not None:
+                    report_task.cancel()
+                writer.close()
+            await asyncio.sleep(RECONNECT_INTERVAL)
+
+    async def _report_metrics(self, writer: asyncio.StreamWriter):
+        """
+        Periodically sends the statistics of this process to the reader process
+        """
+        while True:
+            writer.write(_frame(FRAME_METRICS, METRICS_HEADER.pack(self.index) + generate_latest(REGISTRY)))
+            await asyncio.sleep(METRICS_REPORT_INTERVAL)
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        while True:
+            frame_type, length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+            payload = await reader.readexactly(length)
+            if frame_type == FRAME_EVENT:
+                await self.dispatcher.dispatch(self._decode_event(payload))
+            elif frame_type == FRAME_DEVICES:
+                self.registry.update(payload)
+            else:
+                LOGGER.warning(f"Ignoring frame of unknown type: {frame_type}")
+
+    def _decode_event(self, payload: bytes) -> BarcodeEvent:
+        """
+        Restores an event serialized using encode_event_frame
+        :param payload: payload of the frame
+        :return: the restored event
+        """
+        item = orjson.loads(payload)
+        key = tuple(item["device"])
+        device = self._devices.get(key, None)
+        if device is None:
+            name, path, vendor, product, phys, bustype, version = key
+            device = DeviceMetadata(name=name, path=path, vendor=vendor, product=product, phys=phys,
+                                    bustype=bustype, version=version)
+            self._devices[key] = device
+
+        event = BarcodeEvent(device, item["barcode"], seq=item["seq"], first_key_time=item["first_key_time"],
+                             enter_time=item["enter_time"])
+        event.timestamp_us = item["timestamp_us"]
+        event.id = item["id"]
+        return event
+
+
+def reader_socket_path(config: AppConfig) -> str:
+    """
+    :param config: app config
+    :return: the configured path of the Unix socket of the reader process, or a path in a new private directory
+    """
+    if config.SERVER_READER_SOCKET.value is not None:
+        return config.SERVER_READER_SOCKET.value
+    # only accessible by the current user, unlike a predictable path in a shared directory
+    return str(Path(tempfile.mkdtemp(prefix="barcode-server-")) / "reader.sock")
+
+
+class DeliveryProcesses:
+    """
+    Runs the delivery processes and restarts them when they exit, so the delivery of events
+    doesn't stop silently while the devices are still being read
+    """
+
+    def __init__(self, socket_path: str, log_level: int, count: int):
+        """
+        :param socket_path: path of the Unix socket of the reader process
+        :param log_level: log level of the delivery processes
+        :param count: number of delivery processes
+        """
+        self.socket_path = socket_path
+        self.log_level = log_level
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * count
+        # spawned instead of forked, so the processes don't inherit the devices, threads or event loop of this one
+        self._context = multiprocessing.get_context("spawn")
+
+    def start(self, config: AppConfig):
+        """
+        Starts all delivery processes
+        :param config: app config
+        """
+        # the instance id defaults to a random value, which has to be the same in all processes
+        os.environ[EnvSource.env_key(config.INSTANCE_ID)] = config.INSTANCE_ID.value
+        for index in range(len(self.processes)):
+            self.processes[index] = self._start_process(index)
+
+    def _start_process(self, index: int) -> multiprocessing.Process:
+        """
+        :param index: number of the delivery process
+        :return: the started process
+        """
+        process = self._context.Process(
+            target=run_delivery_process,
+            # only one process sends events to the HTTP, MQTT and Unix socket targets and records them in the history,
+            # so there are no duplicates
+            args=(index, self.socket_path, self.log_level, index == 0),
+            name=f"barcode-server-delivery-{index}",
+            daemon=True)
+        process.start()
+        return process
+
+    def restart_exited(self) -> int:
+        """
+        Restarts all delivery processes that exited
+        :return: number of restarted processes
+        """
+        restarted = 0
+        for index, process in enumerate(self.processes):
+            if process is None or process.is_alive():
+                continue
+            LOGGER.error(f"Delivery process {index} exited with code {process.exitcode}, restarting it")
+            process.close()
+            self.processes[index] = self._start_process(index)
+            DELIVERY_PROCESS_RESTARTS.inc()
+            restarted += 1
+        return restarted
+
+    async def supervise(self):
+        """
+        Periodically restarts delivery processes that exited
+        """
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            try:
+                self.restart_exited()
+            except Exception as ex:
+                LOGGER.exception(ex)
+
+    def stop(self):
+        """
+        Stops all delivery processes
+        """
+        for process in filter(lambda x: x is not None, self.processes):
+            process.terminate()
+            process.join()
+
+
+def run_delivery_process(index: int, socket_path: str, log_level: int = logging.INFO,
+                         external_notifiers: bool = True):
+    """
+    Entry point of a delivery process, running the webserver and the notifiers on the events of the reader process
+    :param index: number of this delivery process
+    :param socket_path: path of the Unix socket of the reader process
+    :param log_level: log level
+    :param external_notifiers: whether to send events to the HTTP, MQTT and Unix socket targets
+                               and record them in the event history
+    """
+    from barcode_server.stats import configure_latency_buckets
+    from barcode_server.webserver import Webserver
+
+    signal.signal(signal.SIGINT, lambda *args: os._exit(0))
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger("barcode_server").setLevel(log_level)
+
+    config = AppConfig()
+    configure_latency_buckets(config.STATS_LATENCY_BUCKETS.value)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    LOGGER.info(f"Starting delivery process {index}")
+    webserver = Webserver(config, RemoteBarcodeReader(socket_path, index=index), external_notifiers=external_notifiers)
+    loop.create_task(_exit_with_parent())
+    loop.run_until_complete(webserver.start())
+
+
+async def _exit_with_parent():
+    """
+    Exits the current process once the process that started it is gone
+    """
+    parent = multiprocessing.parent_process()
+    while parent is not None and parent.is_alive():
+        await asyncio.sleep(RECONNECT_INTERVAL)
+    os._exit(0)
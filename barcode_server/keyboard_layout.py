@@ -0,0 +1,163 @@
+import logging
+import tomllib
+from pathlib import Path
+from typing import Dict, List
+
+from evdev import ecodes
+
+LOGGER = logging.getLogger(__name__)
+
+# directory containing the layout files shipped with barcode-server
+BUILTIN_LAYOUTS_PATH = Path(__file__).parent / "layouts"
+
+DEFAULT_KEYBOARD_LAYOUT_NAME = "us"
+
+# keycode name -> character, for keys that don't simply end with their character
+KEYCODE_NAME_TO_CHARACTER = {
+    "KEY_DOWN": '\n',
+    "KEY_SPACE": ' ',
+    "KEY_ASTERISK": '*',
+    "KEY_KPASTERISK": '*',
+    "KEY_MINUS": '-',
+    "KEY_KPMINUS": '-',
+    "KEY_PLUS": '+',
+    "KEY_KPPLUS": '+',
+    "KEY_QUESTION": '?',
+    "KEY_COMMA": ',',
+    "KEY_KPCOMMA": ',',
+    "KEY_DOT": '.',
+    "KEY_KPDOT": '.',
+    "KEY_EQUAL": '=',
+    "KEY_KPEQUAL": '=',
+    "KEY_LEFTPAREN": '(',
+    "KEY_KPLEFTPAREN": '(',
+    "KEY_PLUSMINUS": '+-',
+    "KEY_KPPLUSMINUS": '+-',
+    "KEY_RIGHTPAREN": ')',
+    "KEY_KPRIGHTPAREN": ')',
+    "KEY_RIGHTBRACE": ']',
+    "KEY_LEFTBRACE": '[',
+    "KEY_SLASH": '/',
+    "KEY_KPSLASH": '/',
+    "KEY_BACKSLASH": '\\',
+    "KEY_COLON": ';',
+    "KEY_SEMICOLON": ';',
+    "KEY_APOSTROPHE": '\'',
+    "KEY_GRAVE": '`',
+}
+
+
+class KeyboardLayout:
+    """
+    Flat keycode -> character lookup tables of a keyboard layout
+    """
+
+    def __init__(self, name: str, unshifted: Dict[int, str], shifted: Dict[int, str], altgr: Dict[int, str],
+                 unhandled: frozenset):
+        self.name = name
+        self.unshifted = unshifted
+        self.shifted = shifted
+        self.altgr = altgr
+        self.unhandled = unhandled
+
+
+def _keycode_name_to_character(name: str) -> str or None:
+    """
+    Converts the name of a keycode to the (unshifted) character it represents
+    :param name: keycode name, f.ex. "KEY_A"
+    :return: the character or None, if the keycode doesn't represent a character
+    """
+    if len(name) == 5:
+        return name[-1]
+    elif name.startswith("KEY_KP") and len(name) == 7:
+        return name[-1]
+    return KEYCODE_NAME_TO_CHARACTER.get(name, None)
+
+
+def _build_base_tables() -> (Dict[int, str], Dict[int, str], frozenset):
+    """
+    Builds keycode -> character lookup tables for all known keycodes, based on their names
+    :return: tuple of (unshifted table, shifted table, codes without a known character)
+    """
+    unshifted = {}
+    shifted = {}
+    unhandled = set()
+    for code, names in ecodes.KEY.items():
+        if isinstance(names, str):
+            names = [names]
+        characters = list(filter(lambda x: x is not None, map(_keycode_name_to_character, names)))
+        if len(characters) > 0:
+            character = characters[0]
+        else:
+            # unknown keys are passed through by name
+            character = names[0][4:]
+            if len(character) > 1:
+                unhandled.add(code)
+
+        unshifted[code] = character.lower()
+        shifted[code] = character.upper()
+
+    return unshifted, shifted, frozenset(unhandled)
+
+
+_BASE_UNSHIFTED, _BASE_SHIFTED, _BASE_UNHANDLED = _build_base_tables()
+
+
+def find_keyboard_layout_file(name: str, search_paths: List[Path] = None) -> Path:
+    """
+    Finds the file of a keyboard layout
+    :param name: name of the layout
+    :param search_paths: additional directories to search, before the builtin layouts
+    :return: path of the layout file
+    """
+    if search_paths is None:
+        search_paths = []
+
+    for path in search_paths + [BUILTIN_LAYOUTS_PATH]:
+        file = Path(path) / f"{name}.toml"
+        if file.is_file():
+            return file
+
+    raise ValueError(f"Unknown keyboard layout: {name}")
+
+
+def load_keyboard_layout(name: str, search_paths: List[Path] = None) -> KeyboardLayout:
+    """
+    Loads a keyboard layout from its data file and compiles it into flat lookup tables.
+
+    A layout file contains a "keys" table, mapping keycode names to a list of
+    characters produced by the key: [unshifted, shifted, altgr (optional)].
+    Keys not listed in the file produce the character of their keycode name.
+
+    :param name: name of the layout
+    :param search_paths: additional directories to search, before the builtin layouts
+    :return: the compiled layout
+    """
+    file = find_keyboard_layout_file(name, search_paths)
+    with open(file, "rb") as f:
+        data = tomllib.load(f)
+
+    unshifted = dict(_BASE_UNSHIFTED)
+    shifted = dict(_BASE_SHIFTED)
+    altgr = {}
+    unhandled = set(_BASE_UNHANDLED)
+
+    for keycode, characters in data.get("keys", {}).items():
+        if keycode not in ecodes.ecodes:
+            raise ValueError(f"Unknown keycode in keyboard layout {file}: {keycode}")
+        if not isinstance(characters, list) or not 1 <= len(characters) <= 3:
+            raise ValueError(f"Invalid characters for {keycode} in keyboard layout {file}: {characters}")
+
+        code = ecodes.ecodes[keycode]
+        unhandled.discard(code)
+        unshifted[code] = characters[0]
+        if len(characters) > 1:
+            shifted[code] = characters[1]
+        if len(characters) > 2:
+            altgr[code] = characters[2]
+
+    LOGGER.debug(f"Loaded keyboard layout '{name}' from {file}")
+    return KeyboardLayout(name, unshifted, shifted, altgr, frozenset(unhandled))
+
+
+DEFAULT_KEYBOARD_LAYOUT = load_keyboard_layout(DEFAULT_KEYBOARD_LAYOUT_NAME)
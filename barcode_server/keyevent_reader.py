@@ -1,32 +1,15 @@
 import logging
 
-from evdev import KeyEvent, InputDevice, categorize
+from evdev import KeyEvent, InputDevice, ecodes
+
+from barcode_server.keyboard_layout import KeyboardLayout, DEFAULT_KEYBOARD_LAYOUT
+from barcode_server.stats import SCAN_DECODE_ERRORS
 
 LOGGER = logging.getLogger(__name__)
 
-US_EN_UPPER_DICT = {
-    "`": "~",
-    "1": "!",
-    "2": "@",
-    "3": "#",
-    "4": "$",
-    "5": "%",
-    "6": "^",
-    "7": "&",
-    "8": "*",
-    "9": "(",
-    "0": ")",
-    "-": "_",
-    "=": "+",
-    ",": "<",
-    ".": ">",
-    "/": "?",
-    ";": ":",
-    "'": "\"",
-    "\\": "|",
-    "[": "{",
-    "]": "}"
-}
+ENTER_CODES = frozenset([ecodes.KEY_ENTER, ecodes.KEY_KPENTER])
+SHIFT_CODES = frozenset([ecodes.KEY_LEFTSHIFT, ecodes.KEY_RIGHTSHIFT])
+ALT_CODES = frozenset([ecodes.KEY_LEFTALT, ecodes.KEY_RIGHTALT])
 
 
 class KeyEventReader:
@@ -34,13 +17,23 @@ class KeyEventReader:
     Class used to convert a sequence of KeyEvents to text
     """
 
-    def __init__(self):
+    def __init__(self, keyboard_layout: KeyboardLayout = None):
+        """
+        :param keyboard_layout: the keyboard layout the device is configured for, defaults to "us"
+        """
+        self._layout = keyboard_layout if keyboard_layout is not None else DEFAULT_KEYBOARD_LAYOUT
+
         self._shift = False
         self._caps = False
         self._alt = False
+        self._altgr = False
         self._unicode_number_input_buffer = ""
 
         self._line = ""
+        self._first_key_time = None
+        # timestamps of the first key event and the ENTER key event of the last finished line
+        self.line_start_time = None
+        self.line_end_time = None
 
     def read_line(self, input_device: InputDevice) -> str:
         """
@@ -54,41 +47,48 @@ class KeyEventReader:
 
         # async for event in input_device.async_read_loop():
         for event in input_device.read_loop():
-            try:
-                event = categorize(event)
-
-                if hasattr(event, "event"):
-                    if not hasattr(event, "keystate") and hasattr(event.event, "keystate"):
-                        event.keystate = event.event.keystate
-
-                if not hasattr(event, "keystate") or not hasattr(event, "keycode"):
-                    continue
-
-                keycode = event.keycode
-                keystate = event.keystate
-
-                if isinstance(event, KeyEvent):
-                    if self._on_key_event(keycode, keystate):
-                        return self._line
-                elif hasattr(event, "event") and event.event.type == 1:
-                    if self._on_key_event(keycode, keystate):
-                        return self._line
-            except Exception as ex:
-                LOGGER.exception(ex)
-
-    def _on_key_event(self, code: str, state: int) -> bool:
-        if code in ["KEY_ENTER", "KEY_KPENTER"]:
+            line = self.process_event(event)
+            if line is not None:
+                return line
+
+    def process_event(self, event) -> str or None:
+        """
+        Processes a single input event
+        :param event: the raw input event
+        :return: the finished line, if this event completed one, None otherwise
+        """
+        try:
+            if event.type != ecodes.EV_KEY:
+                return None
+
+            if self._first_key_time is None:
+                self._first_key_time = event.timestamp()
+            if self._on_key_event(event.code, event.value):
+                line = self._line
+                self._line = ""
+                self.line_start_time = self._first_key_time
+                self.line_end_time = event.timestamp()
+                self._first_key_time = None
+                return line
+        except Exception as ex:
+            SCAN_DECODE_ERRORS.inc()
+            LOGGER.exception(ex)
+
+        return None
+
+    def _on_key_event(self, code: int, state: int) -> bool:
+        if code in ENTER_CODES:
             if state == KeyEvent.key_up:
                 # line is finished
                 self._reset_modifiers()
                 return True
-        elif code in ["KEY_RIGHTSHIFT", "KEY_LEFTSHIFT"]:
-            if state in [KeyEvent.key_down, KeyEvent.key_hold]:
-                self._shift = True
-            else:
-                self._shift = False
-        elif code in ["KEY_LEFTALT", "KEY_RIGHTALT"]:
-            if state in [KeyEvent.key_down, KeyEvent.key_hold]:
+        elif code in SHIFT_CODES:
+            self._shift = state != KeyEvent.key_up
+        elif code == ecodes.KEY_RIGHTALT and len(self._layout.altgr) > 0:
+            # the layout has a third level, so the right alt key acts as AltGr
+            self._altgr = state != KeyEvent.key_up
+        elif code in ALT_CODES:
+            if state != KeyEvent.key_up:
                 self._alt = True
             else:
                 self._alt = False
@@ -99,81 +99,31 @@ class KeyEventReader:
                 if character is not None:
                     self._line += character
 
-        elif code == "KEY_BACKSPACE":
+        elif code == ecodes.KEY_BACKSPACE:
             self._line = self._line[:-1]
         elif state == KeyEvent.key_down:
             character = self._code_to_character(code)
+            if character is None:
+                SCAN_DECODE_ERRORS.inc()
+                return False
             if self._alt:
                 self._unicode_number_input_buffer += character
             else:
-                if character is not None and not self._alt:
-                    # append the current character
-                    self._line += character
+                # append the current character
+                self._line += character
 
         return False
 
-    def _code_to_character(self, code: str) -> chr or None:
-        character = None
-
-        if len(code) == 5:
-            character = code[-1]
-        elif code.startswith("KEY_KP") and len(code) == 7:
-            character = code[-1]
-
-        elif code in ["KEY_DOWN"]:
-            character = '\n'
-        elif code in ["KEY_SPACE"]:
-            character = ' '
-        elif code in ["KEY_ASTERISK", "KEY_KPASTERISK"]:
-            character = '*'
-        elif code in ["KEY_MINUS", "KEY_KPMINUS"]:
-            character = '-'
-        elif code in ["KEY_PLUS", "KEY_KPPLUS"]:
-            character = '+'
-        elif code in ["KEY_QUESTION"]:
-            character = '?'
-        elif code in ["KEY_COMMA", "KEY_KPCOMMA"]:
-            character = ','
-        elif code in ["KEY_DOT", "KEY_KPDOT"]:
-            character = '.'
-        elif code in ["KEY_EQUAL", "KEY_KPEQUAL"]:
-            character = '='
-        elif code in ["KEY_LEFTPAREN", "KEY_KPLEFTPAREN"]:
-            character = '('
-        elif code in ["KEY_PLUSMINUS", "KEY_KPPLUSMINUS"]:
-            character = '+-'
-        elif code in ["KEY_RIGHTPAREN", "KEY_KPRIGHTPAREN"]:
-            character = ')'
-        elif code in ["KEY_RIGHTBRACE"]:
-            character = ']'
-        elif code in ["KEY_LEFTBRACE"]:
-            character = '['
-        elif code in ["KEY_SLASH", "KEY_KPSLASH"]:
-            character = '/'
-        elif code in ["KEY_BACKSLASH"]:
-            character = '\\'
-        elif code in ["KEY_COLON"]:
-            character = ';'
-        elif code in ["KEY_SEMICOLON"]:
-            character = ';'
-        elif code in ["KEY_APOSTROPHE"]:
-            character = '\''
-        elif code in ["KEY_GRAVE"]:
-            character = '`'
-
-        if character is None:
-            character = code[4:]
-            if len(character) > 1:
-                LOGGER.warning(f"Unhandled Keycode: {code}")
-
-        if self._shift or self._caps:
-            character = character.upper()
-            if character in US_EN_UPPER_DICT.keys():
-                character = US_EN_UPPER_DICT[character]
-        else:
-            character = character.lower()
+    def _code_to_character(self, code: int) -> chr or None:
+        if code in self._layout.unhandled:
+            LOGGER.warning(f"Unhandled Keycode: {ecodes.KEY[code]}")
 
-        return character
+        if self._altgr:
+            return self._layout.altgr.get(code, None)
+        elif self._shift or self._caps:
+            return self._layout.shifted.get(code, None)
+        else:
+            return self._layout.unshifted.get(code, None)
 
     @staticmethod
     def _unicode_numbers_to_character(code: str) -> chr or None:
@@ -188,11 +138,13 @@ class KeyEventReader:
 
             return bytearray.fromhex(s[2:]).decode('utf-8')
         except Exception as ex:
+            SCAN_DECODE_ERRORS.inc()
             LOGGER.exception(ex)
             return None
 
     def _reset_modifiers(self):
         self._alt = False
+        self._altgr = False
         self._unicode_number_input_buffer = ""
         self._shift = False
         self._caps = False
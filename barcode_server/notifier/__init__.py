@@ -1,25 +1,47 @@
 import asyncio
 import logging
+import time
 from asyncio import Task, QueueEmpty
-from datetime import datetime
-from typing import Optional
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional, Deque, Dict, Set
 
 from barcode_server.barcode import BarcodeEvent
 from barcode_server.config import AppConfig
+from barcode_server.notifier.event_queue import EventQueue
+from barcode_server.notifier.retry import RetryPolicy, CircuitBreaker
+from barcode_server.stats import NOTIFIER_RETRIES, NOTIFIER_DROPPED_EVENTS, observe_delivery
 
 LOGGER = logging.getLogger(__name__)
 
+# time to wait for events in flight to be delivered when a notifier is stopped, in seconds
+STOP_TIMEOUT = 5
+
 
 class BarcodeNotifier:
     """
     Base class for a notifier.
     """
 
-    def __init__(self):
+    # type of the notifier, used to label metrics, None to not record them
+    name: str = None
+
+    def __init__(self, event_queue: asyncio.Queue = None, retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None):
+        """
+        :param event_queue: the queue to use for pending events, defaults to a bounded in-memory queue
+        :param retry_policy: the policy for delays between retries, defaults to backing off from retry_interval
+        :param circuit_breaker: the circuit breaker for the notification target
+        """
         self.config = AppConfig()
         self.drop_event_queue_after = self.config.DROP_EVENT_QUEUE_AFTER.value
-        self.retry_interval = self.config.RETRY_INTERVAL.value
-        self.event_queue = asyncio.Queue()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(
+            initial_delay=self.config.RETRY_INTERVAL.value)
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        self.max_in_flight = self.config.MAX_IN_FLIGHT.value
+        self.preserve_device_order = self.config.PRESERVE_DEVICE_ORDER.value
+        self.event_queue = event_queue if event_queue is not None else EventQueue(
+            max_size=self.config.EVENT_QUEUE_MAX_SIZE.value)
         self.processor_task: Optional[Task] = None
 
     def is_running(self) -> bool:
@@ -48,14 +70,21 @@ class BarcodeNotifier:
         running = self.is_running()
         # stop if currently running
         if running:
+            processor_task = self.processor_task
             await self.stop()
+            # events in flight are put back by the processor, so they have to be dropped as well
+            await asyncio.wait([processor_task])
+
+        self._count_dropped(self.event_queue.qsize(), "dropped")
+        if isinstance(self.event_queue, EventQueue):
+            self.event_queue.clear()
 
         # mark all items as finished
         for _ in range(self.event_queue.qsize()):
             try:
                 self.event_queue.get_nowait()
                 self.event_queue.task_done()
-            except QueueEmpty as ex:
+            except QueueEmpty:
                 break
 
         # restart if it was running
@@ -66,32 +95,191 @@ class BarcodeNotifier:
         """
         Processes the event queue
         """
+        if self.max_in_flight > 1:
+            return await self._windowed_event_processor()
+
         while True:
             try:
+                self._drop_expired_events()
                 event = await self.event_queue.get()
+                try:
+                    await self._deliver(event)
+                except asyncio.CancelledError:
+                    self._put_back(deque([[event, False]]))
+                    raise
+                self.event_queue.task_done()
+            except Exception as ex:
+                LOGGER.exception(ex)
+
+    async def _windowed_event_processor(self):
+        """
+        Processes the event queue, sending up to max_in_flight events concurrently.
+        Events are marked as done in the order they were taken from the queue.
+        """
+        window = asyncio.Semaphore(self.max_in_flight)
+        # [event, delivered] items in queue order
+        pending: Deque[list] = deque()
+        # device path -> delivery task of the latest event of this device
+        device_deliveries: Dict[str, Task] = {}
+        deliveries: Set[Task] = set()
 
-                success = False
-                while not success:
-                    if datetime.now() - event.date >= self.drop_event_queue_after:
-                        # event is older than threshold, so we just skip it
-                        self.event_queue.task_done()
-                        break
-
-                    try:
-                        await self._send_event(event)
-                        success = True
-                        self.event_queue.task_done()
-                    except Exception as ex:
-                        LOGGER.exception(ex)
-                        await asyncio.sleep(self.retry_interval.total_seconds())
+        def on_delivered(task: Task, item: list):
+            deliveries.discard(task)
+            window.release()
+            if device_deliveries.get(item[0].input_device.path, None) is task:
+                device_deliveries.pop(item[0].input_device.path)
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                LOGGER.exception(task.exception())
 
+            item[1] = True
+            while len(pending) > 0 and pending[0][1]:
+                pending.popleft()
+                self.event_queue.task_done()
+
+        try:
+            while True:
+                try:
+                    await window.acquire()
+                    self._drop_expired_events()
+                    event = await self.event_queue.get()
+
+                    previous = None
+                    if self.preserve_device_order:
+                        previous = device_deliveries.get(event.input_device.path, None)
+
+                    item = [event, False]
+                    pending.append(item)
+                    task = asyncio.create_task(self._deliver(event, previous))
+                    deliveries.add(task)
+                    if self.preserve_device_order:
+                        device_deliveries[event.input_device.path] = task
+                    task.add_done_callback(lambda t, i=item: on_delivered(t, i))
+                except Exception as ex:
+                    LOGGER.exception(ex)
+        finally:
+            await self._stop_deliveries(deliveries, pending)
+
+    async def _stop_deliveries(self, deliveries: Set[Task], pending: Deque[list]):
+        """
+        Waits for deliveries in flight to finish, cancelling them after a timeout. Events that were
+        not delivered are put back into an in-memory queue, a persistent queue keeps them anyway.
+        :param deliveries: delivery tasks in flight
+        :param pending: [event, delivered] items in queue order, that were not marked as done yet
+        """
+        if len(deliveries) > 0:
+            await asyncio.wait(list(deliveries), timeout=STOP_TIMEOUT)
+        for task in list(deliveries):
+            task.cancel()
+        if len(deliveries) > 0:
+            await asyncio.wait(list(deliveries))
+        self._put_back(pending)
+
+    def _put_back(self, pending: Deque[list]):
+        """
+        Marks all events taken from the queue as done, putting back those that were not delivered
+        into an in-memory queue, a persistent queue keeps them anyway
+        :param pending: [event, delivered] items in queue order, that were not marked as done yet
+        """
+        if not isinstance(self.event_queue, EventQueue):
+            return
+        undelivered = list(map(lambda x: x[0], filter(lambda x: not x[1], pending)))
+        for _ in range(len(pending)):
+            self.event_queue.task_done()
+        pending.clear()
+        for event in undelivered:
+            self.event_queue.put_nowait(event)
+        if len(undelivered) > 0:
+            LOGGER.debug(f"Put back {len(undelivered)} events that were not delivered")
+
+    async def _deliver(self, event: BarcodeEvent, previous: Optional[Task] = None):
+        """
+        Sends the given event, retrying until it succeeds or the event is expired
+        :param event: barcode event
+        :param previous: delivery of an event that has to be completed first
+        """
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        attempt = 0
+        while True:
+            if self._is_expired(event):
+                # event is older than threshold, so we just skip it
+                self._count_dropped(1, "expired")
+                return
+
+            probe = await self.circuit_breaker.acquire()
+            try:
+                await self._send_event(event)
+                self.circuit_breaker.on_success()
+                self._on_delivered(event)
+                return
+            except asyncio.CancelledError:
+                if probe:
+                    self.circuit_breaker.release()
+                raise
             except Exception as ex:
-                LOGGER.exception(ex)
+                self.circuit_breaker.on_failure()
+                self._on_failure(ex, attempt)
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                # events waiting behind this one may expire in the meantime
+                self._drop_expired_events()
+                attempt += 1
+
+    def _on_delivered(self, event: BarcodeEvent):
+        """
+        Records the latency of a delivered event
+        :param event: barcode event
+        """
+        if self.name is not None:
+            observe_delivery(event, self.name)
+
+    def _count_dropped(self, count: int, reason: str):
+        """
+        Counts events dropped without being sent
+        :param count: number of dropped events
+        :param reason: why the events were dropped
+        """
+        if self.name is not None and count > 0:
+            NOTIFIER_DROPPED_EVENTS.labels(type=self.name, reason=reason).inc(count)
+
+    def _on_failure(self, ex: Exception, attempt: int):
+        """
+        Counts and logs a failed attempt, including the stack trace only for the first attempt
+        :param ex: the cause of the failure
+        :param attempt: number of failed attempts before this one
+        """
+        if self.name is not None:
+            NOTIFIER_RETRIES.labels(type=self.name).inc()
+        if attempt <= 0:
+            LOGGER.exception(ex)
+        else:
+            LOGGER.warning(f"Retry {attempt} failed: {ex}")
+
+    def _is_expired(self, event: BarcodeEvent) -> bool:
+        """
+        :param event: barcode event
+        :return: true if the event is too old to be delivered anymore
+        """
+        return time.time_ns() // 1000 - event.timestamp_us >= self.drop_event_queue_after // timedelta(microseconds=1)
+
+    def _drop_expired_events(self):
+        """
+        Drops all expired events from the event queue at once, if the queue supports it
+        """
+        if isinstance(self.event_queue, EventQueue):
+            count = self.event_queue.drop_expired(datetime.now() - self.drop_event_queue_after)
+            self._count_dropped(count, "expired")
 
     async def add_event(self, event: BarcodeEvent):
         """
         Adds an event to the event queue
         """
+        if self.name is not None:
+            if event.enqueue_times is None:
+                event.enqueue_times = {}
+            event.enqueue_times[self.name] = time.time()
         await self.event_queue.put(event)
 
     async def _send_event(self, event: BarcodeEvent):
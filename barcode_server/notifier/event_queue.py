@@ -0,0 +1,280 @@
+import asyncio
+import bisect
+import logging
+import shutil
+import threading
+import time
+import weakref
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, List
+
+from barcode_server.barcode import BarcodeEvent, datetime_to_timestamp_us
+from barcode_server.notifier.persistent_queue import PersistentEventQueue
+from barcode_server.stats import NOTIFIER_QUEUE_DEPTH, NOTIFIER_QUEUE_EVICTIONS, NOTIFIER_QUEUE_OLDEST_EVENT_AGE, \
+    NOTIFIER_QUEUE_EVENT_AGE
+
+LOGGER = logging.getLogger(__name__)
+
+OVERFLOW_POLICY_DROP_OLDEST = "drop-oldest"
+OVERFLOW_POLICY_DROP_NEWEST = "drop-newest"
+OVERFLOW_POLICY_SPILL = "spill"
+OVERFLOW_POLICIES = [OVERFLOW_POLICY_DROP_OLDEST, OVERFLOW_POLICY_DROP_NEWEST, OVERFLOW_POLICY_SPILL]
+
+# quantiles of the age distribution of queued events exported as metrics
+AGE_QUANTILES = [0.5, 0.9, 0.99]
+
+# number of consumed events, after which the list of events may be compacted
+COMPACTION_THRESHOLD = 1024
+
+# notifier type -> all live queues of this type, used to report the age of the oldest event
+_queues_by_name = {}
+# the ages are reported by the thread of the exporter, while queues are created and closed on the event loop
+_queues_lock = threading.Lock()
+
+
+def _event_timestamp(event: BarcodeEvent) -> int:
+    return event.timestamp_us
+
+
+def _event_age(name: str, quantile: float) -> float:
+    """
+    :param name: notifier type
+    :param quantile: quantile of the age distribution, 1 for the oldest event
+    :return: age in seconds of the event at the given quantile, the maximum over all queues of the given notifier type
+    """
+    now = datetime.now()
+    with _queues_lock:
+        queues = list(_queues_by_name.get(name, []))
+    ages = map(lambda x: x.event_ages([quantile], now)[0], queues)
+    return max(ages, default=0)
+
+
+class EventQueue(asyncio.Queue):
+    """
+    In-memory event queue with a maximum length, ordered by the date of the events. When the queue
+    is full, either the oldest or the newest event is dropped, or further events are spilled to disk
+    until the queue caught up.
+
+    Events are kept in a list sorted by date, with the index of the first event that was not
+    taken from the queue yet. Since events are usually added in order of their date, adding is
+    an append, taking an event only moves the index and the list is compacted once most of it
+    was consumed. This allows cutting off all expired events with a single binary search.
+    The list is only changed while holding a lock, so the exporter thread can determine the age of the events.
+    """
+
+    def __init__(self, name: str = None, max_size: int = 0, overflow_policy: str = OVERFLOW_POLICY_DROP_OLDEST,
+                 spill_path: Path = None):
+        """
+        :param name: notifier type, used to export metrics, None to not export them
+        :param max_size: maximum number of events held in memory, 0 for no limit
+        :param overflow_policy: what to do with new events when the queue is full
+        :param spill_path: directory to spill events to, required for the spill policy
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        if overflow_policy == OVERFLOW_POLICY_SPILL and spill_path is None:
+            raise ValueError(f"Overflow policy {overflow_policy} requires a spill path")
+
+        # the limit is enforced by the overflow policy, so put() never blocks
+        super().__init__()
+        self.name = name
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.spill_path = spill_path
+
+        self._spill_queue: Optional[PersistentEventQueue] = None
+        if spill_path is not None and Path(spill_path).exists():
+            # continue with events spilled before a restart
+            self._open_spill_queue()
+
+        if name is not None:
+            with _queues_lock:
+                if name not in _queues_by_name:
+                    _queues_by_name[name] = weakref.WeakSet()
+                    NOTIFIER_QUEUE_OLDEST_EVENT_AGE.labels(type=name).set_function(lambda: _event_age(name, 1))
+                    for quantile in AGE_QUANTILES:
+                        NOTIFIER_QUEUE_EVENT_AGE.labels(type=name, quantile=str(quantile)).set_function(
+                            lambda q=quantile: _event_age(name, q))
+                _queues_by_name[name].add(self)
+
+    def _init(self, maxsize):
+        self._events: List[BarcodeEvent] = []
+        self._head = 0
+        self._lock = threading.Lock()
+
+    def _memory_size(self) -> int:
+        return len(self._events) - self._head
+
+    def _open_spill_queue(self):
+        self._spill_queue = PersistentEventQueue(self.spill_path)
+        if self.name is not None:
+            NOTIFIER_QUEUE_DEPTH.labels(type=self.name).inc(self._spill_queue.qsize())
+
+    def _spilled(self) -> int:
+        return self._spill_queue.qsize() if self._spill_queue is not None else 0
+
+    def qsize(self) -> int:
+        return self._memory_size() + self._spilled()
+
+    def empty(self) -> bool:
+        return self.qsize() <= 0
+
+    def _memory_full(self) -> bool:
+        return 0 < self.max_size <= self._memory_size()
+
+    async def put(self, event: BarcodeEvent):
+        """
+        Adds an event, applying the overflow policy instead of waiting if the queue is full
+        """
+        self.put_nowait(event)
+
+    def put_nowait(self, event: BarcodeEvent):
+        if self._memory_full() and self.overflow_policy != OVERFLOW_POLICY_SPILL:
+            if self.overflow_policy == OVERFLOW_POLICY_DROP_NEWEST:
+                self._evict(event)
+                return
+
+            self._evict(self.get_nowait())
+            self.task_done()
+
+        super().put_nowait(event)
+
+    def _put(self, event: BarcodeEvent):
+        if self.name is not None:
+            NOTIFIER_QUEUE_DEPTH.labels(type=self.name).inc()
+
+        # once events are spilled, all further events are spilled as well, to keep them in order
+        if self._memory_full() or self._spilled() > 0:
+            if self._spill_queue is None:
+                self._open_spill_queue()
+            self._spill_queue.put_nowait(event)
+        else:
+            with self._lock:
+                if self._memory_size() <= 0 or self._events[-1].timestamp_us <= event.timestamp_us:
+                    self._events.append(event)
+                else:
+                    # keep the events sorted by date, f.ex. when restored from disk
+                    bisect.insort_right(self._events, event, lo=self._head, key=_event_timestamp)
+
+    def _get(self) -> BarcodeEvent:
+        if self.name is not None:
+            NOTIFIER_QUEUE_DEPTH.labels(type=self.name).dec()
+
+        if self._memory_size() > 0:
+            with self._lock:
+                event = self._events[self._head]
+                self._events[self._head] = None
+                self._head += 1
+                self._compact()
+            return event
+
+        event = self._spill_queue.get_nowait()
+        # the event is held in memory from now on
+        self._spill_queue.task_done()
+        return event
+
+    def _compact(self):
+        """
+        Removes the consumed events from the start of the list, once most of it was consumed.
+        Requires holding the lock.
+        """
+        if self._head >= COMPACTION_THRESHOLD and self._head * 2 >= len(self._events):
+            del self._events[:self._head]
+            self._head = 0
+
+    def _evict(self, event: BarcodeEvent):
+        LOGGER.debug(f"Queue is full, dropping event: {event.id}")
+        if self.name is not None:
+            NOTIFIER_QUEUE_EVICTIONS.labels(type=self.name).inc()
+
+    def _finish(self, count: int):
+        """
+        Marks the given number of events as done at once, that were removed without being taken from the queue
+        """
+        if count <= 0:
+            return
+        if self.name is not None:
+            NOTIFIER_QUEUE_DEPTH.labels(type=self.name).dec(count)
+        self._unfinished_tasks -= count
+        if self._unfinished_tasks <= 0:
+            self._unfinished_tasks = 0
+            self._finished.set()
+
+    def drop_expired(self, cutoff: datetime) -> int:
+        """
+        Drops all events in memory dated at or before the given date at once
+        :param cutoff: the date up to which events are expired
+        :return: number of dropped events
+        """
+        index = bisect.bisect_right(self._events, datetime_to_timestamp_us(cutoff), lo=self._head,
+                                    key=_event_timestamp)
+        count = index - self._head
+        if count <= 0:
+            return 0
+
+        with self._lock:
+            # the dropped events are released right away, but the list is only compacted once most of it was consumed
+            self._events[self._head:index] = [None] * count
+            self._head = index
+            self._compact()
+        self._finish(count)
+        LOGGER.debug(f"Dropped {count} expired events")
+        return count
+
+    def clear(self):
+        """
+        Drops all events, including spilled ones
+        """
+        count = self.qsize()
+        with self._lock:
+            self._events = []
+            self._head = 0
+        if self._spill_queue is not None:
+            self._spill_queue.close()
+            self._spill_queue = None
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+        self._finish(count)
+
+    def event_ages(self, quantiles: List[float], now: datetime = None) -> List[float]:
+        """
+        Determines the age distribution of the events in memory, without looking at all of them
+        :param quantiles: quantiles to determine, between 0 (newest event) and 1 (oldest event)
+        :param now: the current time
+        :return: age in seconds of the event at each quantile, 0 if there is none
+        """
+        now = datetime_to_timestamp_us(now) if now is not None else time.time_ns() // 1000
+        with self._lock:
+            size = self._memory_size()
+            if size <= 0:
+                return [0] * len(quantiles)
+            last = len(self._events) - 1
+            return list(map(
+                lambda q: (now - self._events[last - round(q * (size - 1))].timestamp_us) / 1000000,
+                quantiles))
+
+    def oldest_event_age(self, now: datetime = None) -> float:
+        """
+        :param now: the current time
+        :return: age in seconds of the oldest event in memory, 0 if there is none
+        """
+        return self.event_ages([1], now)[0]
+
+    def close(self, delete: bool = False):
+        """
+        Closes the spill file of this queue
+        :param delete: whether to delete all spilled events
+        """
+        if self.name is not None:
+            NOTIFIER_QUEUE_DEPTH.labels(type=self.name).dec(self.qsize())
+            with _queues_lock:
+                _queues_by_name[self.name].discard(self)
+        with self._lock:
+            self._events = []
+            self._head = 0
+
+        if self._spill_queue is not None:
+            self._spill_queue.close()
+            self._spill_queue = None
+        if delete and self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
@@ -1,30 +1,182 @@
+import asyncio
 import logging
-from typing import List
+from collections import deque
+from datetime import timedelta
+from typing import List, Optional, Deque
 
 import aiohttp
 from prometheus_async.aio import time
 
 from barcode_server.barcode import BarcodeEvent
 from barcode_server.notifier import BarcodeNotifier
-from barcode_server.stats import HTTP_NOTIFIER_TIME
-from barcode_server.util import barcode_event_to_json
+from barcode_server.notifier.retry import RetryPolicy, CircuitBreaker
+from barcode_server.stats import HTTP_NOTIFIER_TIME, HTTP_NOTIFIER_CONNECTIONS_CREATED, \
+    HTTP_NOTIFIER_CONNECTIONS_REUSED
+from barcode_server.util import barcode_event_to_json, barcode_events_to_json
 
 LOGGER = logging.getLogger(__name__)
 
 
+async def _on_connection_create_end(session, context, params):
+    HTTP_NOTIFIER_CONNECTIONS_CREATED.inc()
+
+
+async def _on_connection_reuseconn(session, context, params):
+    HTTP_NOTIFIER_CONNECTIONS_REUSED.inc()
+
+
+def _create_trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    return trace_config
+
+
 class HttpNotifier(BarcodeNotifier):
+    name = "http"
 
-    def __init__(self, method: str, url: str, headers: List[str]):
-        super().__init__()
+    def __init__(self, method: str, url: str, headers: List[str],
+                 pool_size: int = 10,
+                 keepalive_timeout: timedelta = timedelta(seconds=60),
+                 dns_cache_ttl: timedelta = timedelta(minutes=5),
+                 batch_size: int = 1,
+                 batch_timeout: timedelta = timedelta(milliseconds=100),
+                 event_queue: asyncio.Queue = None,
+                 retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None):
+        super().__init__(event_queue, retry_policy, circuit_breaker)
         self.method = method
         self.url = url
         headers = list(map(lambda x: tuple(x.split(':', 1)), headers))
         self.headers = list(map(lambda x: (x[0].strip(), x[1].strip()), headers))
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        if batch_size > 1:
+            # batches are sent one at a time, a backlog is already sent in large requests
+            self.max_in_flight = 1
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def stop(self):
+        await super().stop()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        :return: the long-lived session of this notifier, keeping connections to the target alive between events
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout.total_seconds(),
+                ttl_dns_cache=int(self.dns_cache_ttl.total_seconds()),
+            )
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[_create_trace_config()])
+        return self._session
+
+    async def event_processor(self):
+        """
+        Processes the event queue, sending multiple events per request if batching is enabled
+        """
+        if self.batch_size <= 1:
+            return await super().event_processor()
+
+        # [event, delivered] items of the current batch, that were not marked as done yet
+        pending: Deque[list] = deque()
+        try:
+            while True:
+                try:
+                    self._drop_expired_events()
+                    await self._next_batch(pending)
+                    await self._deliver_batch(pending)
+                except Exception as ex:
+                    LOGGER.exception(ex)
+        finally:
+            # a batch that was not sent yet is put back like any other event in flight
+            self._put_back(pending)
+
+    async def _next_batch(self, pending: Deque[list]):
+        """
+        Waits for the next event and collects up to batch_size events, waiting at most batch_timeout for them
+        :param pending: [event, delivered] items of the batch, the collected events are appended to
+        """
+        if len(pending) <= 0:
+            pending.append([await self.event_queue.get(), False])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_timeout.total_seconds()
+        while len(pending) < self.batch_size:
+            if not self.event_queue.empty():
+                pending.append([self.event_queue.get_nowait(), False])
+                continue
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                pending.append([await asyncio.wait_for(self.event_queue.get(), remaining), False])
+            except asyncio.TimeoutError:
+                break
+
+    async def _deliver_batch(self, pending: Deque[list]):
+        """
+        Sends a batch of events, retrying until it succeeds or all of its events are expired.
+        A batch is acknowledged or retried as a unit.
+        :param pending: [event, delivered] items of the batch, cleared once all of them are done
+        """
+        attempt = 0
+        while True:
+            expired = list(filter(lambda x: self._is_expired(x[0]), pending))
+            if len(expired) > 0:
+                # events older than threshold are dropped from the batch
+                remaining = list(filter(lambda x: x not in expired, pending))
+                pending.clear()
+                pending.extend(remaining)
+                self._count_dropped(len(expired), "expired")
+                for _ in expired:
+                    self.event_queue.task_done()
+            if len(pending) <= 0:
+                return
+
+            events = list(map(lambda x: x[0], pending))
+            probe = await self.circuit_breaker.acquire()
+            try:
+                await self._send_events(events)
+                self.circuit_breaker.on_success()
+                pending.clear()
+                for event in events:
+                    self._on_delivered(event)
+                    self.event_queue.task_done()
+                return
+            except asyncio.CancelledError:
+                if probe:
+                    self.circuit_breaker.release()
+                raise
+            except Exception as ex:
+                self.circuit_breaker.on_failure()
+                self._on_failure(ex, attempt)
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                # events waiting behind this batch may expire in the meantime
+                self._drop_expired_events()
+                attempt += 1
 
     @time(HTTP_NOTIFIER_TIME)
     async def _send_event(self, event: BarcodeEvent):
         json = barcode_event_to_json(self.config.INSTANCE_ID.value, event)
-        async with aiohttp.ClientSession() as session:
-            async with session.request(self.method, self.url, headers=self.headers, data=json) as resp:
-                resp.raise_for_status()
-            LOGGER.debug(f"Notified {self.url}: {event.barcode}")
+        await self._send(json)
+        LOGGER.debug(f"Notified {self.url}: {event.barcode}")
+
+    @time(HTTP_NOTIFIER_TIME)
+    async def _send_events(self, events: List[BarcodeEvent]):
+        json = barcode_events_to_json(self.config.INSTANCE_ID.value, events)
+        await self._send(json)
+        LOGGER.debug(f"Notified {self.url}: {len(events)} events")
+
+    async def _send(self, data: bytes):
+        session = self._get_session()
+        async with session.request(self.method, self.url, headers=self.headers, data=data) as resp:
+            resp.raise_for_status()
@@ -1,10 +1,13 @@
+import asyncio
 import logging
+from typing import Optional
 
-from aiomqtt import Client
+from aiomqtt import Client, MqttError
 from prometheus_async.aio import time
 
 from barcode_server.barcode import BarcodeEvent
 from barcode_server.notifier import BarcodeNotifier
+from barcode_server.notifier.retry import RetryPolicy, CircuitBreaker
 from barcode_server.stats import MQTT_NOTIFIER_TIME
 from barcode_server.util import barcode_event_to_json
 
@@ -12,13 +15,17 @@ LOGGER = logging.getLogger(__name__)
 
 
 class MQTTNotifier(BarcodeNotifier):
+    name = "mqtt"
 
     def __init__(self, host: str, port: int = 1883,
                  topic: str = "/barcode-server/barcode",
                  client_id: str = "barcode-server",
                  user: str = None, password: str = None,
-                 qos: int = 2, retain: bool = False):
-        super().__init__()
+                 qos: int = 2, retain: bool = False,
+                 event_queue: asyncio.Queue = None,
+                 retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None):
+        super().__init__(event_queue, retry_policy, circuit_breaker)
         self.client_id = client_id
         self.host = host
         self.port = port
@@ -28,11 +35,87 @@ class MQTTNotifier(BarcodeNotifier):
         self.qos = qos
         self.retain = retain
 
+        self._client: Optional[Client] = None
+        self._connection_watcher: Optional[asyncio.Task] = None
+        # concurrent sends share a single client, which must only be connected and disconnected once
+        self._connection_lock = asyncio.Lock()
+
+    async def stop(self):
+        await super().stop()
+        await self._disconnect()
+
+    async def _connect(self) -> Client:
+        """
+        :return: the connected client, connecting to the MQTT server first if necessary.
+                 Failed attempts are retried according to the retry policy of this notifier.
+        """
+        async with self._connection_lock:
+            if self._client is not None:
+                return self._client
+
+            client = Client(hostname=self.host, port=self.port,
+                            username=self.user, password=self.password,
+                            identifier=self.client_id)
+            await client.__aenter__()
+
+            LOGGER.debug(f"Connected to {self.host}:{self.port}")
+            self._client = client
+            self._connection_watcher = asyncio.create_task(self._watch_connection(client))
+            return client
+
+    async def _watch_connection(self, client: Client):
+        """
+        Detects a lost connection, so the next event is sent using a new one
+        :param client: the connected client
+        """
+        try:
+            # the message iterator fails as soon as the connection is lost
+            async for _ in client.messages:
+                pass
+        except MqttError as ex:
+            LOGGER.warning(f"Lost connection to {self.host}:{self.port}: {ex}")
+
+        if self._client is client:
+            self._client = None
+            self._connection_watcher = None
+
+    async def _disconnect(self, client: Client = None):
+        """
+        Disconnects from the MQTT server
+        :param client: only disconnect if this client is still the current one, None to disconnect in any case
+        """
+        async with self._connection_lock:
+            if client is not None and self._client is not client:
+                # another send already started over with a new connection
+                return
+            client, self._client = self._client, None
+            if client is None:
+                return
+
+            watcher, self._connection_watcher = self._connection_watcher, None
+            if watcher is not None:
+                watcher.cancel()
+
+            try:
+                await client.__aexit__(None, None, None)
+            except Exception as ex:
+                LOGGER.debug(f"Error while disconnecting from {self.host}:{self.port}: {ex}")
+
     @time(MQTT_NOTIFIER_TIME)
     async def _send_event(self, event: BarcodeEvent):
         json = barcode_event_to_json(self.config.INSTANCE_ID.value, event)
-        async with Client(hostname=self.host, port=self.port,
-                          username=self.user, password=self.password,
-                          identifier=self.client_id) as client:
-            await client.publish(self.topic, json, self.qos, self.retain)
-            LOGGER.debug(f"Notified {self.host}:{self.port}: {event.barcode}")
+        client = await self._connect()
+        watcher = self._connection_watcher
+        try:
+            publish = asyncio.ensure_future(client.publish(self.topic, json, self.qos, self.retain))
+            # don't wait for the publish timeout if the connection is lost in the meantime
+            await asyncio.wait([publish, watcher], return_when=asyncio.FIRST_COMPLETED)
+            if not publish.done():
+                publish.cancel()
+                raise ConnectionError(f"Lost connection to {self.host}:{self.port}")
+            publish.result()
+        except Exception:
+            # the connection is probably broken, so start over with a fresh one
+            await self._disconnect(client)
+            raise
+        LOGGER.debug(f"Notified {self.host}:{self.port}: {event.barcode}")
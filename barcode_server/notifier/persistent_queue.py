@@ -0,0 +1,418 @@
+import asyncio
+import logging
+import os
+import struct
+import threading
+import zlib
+from asyncio import QueueEmpty
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple, Deque, List
+
+import orjson
+
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.device_registry import DeviceMetadata
+
+LOGGER = logging.getLogger(__name__)
+
+# record header: payload length, crc32 of payload
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE_NAME = "cursor"
+
+
+def encode_event(event: BarcodeEvent) -> bytes:
+    """
+    Serializes an event, so it can be restored using decode_event
+    :param event: the event to serialize
+    :return: serialized event
+    """
+    return orjson.dumps({
+        "id": event.id,
+        "seq": event.seq,
+        "date": event.date.isoformat(),
+        "device": {
+            "name": event.input_device.name,
+            "path": event.input_device.path,
+            "vendor": event.input_device.info.vendor,
+            "product": event.input_device.info.product,
+        },
+        "barcode": event.barcode,
+    })
+
+
+def decode_event(data: bytes) -> BarcodeEvent:
+    """
+    Restores an event serialized using encode_event
+    :param data: serialized event
+    :return: the restored event
+    """
+    item = orjson.loads(data)
+    device = DeviceMetadata(**item["device"])
+    event = BarcodeEvent(device, item["barcode"], datetime.fromisoformat(item["date"]), item.get("seq", None))
+    event.id = item["id"]
+    return event
+
+
+class PersistentEventQueue:
+    """
+    Crash-safe FIFO event queue, backed by a segmented append-only log on disk.
+
+    Events are appended to the current segment file and made durable in the background using group commit:
+    all events added while the previous sync is running are synced to disk together, put() does not wait
+    for it. Without group commit, put() waits until its event was synced on its own. Syncs always run in
+    the default executor, so they never block the event loop. flush() waits until all events added so far
+    are durable. Only events between the read position and the end of the log are on disk, events are never held
+    in memory for longer than a single get() call. The position of the first event that
+    was not yet marked as done using task_done() is persisted in a cursor file, which is
+    used to resume after a restart. Segments that only contain finished events are deleted.
+
+    Implements the subset of the asyncio.Queue interface used by the notifiers.
+    """
+
+    def __init__(self, path: Path, group_commit: bool = True, commit_delay: float = 0,
+                 segment_size: int = 16 * 1024 * 1024):
+        """
+        :param path: directory to store the log in
+        :param group_commit: whether to sync multiple events to disk at once, instead of every event individually
+        :param commit_delay: additional time in seconds to collect events before syncing them to disk
+        :param segment_size: size in bytes after which a new segment file is started
+        """
+        self.path = Path(path)
+        self.group_commit = group_commit
+        self.commit_delay = commit_delay
+        self.segment_size = segment_size
+
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # number of events that were not yet returned by get()
+        self._unread = 0
+        # number of events returned by get(), that were not yet marked as done
+        self._unfinished = 0
+        # end positions of events returned by get(), that were not yet marked as done
+        self._in_flight: Deque[Tuple[int, int]] = deque()
+
+        self._ack_position = (0, 0)
+        self._committed_ack_position = None
+        self._read_position = (0, 0)
+        self._read_file = None
+
+        self._write_segment = 0
+        self._write_file = None
+        self._write_size = 0
+
+        self._getters: Deque[asyncio.Future] = deque()
+        # whether events were appended since the last sync
+        self._dirty = False
+        self._commit_waiters: List[asyncio.Future] = []
+        self._commit_task: Optional[asyncio.Task] = None
+        # a commit running in the background must finish before another one starts or the files are closed
+        self._commit_lock = threading.Lock()
+        self._closed = False
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+        self._recover()
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.path / f"{segment:012d}{SEGMENT_SUFFIX}"
+
+    def _cursor_path(self) -> Path:
+        return self.path / CURSOR_FILE_NAME
+
+    def _segments(self) -> List[int]:
+        return sorted(map(lambda x: int(x.stem), self.path.glob(f"*{SEGMENT_SUFFIX}")))
+
+    def _recover(self):
+        """
+        Restores the state of the queue from disk, truncating a partially written record at the end of the log
+        """
+        segments = self._segments()
+        if len(segments) <= 0:
+            segments = [0]
+
+        cursor = self._read_cursor()
+        if cursor is None or cursor[0] not in segments:
+            cursor = (segments[0], 0)
+
+        # count the events after the cursor
+        count = 0
+        for segment in filter(lambda x: x >= cursor[0], segments):
+            offset = cursor[1] if segment == cursor[0] else 0
+            valid_end, records = self._scan_segment(segment, offset)
+            count += records
+            file = self._segment_path(segment)
+            if file.exists() and file.stat().st_size > valid_end:
+                LOGGER.warning(f"Truncating corrupt tail of {file} at offset {valid_end}")
+                os.truncate(file, valid_end)
+
+        # remove segments before the cursor
+        for segment in filter(lambda x: x < cursor[0], segments):
+            self._segment_path(segment).unlink(missing_ok=True)
+
+        self._unread = count
+        self._ack_position = cursor
+        self._committed_ack_position = cursor
+        self._read_position = cursor
+        self._open_write_segment(segments[-1])
+
+        if count > 0:
+            LOGGER.info(f"Restored {count} queued events from {self.path}")
+
+    def _read_cursor(self) -> Optional[Tuple[int, int]]:
+        try:
+            segment, offset = self._cursor_path().read_text().split()
+            return int(segment), int(offset)
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            LOGGER.exception(ex)
+            return None
+
+    def _scan_segment(self, segment: int, offset: int) -> Tuple[int, int]:
+        """
+        Validates the records of a segment
+        :param segment: segment index
+        :param offset: offset to start at
+        :return: tuple of (end offset of the last valid record, number of valid records)
+        """
+        file = self._segment_path(segment)
+        if not file.exists():
+            return 0, 0
+
+        count = 0
+        with open(file, "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, checksum = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                offset += RECORD_HEADER.size + length
+                count += 1
+        return offset, count
+
+    def _open_write_segment(self, segment: int):
+        if self._write_file is not None:
+            os.fsync(self._write_file.fileno())
+            self._write_file.close()
+        self._write_segment = segment
+        self._write_file = open(self._segment_path(segment), "ab", buffering=0)
+        self._write_size = self._write_file.tell()
+
+    def qsize(self) -> int:
+        return self._unread
+
+    def empty(self) -> bool:
+        return self._unread <= 0
+
+    async def put(self, event: BarcodeEvent):
+        """
+        Appends an event to the log, it is synced to disk in the background together with other events.
+        Without group commit, the event is synced right away and this waits for it.
+        """
+        self.put_nowait(event)
+        if not self.group_commit:
+            await self._sync()
+            return
+        self._schedule_commit()
+
+    async def flush(self):
+        """
+        Waits until all events appended and marked as done so far are durable
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._commit_waiters.append(waiter)
+        self._schedule_commit()
+        await waiter
+
+    def put_nowait(self, event: BarcodeEvent):
+        """
+        Appends an event to the log, without syncing it to disk
+        """
+        payload = encode_event(event)
+        if self._write_size >= self.segment_size:
+            self._open_write_segment(self._write_segment + 1)
+        self._write_file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._write_size += RECORD_HEADER.size + len(payload)
+        self._dirty = True
+
+        self._unread += 1
+        self._finished.clear()
+        while len(self._getters) > 0:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                break
+
+    async def get(self) -> BarcodeEvent:
+        """
+        Removes and returns the oldest event, waiting until one is available
+        """
+        while self.empty():
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            await getter
+        return self.get_nowait()
+
+    def get_nowait(self) -> BarcodeEvent:
+        """
+        Removes and returns the oldest event, raising QueueEmpty if there is none
+        """
+        if self.empty():
+            raise QueueEmpty()
+
+        payload = self._read_next_record()
+        self._unread -= 1
+        self._unfinished += 1
+        self._in_flight.append(self._read_position)
+        return decode_event(payload)
+
+    def _read_next_record(self) -> bytes:
+        segment, offset = self._read_position
+        while True:
+            if self._read_file is None:
+                self._read_file = open(self._segment_path(segment), "rb")
+                self._read_file.seek(offset)
+            header = self._read_file.read(RECORD_HEADER.size)
+            if len(header) == RECORD_HEADER.size:
+                break
+            # end of segment, continue with the next one
+            self._read_file.close()
+            self._read_file = None
+            segment, offset = segment + 1, 0
+
+        length, checksum = RECORD_HEADER.unpack(header)
+        payload = self._read_file.read(length)
+        self._read_position = (segment, offset + RECORD_HEADER.size + length)
+        return payload
+
+    def task_done(self):
+        """
+        Marks the oldest event returned by get() as done
+        """
+        if self._unfinished <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished -= 1
+        self._ack_position = self._in_flight.popleft()
+        if self._unfinished == 0 and self._unread == 0:
+            self._finished.set()
+
+        # losing an acknowledgement only causes the event to be sent again, so it is never waited for
+        self._schedule_commit()
+
+    async def join(self):
+        """
+        Waits until all events have been marked as done
+        """
+        await self._finished.wait()
+
+    def _schedule_commit(self):
+        if self._commit_task is None:
+            self._commit_task = asyncio.create_task(self._group_commit())
+
+    async def _group_commit(self):
+        """
+        Syncs pending changes to disk until there are none left. Events added
+        while a sync is running are synced together in the next round.
+        """
+        try:
+            while self._dirty or len(self._commit_waiters) > 0 or self._ack_position != self._committed_ack_position:
+                await asyncio.sleep(self.commit_delay)
+                if self._closed:
+                    break
+                waiters, self._commit_waiters = self._commit_waiters, []
+                self._dirty = False
+                try:
+                    await self._sync()
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+                except Exception as ex:
+                    LOGGER.exception(ex)
+                    self._dirty = True
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(ex)
+                    break
+        finally:
+            self._commit_task = None
+
+    async def _sync(self):
+        """
+        Commits in the default executor
+        """
+        # the write segment might be rotated while syncing, so sync a duplicate of its descriptor,
+        # which is closed by the worker thread, so it stays valid even if the caller is cancelled
+        fd = os.dup(self._write_file.fileno())
+        # shielded, so the commit always runs and closes the descriptor
+        await asyncio.shield(asyncio.get_running_loop().run_in_executor(None, self._commit_and_close, fd))
+
+    def _commit_and_close(self, fd: int):
+        """
+        Commits using the given file descriptor of the write segment and closes it afterwards
+        """
+        try:
+            self._commit(fd)
+        finally:
+            os.close(fd)
+
+    def _commit(self, fd: int = None):
+        """
+        Syncs the log and the cursor to disk and deletes segments that only contain finished events
+        :param fd: file descriptor of the write segment, defaults to the current one
+        """
+        with self._commit_lock:
+            if self._closed:
+                return
+            self._commit_locked(fd)
+
+    def _commit_locked(self, fd: int = None):
+        """
+        Like _commit, but requires holding the commit lock
+        """
+        os.fsync(fd if fd is not None else self._write_file.fileno())
+
+        ack_position = self._ack_position
+        if ack_position == self._committed_ack_position:
+            return
+
+        cursor = self._cursor_path()
+        temp = cursor.with_suffix(".tmp")
+        with open(temp, "w") as f:
+            f.write(f"{ack_position[0]} {ack_position[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, cursor)
+        self._committed_ack_position = ack_position
+
+        # compaction
+        for segment in self._segments():
+            if segment >= min(ack_position[0], self._write_segment):
+                break
+            self._segment_path(segment).unlink(missing_ok=True)
+
+    def close(self):
+        """
+        Syncs all pending changes to disk and closes all files
+        """
+        if self._commit_task is not None:
+            self._commit_task.cancel()
+            self._commit_task = None
+        # waits for a commit still running in the background, before committing and closing the files
+        with self._commit_lock:
+            self._commit_locked()
+            self._closed = True
+        for waiter in self._commit_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._commit_waiters.clear()
+        if self._read_file is not None:
+            self._read_file.close()
+            self._read_file = None
+        self._write_file.close()
@@ -0,0 +1,61 @@
+import bisect
+import itertools
+import logging
+from collections import deque
+from typing import List, Optional, Deque
+
+from barcode_server.barcode import BarcodeEvent
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _event_seq(event: BarcodeEvent) -> int:
+    return event.seq
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of the most recent events, shared by all websocket clients, so reconnecting clients
+    can resume after the last event they received, without keeping a copy of all events per client.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: maximum number of events to keep, the oldest events are dropped first
+        """
+        self._events: Deque[BarcodeEvent] = deque(maxlen=capacity)
+        # sequence number of the newest event dropped from the buffer, None if none was dropped yet
+        self._evicted_seq: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def append(self, event: BarcodeEvent):
+        """
+        Adds an event, which must have a higher sequence number than all events added before
+        """
+        if self._events.maxlen <= 0:
+            self._evicted_seq = event.seq
+            return
+        if len(self._events) >= self._events.maxlen:
+            self._evicted_seq = self._events[0].seq
+        self._events.append(event)
+
+    @property
+    def oldest_seq(self) -> Optional[int]:
+        """
+        :return: sequence number of the oldest event still available, None if there is none
+        """
+        return self._events[0].seq if len(self._events) > 0 else None
+
+    def since(self, seq: int) -> List[BarcodeEvent]:
+        """
+        :param seq: sequence number of the last event a client received
+        :return: all available events following the given one, in order
+        """
+        index = bisect.bisect_right(self._events, seq, key=_event_seq)
+        # sequence numbers are not contiguous, f.ex. they start over after a restart,
+        # so only events that were actually dropped from the buffer are missed
+        if self._evicted_seq is not None and self._evicted_seq > seq:
+            LOGGER.warning(f"Events after {seq} are not available anymore, resuming from {self.oldest_seq}")
+        return list(itertools.islice(self._events, index, None))
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import random
+from datetime import timedelta
+
+from barcode_server.stats import NOTIFIER_CIRCUIT_BREAKER_STATE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter, used to determine the delay between retries
+    """
+
+    def __init__(self, initial_delay: timedelta = timedelta(seconds=2), max_delay: timedelta = timedelta(minutes=5),
+                 multiplier: float = 2, jitter: float = 0.2):
+        """
+        :param initial_delay: delay after the first failed attempt
+        :param max_delay: upper bound of the delay
+        :param multiplier: factor the delay grows by with every failed attempt
+        :param jitter: fraction of the delay that is randomized, to spread out retries of multiple notifiers
+        """
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, attempt: int) -> float:
+        """
+        :param attempt: number of failed attempts so far, minus one
+        :return: the time in seconds to wait before the next attempt
+        """
+        max_delay = self.max_delay.total_seconds()
+        try:
+            delay = min(self.initial_delay.total_seconds() * self.multiplier ** attempt, max_delay)
+        except OverflowError:
+            delay = max_delay
+        return delay * (1 - self.jitter * random.random())
+
+
+class CircuitBreaker:
+    """
+    Stops sending to a failing target for some time, after which a single probe is
+    allowed through. All other attempts wait until the probe succeeded.
+    """
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, name: str = None, failure_threshold: int = 5, reset_timeout: timedelta = timedelta(seconds=30)):
+        """
+        :param name: name of the notifier, used to export the state, None to not export it
+        :param failure_threshold: number of consecutive failures after which the breaker opens, 0 to disable
+        :param reset_timeout: time to wait before probing the target again
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probe_finished = asyncio.Event()
+        self._set_state(self.CLOSED)
+
+    def _set_state(self, state: int):
+        self.state = state
+        if self.name is not None:
+            NOTIFIER_CIRCUIT_BREAKER_STATE.labels(type=self.name).set(state)
+
+    async def acquire(self) -> bool:
+        """
+        Waits until an attempt to send to the target is allowed
+        :return: True if the attempt probes the target, False otherwise
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.state == self.CLOSED:
+                return False
+            elif self.state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout.total_seconds() - loop.time()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                    continue
+                # this attempt probes the target
+                self._probe_finished.clear()
+                self._set_state(self.HALF_OPEN)
+                return True
+            else:
+                await self._probe_finished.wait()
+
+    def on_success(self):
+        """
+        Records a successful attempt
+        """
+        self._failures = 0
+        if self.state != self.CLOSED:
+            LOGGER.info(f"Circuit breaker of {self.name} notifier closed")
+            self._set_state(self.CLOSED)
+            self._probe_finished.set()
+
+    def release(self):
+        """
+        Records a probe that was abandoned before it finished, so another attempt can probe the target
+        """
+        if self.state == self.HALF_OPEN:
+            # keep the original opening time, the next attempt may probe right away
+            self._set_state(self.OPEN)
+            self._probe_finished.set()
+
+    def on_failure(self):
+        """
+        Records a failed attempt
+        """
+        self._failures += 1
+        if self.failure_threshold <= 0:
+            return
+
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+            if self.state == self.CLOSED:
+                LOGGER.warning(
+                    f"Circuit breaker of {self.name} notifier opened after {self._failures} failures, "
+                    f"pausing for {self.reset_timeout}")
+            self._opened_at = asyncio.get_running_loop().time()
+            self._set_state(self.OPEN)
+            self._probe_finished.set()
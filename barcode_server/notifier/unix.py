@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import struct
+from typing import Optional, Set
+
+from prometheus_async.aio import time
+
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.notifier import BarcodeNotifier
+from barcode_server.notifier.retry import RetryPolicy, CircuitBreaker
+from barcode_server.stats import UNIX_SOCKET_NOTIFIER_TIME, UNIX_SOCKET_SUBSCRIBER_COUNT, observe_delivery
+from barcode_server.util import barcode_event_to_json, bind_unix_socket, remove_unix_socket
+
+LOGGER = logging.getLogger(__name__)
+
+FORMAT_UNIX_SOCKET_FRAME = "unix-socket-frame"
+
+# frame header: length of the json payload
+FRAME_HEADER = struct.Struct(">I")
+
+# number of bytes buffered for a subscriber, above which it is disconnected
+WRITE_BUFFER_LIMIT = 1024 * 1024
+
+
+def barcode_event_to_unix_socket_frame(server_id: str, event: BarcodeEvent) -> bytes:
+    """
+    Converts a barcode event to a frame, containing the length of its json representation followed by the json.
+    The result is cached on the event, so it is only computed once.
+    :param server_id: server instance id
+    :param event: the event to convert
+    :return: frame
+    """
+    key = (FORMAT_UNIX_SOCKET_FRAME, server_id)
+    if event.payloads is None:
+        event.payloads = {}
+    frame = event.payloads.get(key, None)
+    if frame is None:
+        payload = barcode_event_to_json(server_id, event)
+        frame = FRAME_HEADER.pack(len(payload)) + payload
+        event.payloads[key] = frame
+    return frame
+
+
+class _SubscriberProtocol(asyncio.Protocol):
+
+    def __init__(self, notifier: 'UnixSocketNotifier'):
+        self.notifier = notifier
+        self.transport: Optional[asyncio.Transport] = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.notifier._on_connected(transport)
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.notifier._on_disconnected(self.transport)
+
+
+class UnixSocketNotifier(BarcodeNotifier):
+    """
+    Streams events to all local processes connected to a Unix domain socket. Every event is sent as
+    a 4 byte big endian length, followed by the json representation of the event. Access is controlled
+    by the permissions of the socket file, instead of an api token.
+
+    Events are written to all subscribers at once, without waiting for them to be sent, right when they are
+    added. Only while no subscriber is connected, events are kept in the queue and retried like for any other
+    notification target.
+    """
+    name = "unix"
+
+    def __init__(self, path: str, mode: int = 0o660,
+                 event_queue: asyncio.Queue = None,
+                 retry_policy: RetryPolicy = None,
+                 circuit_breaker: CircuitBreaker = None):
+        """
+        :param path: path of the socket file
+        :param mode: permissions of the socket file, processes need write permission to connect
+        """
+        super().__init__(event_queue, retry_policy, circuit_breaker)
+        self.path = path
+        self.mode = mode
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._transports: Set[asyncio.Transport] = set()
+        # all subscribers share a single stream of events, so there is no point in sending concurrently
+        self.max_in_flight = 1
+        self._delivering = False
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._transports)
+
+    async def start(self):
+        if self._server is None:
+            self._server = await asyncio.get_running_loop().create_unix_server(
+                lambda: _SubscriberProtocol(self), sock=bind_unix_socket(self.path, self.mode))
+            LOGGER.info(f"Listening for subscribers on {self.path}")
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        if self._server is None:
+            return
+        self._server.close()
+        self._server = None
+        for transport in list(self._transports):
+            transport.close()
+        self._transports.clear()
+        UNIX_SOCKET_SUBSCRIBER_COUNT.set(0)
+        try:
+            remove_unix_socket(self.path)
+        except FileExistsError as ex:
+            LOGGER.warning(ex)
+
+    def _on_connected(self, transport: asyncio.Transport):
+        LOGGER.debug(f"Subscriber connected to {self.path}")
+        self._transports.add(transport)
+        UNIX_SOCKET_SUBSCRIBER_COUNT.set(len(self._transports))
+
+    def _on_disconnected(self, transport: asyncio.Transport):
+        LOGGER.debug(f"Subscriber disconnected from {self.path}")
+        self._transports.discard(transport)
+        UNIX_SOCKET_SUBSCRIBER_COUNT.set(len(self._transports))
+
+    async def add_event(self, event: BarcodeEvent):
+        if self._delivering or not self.event_queue.empty():
+            # queued events must not be overtaken
+            await super().add_event(event)
+        elif self._write(event) > 0:
+            observe_delivery(event, self.name, direct=True)
+        else:
+            await super().add_event(event)
+
+    async def _deliver(self, event: BarcodeEvent, previous: Optional[asyncio.Task] = None):
+        self._delivering = True
+        try:
+            await super()._deliver(event, previous)
+        finally:
+            self._delivering = False
+
+    @time(UNIX_SOCKET_NOTIFIER_TIME)
+    async def _send_event(self, event: BarcodeEvent):
+        if self._write(event) <= 0:
+            raise ConnectionError(f"No subscriber connected to {self.path}")
+
+    def _write(self, event: BarcodeEvent) -> int:
+        """
+        Writes an event to all subscribers
+        :param event: barcode event
+        :return: number of subscribers the event was written to
+        """
+        frame = barcode_event_to_unix_socket_frame(self.config.INSTANCE_ID.value, event)
+        delivered = 0
+        for transport in list(self._transports):
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                LOGGER.warning(f"Subscriber of {self.path} is too far behind, disconnecting it")
+                transport.abort()
+                continue
+            transport.write(frame)
+            delivered += 1
+        return delivered
@@ -1,16 +1,85 @@
+import asyncio
+import logging
+import struct
+from typing import Optional, Set
+
 from prometheus_async.aio import time
 
 from barcode_server.barcode import BarcodeEvent
 from barcode_server.notifier import BarcodeNotifier
-from barcode_server.stats import WEBSOCKET_NOTIFIER_TIME
+from barcode_server.stats import WEBSOCKET_NOTIFIER_TIME, WEBSOCKET_BROADCAST_DELIVERIES_DIRECT, \
+    WEBSOCKET_BROADCAST_DELIVERIES_QUEUED, observe_delivery
 from barcode_server.util import barcode_event_to_json
 
+LOGGER = logging.getLogger(__name__)
+
+FORMAT_WEBSOCKET_FRAME = "websocket-frame"
+
+# number of bytes buffered for a client, above which it is considered to be behind
+WRITE_BUFFER_HIGH_WATERMARK = 64 * 1024
+
+
+def barcode_event_to_websocket_frame(server_id: str, event: BarcodeEvent) -> bytes:
+    """
+    Converts a barcode event to a complete websocket frame, containing its json representation
+    as a binary message. The result is cached on the event, so it is only computed once.
+    :param server_id: server instance id
+    :param event: the event to convert
+    :return: websocket frame
+    """
+    key = (FORMAT_WEBSOCKET_FRAME, server_id)
+    if event.payloads is None:
+        event.payloads = {}
+    frame = event.payloads.get(key, None)
+    if frame is None:
+        payload = barcode_event_to_json(server_id, event)
+        length = len(payload)
+        # FIN + binary opcode, frames sent by a server are not masked
+        if length < 126:
+            header = struct.pack("!BB", 0x82, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x82, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x82, 127, length)
+        frame = header + payload
+        event.payloads[key] = frame
+    return frame
+
 
 class WebsocketNotifier(BarcodeNotifier):
+    name = "websocket"
 
-    def __init__(self, websocket):
-        super().__init__()
+    def __init__(self, websocket, transport: Optional[asyncio.Transport] = None, event_queue: asyncio.Queue = None):
+        """
+        :param websocket: the websocket of the client
+        :param transport: the transport of the websocket, used to write broadcast frames to directly
+        :param event_queue: the queue to use for events, while the client is behind or disconnected
+        """
+        super().__init__(event_queue)
         self.websocket = websocket
+        self.transport = transport
+        # messages are written to a single connection, so there is no point in sending concurrently
+        self.max_in_flight = 1
+        self._delivering = False
+
+    def is_caught_up(self) -> bool:
+        """
+        :return: True if new events can be written to the client right away, without
+                 overtaking queued events or piling up in the write buffer
+        """
+        return not self._delivering \
+            and self.event_queue.empty() \
+            and self.transport is not None \
+            and not self.transport.is_closing() \
+            and not self.websocket.closed \
+            and self.transport.get_write_buffer_size() < WRITE_BUFFER_HIGH_WATERMARK
+
+    async def _deliver(self, event: BarcodeEvent, previous: Optional[asyncio.Task] = None):
+        self._delivering = True
+        try:
+            await super()._deliver(event, previous)
+        finally:
+            self._delivering = False
 
     @time(WEBSOCKET_NOTIFIER_TIME)
     async def _send_event(self, event: BarcodeEvent):
@@ -21,3 +90,58 @@ class WebsocketNotifier(BarcodeNotifier):
         #  to an unique identifier anymore, maybe we need to store one manually
         #  when the websocket is connected initially...
         # LOGGER.debug(f"Notified {client.remote_address}")
+
+
+class WebsocketBroadcaster:
+    """
+    Sends events to all connected websocket clients. A single pre-framed message is written
+    to the sockets of all clients that are caught up in one pass, only clients that are behind
+    fall back to the event queue of their notifier.
+    """
+
+    def __init__(self, server_id: str):
+        """
+        :param server_id: server instance id
+        """
+        self.server_id = server_id
+        self.notifiers: Set[WebsocketNotifier] = set()
+
+    def add(self, notifier: WebsocketNotifier):
+        """
+        Adds the notifier of a connected client
+        """
+        self.notifiers.add(notifier)
+
+    def remove(self, notifier: WebsocketNotifier):
+        """
+        Removes the notifier of a disconnected client
+        """
+        self.notifiers.discard(notifier)
+
+    def __contains__(self, notifier) -> bool:
+        return notifier in self.notifiers
+
+    async def broadcast(self, event: BarcodeEvent):
+        """
+        Sends an event to all connected clients
+        :param event: barcode event
+        """
+        frame = None
+        behind = []
+        for notifier in self.notifiers:
+            if not notifier.is_caught_up():
+                behind.append(notifier)
+                continue
+
+            if frame is None:
+                frame = barcode_event_to_websocket_frame(self.server_id, event)
+            notifier.transport.write(frame)
+
+        direct = len(self.notifiers) - len(behind)
+        WEBSOCKET_BROADCAST_DELIVERIES_DIRECT.inc(direct)
+        WEBSOCKET_BROADCAST_DELIVERIES_QUEUED.inc(len(behind))
+        if direct > 0:
+            # written to all clients at once, so the latency is only recorded once per broadcast
+            observe_delivery(event, WebsocketNotifier.name, direct=True)
+        for notifier in behind:
+            await notifier.add_event(event)
@@ -1,7 +1,14 @@
-from prometheus_client import Gauge, Summary
+import time
+from typing import List, Dict, Tuple, Optional
+
+from prometheus_client import Gauge, Summary, Counter, Histogram, REGISTRY
 
 from barcode_server.const import *
 
+LATENCY_STAGE_ENQUEUE = "enqueue"
+LATENCY_STAGE_QUEUE = "queue"
+LATENCY_STAGE_END_TO_END = "end_to_end"
+
 WEBSOCKET_CLIENT_COUNT = Gauge(
     'websocket_client_count',
     'Number of currently connected websocket clients'
@@ -12,17 +19,199 @@ DEVICES_COUNT = Gauge(
     'Number of currently detected devices'
 )
 
-SCAN_COUNT = Gauge(
+SCAN_COUNT = Counter(
     'scan_count',
     'Number of times a scan has been detected'
 )
 
+SCAN_DECODE_ERRORS = Counter(
+    'scan_decode_errors',
+    'Number of key events that could not be decoded'
+)
+
 DEVICE_DETECTION_TIME = Summary('device_detection_processing_seconds', 'Time spent detecting devices')
 
+DISPATCH_QUEUE_DEPTH = Gauge(
+    'dispatch_queue_depth',
+    'Number of scanned events waiting to be handed to the listeners'
+)
+
+DISPATCH_QUEUE_TIME = Summary('dispatch_queue_seconds', 'Time scanned events spent waiting to be dispatched')
+
+DISPATCH_LISTENER_TIME = Summary(
+    'dispatch_listener_processing_seconds',
+    'Time spent handing a scanned event to a listener',
+    ['listener']
+)
+
+DISPATCH_LISTENER_ERRORS = Counter(
+    'dispatch_listener_errors',
+    'Number of errors raised by a listener while handing a scanned event to it',
+    ['listener']
+)
+
 REST_TIME = Summary('rest_endpoint_processing_seconds', 'Time spent in a rest command handler', ['endpoint'])
 REST_TIME_DEVICES = REST_TIME.labels(endpoint=ENDPOINT_DEVICES)
+REST_TIME_EVENTS = REST_TIME.labels(endpoint=ENDPOINT_EVENTS)
 
 NOTIFIER_TIME = Summary('notifier_processing_seconds', 'Time spent in a notifier', ['type'])
 WEBSOCKET_NOTIFIER_TIME = NOTIFIER_TIME.labels(type='websocket')
 HTTP_NOTIFIER_TIME = NOTIFIER_TIME.labels(type='http')
 MQTT_NOTIFIER_TIME = NOTIFIER_TIME.labels(type='mqtt')
+UNIX_SOCKET_NOTIFIER_TIME = NOTIFIER_TIME.labels(type='unix')
+
+UNIX_SOCKET_SUBSCRIBER_COUNT = Gauge(
+    'unix_socket_subscriber_count',
+    'Number of processes connected to the Unix socket'
+)
+
+DELIVERY_PROCESS_RESTARTS = Counter(
+    'delivery_process_restarts',
+    'Number of delivery processes that were restarted, because they exited'
+)
+
+HISTORY_INSERT_TIME = Summary('history_insert_seconds', 'Time spent inserting a batch of events into the history')
+HISTORY_PENDING_EVENTS = Gauge('history_pending_events', 'Number of events waiting to be inserted into the history')
+HISTORY_DELETED_EVENTS = Counter('history_deleted_events', 'Events deleted from the history by the retention policy')
+HISTORY_DROPPED_EVENTS = Counter(
+    'history_dropped_events',
+    'Events dropped, because they could not be inserted into the history'
+)
+
+WEBSOCKET_BROADCAST_DELIVERIES = Counter(
+    'websocket_broadcast_deliveries',
+    'Number of events sent to websocket clients, either written directly or queued for clients that are behind',
+    ['mode']
+)
+WEBSOCKET_BROADCAST_DELIVERIES_DIRECT = WEBSOCKET_BROADCAST_DELIVERIES.labels(mode='direct')
+WEBSOCKET_BROADCAST_DELIVERIES_QUEUED = WEBSOCKET_BROADCAST_DELIVERIES.labels(mode='queued')
+
+HTTP_NOTIFIER_CONNECTIONS = Counter(
+    'http_notifier_connections',
+    'Number of connections used by the http notifier',
+    ['state']
+)
+HTTP_NOTIFIER_CONNECTIONS_CREATED = HTTP_NOTIFIER_CONNECTIONS.labels(state='created')
+HTTP_NOTIFIER_CONNECTIONS_REUSED = HTTP_NOTIFIER_CONNECTIONS.labels(state='reused')
+
+NOTIFIER_CIRCUIT_BREAKER_STATE = Gauge(
+    'notifier_circuit_breaker_state',
+    'State of the circuit breaker of a notifier (0: closed, 1: open, 2: half-open)',
+    ['type']
+)
+
+NOTIFIER_QUEUE_DEPTH = Gauge(
+    'notifier_queue_depth',
+    'Number of events waiting to be sent by a notifier',
+    ['type']
+)
+
+NOTIFIER_QUEUE_EVICTIONS = Counter(
+    'notifier_queue_evictions',
+    'Number of events dropped, because the queue of a notifier was full',
+    ['type']
+)
+
+NOTIFIER_QUEUE_OLDEST_EVENT_AGE = Gauge(
+    'notifier_queue_oldest_event_age_seconds',
+    'Age of the oldest event waiting to be sent by a notifier',
+    ['type']
+)
+
+NOTIFIER_QUEUE_EVENT_AGE = Gauge(
+    'notifier_queue_event_age_seconds',
+    'Age distribution of the events waiting to be sent by a notifier',
+    ['type', 'quantile']
+)
+
+WEBSOCKET_CLIENT_EVICTIONS = Counter(
+    'websocket_client_evictions',
+    'Number of websocket client notifiers removed, because the client has been idle for too long'
+)
+
+NOTIFIER_RETRIES = Counter(
+    'notifier_retries',
+    'Number of failed attempts to send events, which are retried',
+    ['type']
+)
+
+NOTIFIER_DROPPED_EVENTS = Counter(
+    'notifier_dropped_events',
+    'Number of events dropped by a notifier without being sent, because they expired or the queue was dropped',
+    ['type', 'reason']
+)
+
+# the buckets of the latency histograms are configurable, so they are (re)created by configure_latency_buckets
+SCAN_INPUT_DURATION: Optional[Histogram] = None
+SCAN_LATENCY: Optional[Histogram] = None
+# (device, notifier) -> children of SCAN_LATENCY for each stage
+_scan_latency_children: Dict[Tuple[str, str], Tuple] = {}
+
+
+def configure_latency_buckets(buckets: List[float]):
+    """
+    (Re)creates the latency histograms using the given buckets
+    :param buckets: upper bounds of the buckets in seconds
+    """
+    global SCAN_INPUT_DURATION, SCAN_LATENCY
+    if SCAN_INPUT_DURATION is not None:
+        REGISTRY.unregister(SCAN_INPUT_DURATION)
+        REGISTRY.unregister(SCAN_LATENCY)
+    _scan_latency_children.clear()
+
+    SCAN_INPUT_DURATION = Histogram(
+        'scan_input_duration_seconds',
+        'Time from the first key of a barcode to the ENTER key',
+        ['device'],
+        buckets=buckets
+    )
+    SCAN_LATENCY = Histogram(
+        'scan_latency_seconds',
+        'Time a barcode event spent in a stage of the delivery to a notifier: '
+        'from the ENTER key to the queue of the notifier (enqueue), in the queue until delivered (queue) '
+        'and from the first key until delivered (end_to_end)',
+        ['device', 'notifier', 'stage'],
+        buckets=buckets
+    )
+
+
+configure_latency_buckets(DEFAULT_LATENCY_BUCKETS)
+
+
+def observe_scan(event):
+    """
+    Records the input duration of a scanned barcode
+    :param event: the barcode event
+    """
+    if event.first_key_time is not None and event.enter_time is not None:
+        SCAN_INPUT_DURATION.labels(device=event.input_device.name).observe(event.enter_time - event.first_key_time)
+
+
+def observe_delivery(event, notifier: str, direct: bool = False):
+    """
+    Records the latency of each stage of a barcode event, which was just delivered
+    :param event: the barcode event
+    :param notifier: type of the notifier that delivered the event
+    :param direct: whether the event was delivered right away, without being queued
+    """
+    delivered = time.time()
+
+    key = (event.input_device.name, notifier)
+    children = _scan_latency_children.get(key, None)
+    if children is None:
+        children = tuple(map(
+            lambda x: SCAN_LATENCY.labels(device=key[0], notifier=notifier, stage=x),
+            [LATENCY_STAGE_ENQUEUE, LATENCY_STAGE_QUEUE, LATENCY_STAGE_END_TO_END]))
+        _scan_latency_children[key] = children
+    enqueue, queue, end_to_end = children
+
+    if direct:
+        enqueued = delivered
+    else:
+        enqueued = event.enqueue_times.get(notifier, None) if event.enqueue_times is not None else None
+    if enqueued is not None:
+        if event.enter_time is not None:
+            enqueue.observe(enqueued - event.enter_time)
+        queue.observe(delivered - enqueued)
+    if event.first_key_time is not None:
+        end_to_end.observe(delivered - event.first_key_time)
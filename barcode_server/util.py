@@ -1,6 +1,14 @@
+import os
+import socket
+import stat
+from typing import List
+
 from evdev import InputDevice
 
 from barcode_server.barcode import BarcodeEvent
+from barcode_server.device_registry import DeviceMetadata
+
+FORMAT_JSON = "json"
 
 
 def input_device_to_dict(input_device: InputDevice) -> dict:
@@ -9,6 +17,10 @@ def input_device_to_dict(input_device: InputDevice) -> dict:
     :param input_device: the device to convert
     :return: dictionary
     """
+    if isinstance(input_device, DeviceMetadata) and input_device.dict is not None:
+        # precomputed when the device was detected
+        return input_device.dict
+
     return {
         "name": input_device.name,
         "path": input_device.path,
@@ -17,22 +29,84 @@ def input_device_to_dict(input_device: InputDevice) -> dict:
     }
 
 
-def barcode_event_to_json(server_id: str, event: BarcodeEvent) -> bytes:
+def barcode_event_to_dict(server_id: str, event: BarcodeEvent) -> dict:
     """
-    Converts a barcode event to json
+    Converts a barcode event to a dictionary
     :param server_id: server instance id
     :param event: the event to convert
-    :return: json representation
+    :return: dictionary
     """
-    import orjson
-
-    event = {
+    return {
         "id": event.id,
+        "seq": event.seq,
         "serverId": server_id,
         "date": event.date.isoformat(),
         "device": input_device_to_dict(event.input_device),
         "barcode": event.barcode
     }
 
-    json = orjson.dumps(event)
+
+def barcode_event_to_json(server_id: str, event: BarcodeEvent) -> bytes:
+    """
+    Converts a barcode event to json. The result is cached on the event, so it is only computed once.
+    :param server_id: server instance id
+    :param event: the event to convert
+    :return: json representation
+    """
+    key = (FORMAT_JSON, server_id)
+    if event.payloads is None:
+        event.payloads = {}
+    json = event.payloads.get(key, None)
+    if json is None:
+        import orjson
+
+        json = orjson.dumps(barcode_event_to_dict(server_id, event))
+        event.payloads[key] = json
     return json
+
+
+def barcode_events_to_json(server_id: str, events: List[BarcodeEvent]) -> bytes:
+    """
+    Converts multiple barcode events to a json array
+    :param server_id: server instance id
+    :param events: the events to convert
+    :return: json representation
+    """
+    # reuse the cached representations of the individual events
+    return b"[" + b",".join(map(lambda x: barcode_event_to_json(server_id, x), events)) + b"]"
+
+
+def remove_unix_socket(path: str):
+    """
+    Removes the Unix domain socket file at the given path, if any
+    :param path: path of the socket file
+    :raises FileExistsError: if the path exists, but is not a socket
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"Refusing to replace {path}, it is not a socket")
+    os.unlink(path)
+
+
+def bind_unix_socket(path: str, mode: int) -> socket.socket:
+    """
+    Creates a Unix domain socket bound to the given path, replacing a socket left over from a previous run.
+    The socket file is created with the given permissions, so it is never accessible to anyone else.
+    :param path: path of the socket file
+    :param mode: permissions of the socket file
+    :return: the bound socket
+    """
+    remove_unix_socket(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o777 & ~mode)
+    try:
+        sock.bind(path)
+    except Exception:
+        sock.close()
+        raise
+    finally:
+        os.umask(umask)
+    return sock
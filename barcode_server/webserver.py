@@ -1,66 +1,224 @@
 import asyncio
+import hashlib
 import logging
+from datetime import datetime, timedelta
+from pathlib import Path
 from typing import Dict, Optional, Tuple
 
 import aiohttp
 from aiohttp import web
 from aiohttp.web_middlewares import middleware
 from prometheus_async.aio import time
+from prometheus_client import REGISTRY, generate_latest, CONTENT_TYPE_LATEST
 
-from barcode_server.barcode import BarcodeReader, BarcodeEvent
+from barcode_server.barcode import BarcodeReader, BarcodeEvent, datetime_to_timestamp_us
 from barcode_server.config import AppConfig
 from barcode_server.const import *
+from barcode_server.history import EventHistory
 from barcode_server.notifier import BarcodeNotifier
 from barcode_server.notifier.http import HttpNotifier
 from barcode_server.notifier.mqtt import MQTTNotifier
-from barcode_server.notifier.ws import WebsocketNotifier
-from barcode_server.stats import REST_TIME_DEVICES, WEBSOCKET_CLIENT_COUNT
-from barcode_server.util import input_device_to_dict
+from barcode_server.notifier.event_queue import EventQueue, OVERFLOW_POLICY_SPILL
+from barcode_server.notifier.persistent_queue import PersistentEventQueue
+from barcode_server.notifier.replay import ReplayBuffer
+from barcode_server.notifier.retry import RetryPolicy, CircuitBreaker
+from barcode_server.notifier.unix import UnixSocketNotifier
+from barcode_server.notifier.ws import WebsocketNotifier, WebsocketBroadcaster
+from barcode_server.stats import REST_TIME_DEVICES, REST_TIME_EVENTS, WEBSOCKET_CLIENT_COUNT, \
+    WEBSOCKET_CLIENT_EVICTIONS
 
 LOGGER = logging.getLogger(__name__)
+
+# time between checks for idle clients, in seconds
+CLIENT_EVICTION_INTERVAL = 60
+# number of events returned by the events endpoint, if not specified otherwise
+DEFAULT_EVENTS_LIMIT = 100
+
 routes = web.RouteTableDef()
 
 
 class Webserver:
 
-    def __init__(self, config: AppConfig, barcode_reader: BarcodeReader):
+    def __init__(self, config: AppConfig, barcode_reader: BarcodeReader, external_notifiers: bool = True):
+        """
+        :param config: app config
+        :param barcode_reader: the reader to send the events of
+        :param external_notifiers: whether to send events to the HTTP, MQTT and Unix socket targets
+                                   and record them in the event history, only one of multiple webserver processes does
+        """
         self.config = config
         self.host = config.SERVER_HOST.value
         self.port = config.SERVER_PORT.value
 
         self.clients = {}
+        # client id -> time the client disconnected
+        self._client_last_seen: Dict[str, datetime] = {}
+        self._client_eviction_task = None
+
+        # cached output of the metrics endpoint and the loop time it was collected at
+        self._metrics: Optional[bytes] = None
+        self._metrics_time = None
 
         self.barcode_reader = barcode_reader
         self.barcode_reader.add_listener(self.on_barcode)
 
+        # notifiers of the HTTP, MQTT and Unix socket targets
         self.notifiers: Dict[str, BarcodeNotifier] = {}
-        if config.HTTP_URL.value is not None:
-            http_notifier = HttpNotifier(
-                config.HTTP_METHOD.value,
-                config.HTTP_URL.value,
-                config.HTTP_HEADERS.value)
-            self.notifiers["http"] = http_notifier
-
-        if config.MQTT_HOST.value is not None:
-            mqtt_notifier = MQTTNotifier(
-                host=config.MQTT_HOST.value,
-                port=config.MQTT_PORT.value,
-                client_id=config.MQTT_CLIENT_ID.value,
-                user=config.MQTT_USER.value,
-                password=config.MQTT_PASSWORD.value,
-                topic=config.MQTT_TOPIC.value,
-                qos=config.MQTT_QOS.value,
-                retain=config.MQTT_RETAIN.value,
-            )
-            self.notifiers["mqtt"] = mqtt_notifier
+        # client id -> notifier of a websocket client, kept apart so a client id can't replace one of the above
+        self.client_notifiers: Dict[str, WebsocketNotifier] = {}
+        self.websocket_broadcaster = WebsocketBroadcaster(config.INSTANCE_ID.value)
+        self.replay_buffer = ReplayBuffer(config.SERVER_REPLAY_BUFFER_SIZE.value)
+        if external_notifiers and config.HTTP_URL.value is not None:
+            self.notifiers["http"] = self._create_http_notifier(config.HTTP_URL.value)
+
+        if external_notifiers and config.MQTT_HOST.value is not None:
+            self.notifiers["mqtt"] = self._create_mqtt_notifier(config.MQTT_HOST.value, config.MQTT_PORT.value)
+
+        if external_notifiers and config.UNIX_SOCKET_PATH.value is not None:
+            self.notifiers["unix"] = self._create_unix_socket_notifier(config.UNIX_SOCKET_PATH.value)
+
+        self.history: Optional[EventHistory] = None
+        if config.HISTORY_PATH.value is not None:
+            self.history = EventHistory(
+                config.HISTORY_PATH.value,
+                config.INSTANCE_ID.value,
+                retention=config.HISTORY_RETENTION.value,
+                batch_size=config.HISTORY_BATCH_SIZE.value,
+                flush_interval=config.HISTORY_FLUSH_INTERVAL.value,
+                # all processes can query the history, but only one records events
+                writer=external_notifiers)
+
+    def _create_http_notifier(self, url: str) -> HttpNotifier:
+        """
+        Creates the HTTP notifier
+        :param url: url to send events to
+        :return: the notifier
+        """
+        config = self.config
+        return HttpNotifier(
+            config.HTTP_METHOD.value,
+            url,
+            config.HTTP_HEADERS.value,
+            pool_size=config.HTTP_POOL_SIZE.value,
+            keepalive_timeout=config.HTTP_KEEPALIVE_TIMEOUT.value,
+            dns_cache_ttl=config.HTTP_DNS_CACHE_TTL.value,
+            batch_size=config.HTTP_BATCH_SIZE.value,
+            batch_timeout=config.HTTP_BATCH_TIMEOUT.value,
+            event_queue=self._create_event_queue("http"),
+            retry_policy=self._create_retry_policy(
+                config.HTTP_RETRY_INITIAL_DELAY.value,
+                config.HTTP_RETRY_MAX_DELAY.value,
+                config.HTTP_RETRY_MULTIPLIER.value,
+                config.HTTP_RETRY_JITTER.value),
+            circuit_breaker=CircuitBreaker(
+                name="http",
+                failure_threshold=config.HTTP_CIRCUIT_BREAKER_FAILURE_THRESHOLD.value,
+                reset_timeout=config.HTTP_CIRCUIT_BREAKER_RESET_TIMEOUT.value))
+
+    def _create_mqtt_notifier(self, host: str, port: int) -> MQTTNotifier:
+        """
+        Creates the MQTT notifier
+        :param host: host of the MQTT server
+        :param port: port of the MQTT server
+        :return: the notifier
+        """
+        config = self.config
+        return MQTTNotifier(
+            host=host,
+            port=port,
+            client_id=config.MQTT_CLIENT_ID.value,
+            user=config.MQTT_USER.value,
+            password=config.MQTT_PASSWORD.value,
+            topic=config.MQTT_TOPIC.value,
+            qos=config.MQTT_QOS.value,
+            retain=config.MQTT_RETAIN.value,
+            event_queue=self._create_event_queue("mqtt"),
+            retry_policy=self._create_retry_policy(
+                config.MQTT_RETRY_INITIAL_DELAY.value,
+                config.MQTT_RETRY_MAX_DELAY.value,
+                config.MQTT_RETRY_MULTIPLIER.value,
+                config.MQTT_RETRY_JITTER.value),
+            circuit_breaker=CircuitBreaker(
+                name="mqtt",
+                failure_threshold=config.MQTT_CIRCUIT_BREAKER_FAILURE_THRESHOLD.value,
+                reset_timeout=config.MQTT_CIRCUIT_BREAKER_RESET_TIMEOUT.value),
+        )
+
+    def _create_unix_socket_notifier(self, path: str) -> UnixSocketNotifier:
+        """
+        Creates the Unix socket notifier
+        :param path: path of the socket file
+        :return: the notifier
+        """
+        return UnixSocketNotifier(
+            path=path,
+            mode=int(self.config.UNIX_SOCKET_MODE.value, 8),
+            event_queue=self._create_memory_event_queue("unix", "unix"),
+            # a subscriber may connect at any time, so keep checking at the same interval
+            retry_policy=RetryPolicy(initial_delay=self.config.RETRY_INTERVAL.value,
+                                     max_delay=self.config.RETRY_INTERVAL.value),
+            # nothing to protect from load while no subscriber is connected
+            circuit_breaker=CircuitBreaker(name="unix", failure_threshold=0))
+
+    def _create_retry_policy(self, initial_delay: Optional[timedelta], max_delay: timedelta,
+                             multiplier: float, jitter: float) -> RetryPolicy:
+        """
+        Creates the retry policy of a notifier
+        :param initial_delay: delay after the first failed attempt, None to use the global retry interval
+        :param max_delay: upper bound of the delay
+        :param multiplier: factor the delay grows by with every failed attempt
+        :param jitter: fraction of the delay that is randomized
+        :return: the retry policy
+        """
+        if initial_delay is None:
+            initial_delay = self.config.RETRY_INTERVAL.value
+        return RetryPolicy(initial_delay=initial_delay, max_delay=max_delay, multiplier=multiplier, jitter=jitter)
+
+    def _create_event_queue(self, name: str) -> asyncio.Queue:
+        """
+        Creates the event queue of a notifier, which is persisted on disk if configured
+        :param name: name of the notifier
+        :return: the queue
+        """
+        if self.config.EVENT_QUEUE_PATH.value is None:
+            return self._create_memory_event_queue(name, name)
+
+        return PersistentEventQueue(
+            path=Path(self.config.EVENT_QUEUE_PATH.value) / name,
+            group_commit=self.config.EVENT_QUEUE_GROUP_COMMIT.value,
+            commit_delay=self.config.EVENT_QUEUE_COMMIT_DELAY.value.total_seconds(),
+            segment_size=self.config.EVENT_QUEUE_SEGMENT_SIZE.value,
+        )
+
+    def _create_memory_event_queue(self, name: str, spill_name: str) -> EventQueue:
+        """
+        Creates a bounded in-memory event queue for a notifier
+        :param name: type of the notifier
+        :param spill_name: name of the directory to spill events to, if the queue is full
+        :return: the queue
+        """
+        overflow_policy = self.config.EVENT_QUEUE_OVERFLOW_POLICY.value
+        spill_path = None
+        if overflow_policy == OVERFLOW_POLICY_SPILL:
+            spill_path = Path(self.config.EVENT_QUEUE_PATH.value) / "spill" / spill_name
+
+        return EventQueue(
+            name=name,
+            max_size=self.config.EVENT_QUEUE_MAX_SIZE.value,
+            overflow_policy=overflow_policy,
+            spill_path=spill_path,
+        )
 
     async def start(self):
+        if self.history is not None:
+            await self.history.start()
         # start detecting and reading barcode scanners
         await self.barcode_reader.start()
         # start notifier queue processors
         for key, notifier in self.notifiers.items():
             LOGGER.debug(f"Starting notifier: {key}")
             await notifier.start()
+        self._client_eviction_task = asyncio.create_task(self._client_eviction_loop())
         LOGGER.info(f"Starting webserver on {self.config.SERVER_HOST.value}:{self.config.SERVER_PORT.value} ...")
 
         app = self.create_app()
@@ -69,7 +227,9 @@ class Webserver:
         site = aiohttp.web.TCPSite(
             runner,
             host=self.config.SERVER_HOST.value,
-            port=self.config.SERVER_PORT.value
+            port=self.config.SERVER_PORT.value,
+            # multiple webserver processes share the port, the kernel balances connections between them
+            reuse_port=self.config.SERVER_PROCESSES.value > 1,
         )
         await site.start()
 
@@ -79,6 +239,11 @@ class Webserver:
     def create_app(self) -> web.Application:
         app = web.Application(middlewares=[self.authentication_middleware])
         app.add_routes(routes)
+        # with multiple processes, any of them might answer, so the reader process exports the statistics of all of them
+        if self.config.STATS_WEBSERVER.value and self.config.SERVER_PROCESSES.value <= 0:
+            app.router.add_get(f"/{ENDPOINT_METRICS}", Webserver.metrics_handle)
+        if self.history is not None:
+            app.router.add_get(f"/{ENDPOINT_EVENTS}", Webserver.events_handle)
         return app
 
     @middleware
@@ -87,6 +252,10 @@ class Webserver:
         if error is not None:
             return error
 
+        if request.path == f"/{ENDPOINT_METRICS}":
+            # scraped by monitoring systems, which are not clients
+            return await handler(self, request)
+
         client_id, error = self._find_client_id(request)
         if error is not None:
             return error
@@ -126,17 +295,61 @@ class Webserver:
 
         return client_id, None
 
+    @staticmethod
+    def _find_last_event_seq(request) -> Tuple[Optional[int], Optional[web.HTTPClientError]]:
+        if Last_Event_Seq in request.headers.keys():
+            value = request.headers[Last_Event_Seq]
+        elif Last_Event_Seq in request.rel_url.query.keys():
+            value = request.rel_url.query[Last_Event_Seq]
+        else:
+            return None, None
+
+        try:
+            return int(value.strip()), None
+        except ValueError:
+            LOGGER.warning(f"Rejecting client with invalid {Last_Event_Seq}: {request.host}")
+            return None, web.HTTPBadRequest()
+
     @routes.get(f"/{ENDPOINT_DEVICES}")
     @time(REST_TIME_DEVICES)
     async def devices_handle(self, request):
-        import orjson
-        device_list = list(map(input_device_to_dict, self.barcode_reader.devices.values()))
-        json = orjson.dumps(device_list)
+        json = self.barcode_reader.registry.devices_json()
         return web.Response(body=json, content_type="application/json")
 
+    @time(REST_TIME_EVENTS)
+    async def events_handle(self, request):
+        query = request.rel_url.query
+        try:
+            limit = int(query.get("limit", DEFAULT_EVENTS_LIMIT))
+            cursor = int(query["cursor"]) if "cursor" in query else None
+            since = datetime_to_timestamp_us(datetime.fromisoformat(query["since"])) if "since" in query else None
+            until = datetime_to_timestamp_us(datetime.fromisoformat(query["until"])) if "until" in query else None
+        except ValueError:
+            LOGGER.warning(f"Rejecting events query with invalid parameters: {request.rel_url.query_string}")
+            return web.HTTPBadRequest()
+
+        events, next_cursor = await self.history.query(
+            barcode=query.get("barcode", None), device=query.get("device", None), since=since, until=until,
+            cursor=cursor, limit=limit)
+        # the json representations of the events are stored as they are
+        body = b'{"events":[' + b",".join(events) + b'],"next":' \
+               + (str(next_cursor).encode() if next_cursor is not None else b"null") + b"}"
+        return web.Response(body=body, content_type="application/json")
+
+    async def metrics_handle(self, request):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._metrics is None or now - self._metrics_time >= self.config.STATS_CACHE_DURATION.value.total_seconds():
+            self._metrics = generate_latest(REGISTRY)
+            self._metrics_time = now
+        return web.Response(body=self._metrics, headers={"Content-Type": CONTENT_TYPE_LATEST})
+
     @routes.get("/")
     async def websocket_handler(self, request):
         client_id, error = self._find_client_id(request)
+        if error is not None:
+            return error
+        last_event_seq, error = self._find_last_event_seq(request)
         if error is not None:
             return error
 
@@ -149,27 +362,40 @@ class Webserver:
         # TODO: report both the mount of currently connected clients, as well as known client ids
         WEBSOCKET_CLIENT_COUNT.set(active_client_count)
 
-        if client_id not in self.notifiers.keys():
+        if last_event_seq is not None and client_id in self.client_notifiers.keys():
+            # the client resumes from the replay buffer, so events queued for it are not needed anymore
+            await self._remove_notifier(client_id)
+
+        if client_id not in self.client_notifiers.keys():
             LOGGER.debug(
                 f"New client connected: {client_id} (from {request.host})")
 
             LOGGER.debug(f"Creating new notifier for client id: {client_id}")
-            notifier = WebsocketNotifier(websocket)
-            self.notifiers[client_id] = notifier
+            spill_name = f"websocket-{hashlib.sha1(client_id.encode()).hexdigest()}"
+            notifier = WebsocketNotifier(
+                websocket, event_queue=self._create_memory_event_queue("websocket", spill_name))
+            self.client_notifiers[client_id] = notifier
         else:
             LOGGER.debug(
                 f"Previously seen client reconnected: {client_id} (from {request.host})")
 
-        notifier = self.notifiers[client_id]
-        if isinstance(notifier, WebsocketNotifier):
-            notifier.websocket = websocket
+        notifier = self.client_notifiers[client_id]
+        notifier.websocket = websocket
+        notifier.transport = request.transport
 
         if Drop_Event_Queue in request.headers.keys() or Drop_Event_Queue in request.rel_url.query.keys():
             LOGGER.debug(f"Dropping event queue for notifier: {client_id}")
             await notifier.drop_queue()
+        elif last_event_seq is not None:
+            missed_events = self.replay_buffer.since(last_event_seq)
+            LOGGER.debug(f"Replaying {len(missed_events)} events after {last_event_seq} for client: {client_id}")
+            # queued before the notifier is registered for broadcasts, so live events can't overtake them
+            for event in missed_events:
+                await notifier.add_event(event)
 
         LOGGER.debug(f"Starting notifier: {client_id}")
         await notifier.start()
+        self.websocket_broadcaster.add(notifier)
 
         try:
             async for msg in websocket:
@@ -184,20 +410,79 @@ class Webserver:
         except Exception as e:
             LOGGER.exception(e)
         finally:
-            # TODO: should we remove this notifier after some time?
+            # the notifier keeps queueing events until the client reconnects or is evicted after being idle
             LOGGER.debug(f"Stopping notifier: {client_id}")
+            self.websocket_broadcaster.remove(notifier)
             await notifier.stop()
 
             self.clients[client_id] = None
             self.clients.pop(client_id)
+            if last_event_seq is not None:
+                # the client resumes from the replay buffer, so there is no need to queue events for it
+                await self._remove_notifier(client_id)
+            else:
+                self._client_last_seen[client_id] = datetime.now()
             active_client_count = self.count_active_clients()
             WEBSOCKET_CLIENT_COUNT.set(active_client_count)
             LOGGER.debug(f"Client disconnected: {client_id} (from {request.host})")
         return websocket
 
     async def on_barcode(self, event: BarcodeEvent):
-        for key, notifier in self.notifiers.items():
+        # broadcast right after adding the event to the replay buffer, without yielding in between,
+        # so a client resuming in the meantime can't receive it both from the replay buffer and the broadcast
+        self.replay_buffer.append(event)
+        await self.websocket_broadcaster.broadcast(event)
+        for key, notifier in list(self.client_notifiers.items()):
+            if notifier in self.websocket_broadcaster:
+                # connected websocket clients are handled by the broadcaster
+                continue
+            await notifier.add_event(event)
+        for key, notifier in list(self.notifiers.items()):
             await notifier.add_event(event)
+        if self.history is not None and self.history.writer:
+            # only collected here, inserted in the background
+            self.history.add(event)
+
+    async def _client_eviction_loop(self):
+        """
+        Periodically removes the notifiers of clients that have been disconnected for too long
+        """
+        while True:
+            await asyncio.sleep(CLIENT_EVICTION_INTERVAL)
+            try:
+                await self._evict_idle_clients()
+            except Exception as ex:
+                LOGGER.exception(ex)
+
+    async def _evict_idle_clients(self):
+        """
+        Removes the notifiers, including all queued events, of clients that have been disconnected
+        for longer than the client idle timeout
+        """
+        now = datetime.now()
+        timeout = self.config.SERVER_CLIENT_IDLE_TIMEOUT.value
+        for client_id, last_seen in list(self._client_last_seen.items()):
+            if client_id in self.clients or now - last_seen < timeout:
+                continue
+
+            LOGGER.debug(f"Removing notifier of idle client: {client_id}")
+            if await self._remove_notifier(client_id):
+                WEBSOCKET_CLIENT_EVICTIONS.inc()
+
+    async def _remove_notifier(self, client_id: str) -> bool:
+        """
+        Removes the notifier of a websocket client, including all events queued for it
+        :param client_id: client id
+        :return: True if there was a notifier for the given client
+        """
+        self._client_last_seen.pop(client_id, None)
+        notifier = self.client_notifiers.pop(client_id, None)
+        if notifier is None:
+            return False
+        await notifier.stop()
+        if isinstance(notifier.event_queue, EventQueue):
+            notifier.event_queue.close(delete=True)
+        return True
 
     def count_active_clients(self):
         """
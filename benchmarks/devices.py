@@ -0,0 +1,99 @@
+"""
+Fake input devices emitting synthetic key event streams, used by the benchmarks and tests
+"""
+import os
+import struct
+import tempfile
+import time
+from typing import List
+
+from evdev import InputEvent, KeyEvent, ecodes
+
+# struct input_event { struct timeval time; __u16 type; __u16 code; __s32 value; }
+INPUT_EVENT_FORMAT = "llHHi"
+INPUT_EVENT_SIZE = struct.calcsize(INPUT_EVENT_FORMAT)
+
+
+class FakeInputDevice:
+    """
+    Emulates an evdev InputDevice using a pipe, so it can be multiplexed on the event loop
+    """
+
+    class Info:
+        def __init__(self, vendor: int, product: int):
+            self.vendor = vendor
+            self.product = product
+
+    def __init__(self, index: int, directory: str = None):
+        self.name = f"Barcode Scanner {index}"
+        # a regular file stands in for the device node
+        handle, self.path = tempfile.mkstemp(prefix=f"event{index}-", dir=directory)
+        os.close(handle)
+        self.info = self.Info(vendor=0xffff, product=index)
+        self.fd, self._write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        self.grabbed = False
+
+    def grab(self):
+        self.grabbed = True
+
+    def ungrab(self):
+        self.grabbed = False
+
+    def read(self):
+        # like evdev, read at most 64 events at once
+        data = os.read(self.fd, INPUT_EVENT_SIZE * 64)
+        for offset in range(0, len(data), INPUT_EVENT_SIZE):
+            yield InputEvent(*struct.unpack_from(INPUT_EVENT_FORMAT, data, offset))
+
+    def write(self, events: List[tuple]):
+        now = time.time()
+        sec, usec = int(now), int((now % 1) * 1000000)
+        os.write(self._write_fd, b"".join(
+            map(lambda x: struct.pack(INPUT_EVENT_FORMAT, sec, usec, *x), events)))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            os.close(self._write_fd)
+            self.fd = None
+
+    def unplug(self):
+        os.unlink(self.path)
+
+
+def character_to_keycodes(character: str) -> List[int]:
+    """
+    :param character: a digit or a letter
+    :return: keycodes to press to type the given character on a keyboard with "us" layout, the first one is held
+    """
+    if character.isdigit():
+        return [ecodes.ecodes[f"KEY_KP{character}"]]
+    if character.isupper():
+        return [ecodes.KEY_LEFTSHIFT, ecodes.ecodes[f"KEY_{character}"]]
+    return [ecodes.ecodes[f"KEY_{character.upper()}"]]
+
+
+def barcode_to_raw_events(barcode: str) -> List[tuple]:
+    """
+    Converts a barcode to a list of (type, code, value) tuples, the way a scanner would emit them
+    :param barcode: a barcode consisting of digits and letters
+    :return: raw input events
+    """
+    events = []
+
+    def key(code: int, state: int):
+        events.append((ecodes.EV_KEY, code, state))
+        events.append((ecodes.EV_SYN, ecodes.SYN_REPORT, 0))
+
+    for character in barcode:
+        *modifiers, code = character_to_keycodes(character)
+        for modifier in modifiers:
+            key(modifier, KeyEvent.key_down)
+        key(code, KeyEvent.key_down)
+        key(code, KeyEvent.key_up)
+        for modifier in modifiers:
+            key(modifier, KeyEvent.key_up)
+    key(ecodes.KEY_ENTER, KeyEvent.key_down)
+    key(ecodes.KEY_ENTER, KeyEvent.key_up)
+    return events
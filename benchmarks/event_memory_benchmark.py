@@ -0,0 +1,73 @@
+"""
+Benchmark of the memory held by queued barcode events, comparing the compact event to
+the previous representation with an instance dict, a random uuid and a datetime.
+
+Run from the repository root:
+
+    python -m benchmarks.event_memory_benchmark [event count]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.notifier.event_queue import EventQueue
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+EVENTS = 1000000
+
+
+class LegacyBarcodeEvent:
+    """
+    Barcode event like before it was made compact
+    """
+
+    def __init__(self, input_device, barcode: str, first_key_time: float = None, enter_time: float = None):
+        self.id = str(uuid.uuid4())
+        self.seq = time.time_ns() // 1000
+        self.date = datetime.now()
+        self.timestamp_us = self.seq
+        self.input_device = input_device
+        self.barcode = barcode
+        self.first_key_time = first_key_time
+        self.enter_time = enter_time
+        self.enqueue_times = {}
+        self.payloads = {}
+
+
+def measure(event_type: type, count: int) -> tuple:
+    """
+    Queues the given number of events
+    :return: tuple of (bytes per event, microseconds per event)
+    """
+    device = create_barcode_event_mock().input_device
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    queue = EventQueue()
+    for i in range(count):
+        now = time.time()
+        queue.put_nowait(event_type(device, f"{i:013d}", first_key_time=now, enter_time=now))
+    duration = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    queue.close()
+    return size / count, duration / count * 1000000
+
+
+def main(count: int = EVENTS):
+    print(f"{count} queued events")
+    print(f"{'':>8} {'memory':>10} {'per event':>12} {'create':>10}")
+    results = {}
+    for name, event_type in [("legacy", LegacyBarcodeEvent), ("compact", BarcodeEvent)]:
+        per_event, duration = measure(event_type, count)
+        results[name] = per_event
+        print(f"{name:>8} {per_event * count / 1024 / 1024:>7.1f} MB {per_event:>8.1f} B {duration:>7.2f} µs")
+    print(f"{results['legacy'] / results['compact']:.1f}x less memory")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
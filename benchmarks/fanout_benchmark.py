@@ -0,0 +1,77 @@
+"""
+Benchmark of the cost of sending a single barcode event to a growing number of websocket clients,
+comparing the cached event payload to serializing the event once per client.
+
+Run from the repository root:
+
+    python -m benchmarks.fanout_benchmark
+"""
+import asyncio
+import time
+
+import orjson
+
+from barcode_server.notifier.ws import WebsocketNotifier
+from barcode_server.util import barcode_event_to_dict, barcode_event_to_json
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+CLIENT_COUNTS = [1, 10, 100, 1000]
+SCANS = 200
+
+
+class NullWebsocket:
+    """
+    Websocket that discards all messages, so only the cost of the notifier itself is measured
+    """
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+
+class CachedWebsocketNotifier(WebsocketNotifier):
+    """
+    Sends the cached event payload, like WebsocketNotifier, but without recording
+    the notifier processing time, which would dominate the measurement
+    """
+
+    async def _send_event(self, event):
+        json = barcode_event_to_json(self.config.INSTANCE_ID.value, event)
+        await self.websocket.send_bytes(json)
+
+
+class LegacyWebsocketNotifier(WebsocketNotifier):
+    """
+    Serializes every event for every client, like before the payload cache
+    """
+
+    async def _send_event(self, event):
+        json = orjson.dumps(barcode_event_to_dict(self.config.INSTANCE_ID.value, event))
+        await self.websocket.send_bytes(json)
+
+
+async def fan_out(notifier_type: type, client_count: int) -> float:
+    """
+    Sends events to the given number of clients
+    :return: microseconds per scan
+    """
+    notifiers = [notifier_type(NullWebsocket()) for _ in range(client_count)]
+    events = [create_barcode_event_mock() for _ in range(SCANS)]
+
+    start = time.perf_counter()
+    for event in events:
+        for notifier in notifiers:
+            await notifier._send_event(event)
+    duration = time.perf_counter() - start
+    return duration / SCANS * 1000000
+
+
+async def main():
+    print(f"{'clients':>8} {'per client':>14} {'cached':>14} {'speedup':>8}")
+    for client_count in CLIENT_COUNTS:
+        legacy = await fan_out(LegacyWebsocketNotifier, client_count)
+        cached = await fan_out(CachedWebsocketNotifier, client_count)
+        print(f"{client_count:>8} {legacy:>11.1f} µs {cached:>11.1f} µs {legacy / cached:>7.1f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""
+Benchmark of the EventHistory, measuring the time recording an event takes on the event loop,
+the insert throughput of batched inserts compared to inserting every event individually,
+and the latency of queries on a filled database.
+
+Run from the repository root:
+
+    python -m benchmarks.history_benchmark [directory]
+
+The directory should be located on the disk the database is meant to be used on,
+it defaults to a temporary directory.
+"""
+import asyncio
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from barcode_server.history import EventHistory
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+EVENTS = 20000
+BARCODES = 1000
+DEVICES = 4
+QUERIES = 200
+
+
+def create_events() -> list:
+    return list(map(
+        lambda i: create_barcode_event_mock(f"{i % BARCODES:013d}", device_path=f"/dev/input/event{i % DEVICES}"),
+        range(EVENTS)))
+
+
+async def insert(path: Path, batch_size: int) -> dict:
+    """
+    Records events and waits until all of them were inserted
+    :param batch_size: number of events inserted at once
+    :return: events per second and the time spent in add() per event
+    """
+    history = EventHistory(str(path), "benchmark", batch_size=batch_size)
+    await history.start()
+    events = create_events()
+    try:
+        start = time.perf_counter()
+        add_duration = 0
+        for event in events:
+            add_start = time.perf_counter()
+            history.add(event)
+            add_duration += time.perf_counter() - add_start
+            if len(history._pending) >= batch_size:
+                await history.flush()
+        await history.flush()
+        duration = time.perf_counter() - start
+    finally:
+        await history.stop()
+    return {
+        "events_per_second": EVENTS / duration,
+        "add_us": add_duration / EVENTS * 1000000,
+    }
+
+
+async def query(path: Path) -> dict:
+    """
+    Runs queries with different filters on the database filled by insert()
+    :return: filter -> median latency in milliseconds
+    """
+    history = EventHistory(str(path), "benchmark", writer=False)
+    await history.start()
+    with sqlite3.connect(str(path)) as connection:
+        oldest = connection.execute("SELECT min(timestamp_us) FROM events").fetchone()[0]
+    filters = {
+        "latest page": lambda i: {},
+        "barcode": lambda i: {"barcode": f"{i % BARCODES:013d}"},
+        "device": lambda i: {"device": f"/dev/input/event{i % DEVICES}"},
+        "time range": lambda i: {"since": 0, "until": time.time_ns() // 1000},
+        "old time range": lambda i: {"since": oldest, "until": oldest + 1000},
+    }
+    results = {}
+    try:
+        for name, create_filter in filters.items():
+            durations = []
+            for i in range(QUERIES):
+                start = time.perf_counter()
+                found, cursor = await history.query(limit=100, **create_filter(i))
+                durations.append(time.perf_counter() - start)
+                assert len(found) > 0
+            results[name] = statistics.median(durations) * 1000
+    finally:
+        await history.stop()
+    return results
+
+
+async def main(directory: str = None):
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        print(f"{EVENTS} events")
+        for name, batch_size in [("per-event insert", 1), ("batched insert", 500)]:
+            result = await insert(Path(temp_dir) / f"{batch_size}.db", batch_size)
+            print(f"{name:>18}: {result['events_per_second']:10.0f} events/s, "
+                  f"add() {result['add_us']:.2f} us/event")
+
+        for name, latency in (await query(Path(temp_dir) / "500.db")).items():
+            print(f"{name:>18}: {latency:10.3f} ms per query of 100 events")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:]))
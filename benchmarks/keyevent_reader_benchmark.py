@@ -0,0 +1,171 @@
+"""
+Micro-benchmark of the table driven KeyEventReader against the previous,
+name based decoder that used evdev.categorize() and string comparisons.
+
+Run from the repository root:
+
+    python -m benchmarks.keyevent_reader_benchmark
+"""
+import timeit
+
+from evdev import InputEvent, KeyEvent, categorize
+
+from barcode_server.keyevent_reader import KeyEventReader, LOGGER
+from tests.key_event_reader_test import KeyEventReaderTest
+
+LINES = 1000
+REPEAT = 5
+
+US_EN_UPPER_DICT = {
+    "`": "~", "1": "!", "2": "@", "3": "#", "4": "$", "5": "%", "6": "^", "7": "&", "8": "*", "9": "(", "0": ")",
+    "-": "_", "=": "+", ",": "<", ".": ">", "/": "?", ";": ":", "'": "\"", "\\": "|", "[": "{", "]": "}"
+}
+
+
+class LegacyKeyEventReader(KeyEventReader):
+    """
+    The decoder as it was before keycodes were resolved using lookup tables
+    """
+
+    def process_event(self, event) -> str or None:
+        event = categorize(event)
+        if not isinstance(event, KeyEvent):
+            return None
+        if self._on_key_event(event.keycode, event.keystate):
+            line = self._line
+            self._line = ""
+            return line
+        return None
+
+    def _on_key_event(self, code: str, state: int) -> bool:
+        if code in ["KEY_ENTER", "KEY_KPENTER"]:
+            if state == KeyEvent.key_up:
+                # line is finished
+                self._reset_modifiers()
+                return True
+        elif code in ["KEY_RIGHTSHIFT", "KEY_LEFTSHIFT"]:
+            if state in [KeyEvent.key_down, KeyEvent.key_hold]:
+                self._shift = True
+            else:
+                self._shift = False
+        elif code in ["KEY_LEFTALT", "KEY_RIGHTALT"]:
+            if state in [KeyEvent.key_down, KeyEvent.key_hold]:
+                self._alt = True
+            else:
+                self._alt = False
+
+                character = self._unicode_numbers_to_character(self._unicode_number_input_buffer)
+                self._unicode_number_input_buffer = ""
+
+                if character is not None:
+                    self._line += character
+
+        elif code == "KEY_BACKSPACE":
+            self._line = self._line[:-1]
+        elif state == KeyEvent.key_down:
+            character = self._code_to_character(code)
+            if self._alt:
+                self._unicode_number_input_buffer += character
+            else:
+                if character is not None and not self._alt:
+                    # append the current character
+                    self._line += character
+
+        return False
+
+    def _code_to_character(self, code: str) -> chr or None:
+        character = None
+
+        if len(code) == 5:
+            character = code[-1]
+        elif code.startswith("KEY_KP") and len(code) == 7:
+            character = code[-1]
+
+        elif code in ["KEY_DOWN"]:
+            character = '\n'
+        elif code in ["KEY_SPACE"]:
+            character = ' '
+        elif code in ["KEY_ASTERISK", "KEY_KPASTERISK"]:
+            character = '*'
+        elif code in ["KEY_MINUS", "KEY_KPMINUS"]:
+            character = '-'
+        elif code in ["KEY_PLUS", "KEY_KPPLUS"]:
+            character = '+'
+        elif code in ["KEY_QUESTION"]:
+            character = '?'
+        elif code in ["KEY_COMMA", "KEY_KPCOMMA"]:
+            character = ','
+        elif code in ["KEY_DOT", "KEY_KPDOT"]:
+            character = '.'
+        elif code in ["KEY_EQUAL", "KEY_KPEQUAL"]:
+            character = '='
+        elif code in ["KEY_LEFTPAREN", "KEY_KPLEFTPAREN"]:
+            character = '('
+        elif code in ["KEY_PLUSMINUS", "KEY_KPPLUSMINUS"]:
+            character = '+-'
+        elif code in ["KEY_RIGHTPAREN", "KEY_KPRIGHTPAREN"]:
+            character = ')'
+        elif code in ["KEY_RIGHTBRACE"]:
+            character = ']'
+        elif code in ["KEY_LEFTBRACE"]:
+            character = '['
+        elif code in ["KEY_SLASH", "KEY_KPSLASH"]:
+            character = '/'
+        elif code in ["KEY_BACKSLASH"]:
+            character = '\\'
+        elif code in ["KEY_COLON"]:
+            character = ';'
+        elif code in ["KEY_SEMICOLON"]:
+            character = ';'
+        elif code in ["KEY_APOSTROPHE"]:
+            character = '\''
+        elif code in ["KEY_GRAVE"]:
+            character = '`'
+
+        if character is None:
+            character = code[4:]
+            if len(character) > 1:
+                LOGGER.warning(f"Unhandled Keycode: {code}")
+
+        if self._shift or self._caps:
+            character = character.upper()
+            if character in US_EN_UPPER_DICT.keys():
+                character = US_EN_UPPER_DICT[character]
+        else:
+            character = character.lower()
+
+        return character
+
+
+def generate_events(lines: int) -> [InputEvent]:
+    """
+    Generates real input events for the given amount of lines using the test sequence generator
+    """
+    generator = KeyEventReaderTest()
+    mocks = generator.generate_input_event_sequence("4006824000970") * lines
+    return list(map(lambda x: InputEvent(0, 0, x.type, x.code, x.value), mocks))
+
+
+def decode(reader: KeyEventReader, events: [InputEvent]) -> int:
+    count = 0
+    for event in events:
+        if reader.process_event(event) is not None:
+            count += 1
+    return count
+
+
+def main():
+    events = generate_events(LINES)
+
+    results = {}
+    for name, reader in [("legacy", LegacyKeyEventReader()), ("table", KeyEventReader())]:
+        assert decode(reader, events) == LINES
+        seconds = min(timeit.repeat(lambda: decode(reader, events), number=1, repeat=REPEAT))
+        results[name] = seconds
+        print(f"{name:>8}: {len(events) / seconds:12.0f} events/s ({seconds * 1000:.2f} ms for {LINES} lines)")
+
+    print(f" speedup: {results['legacy'] / results['table']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
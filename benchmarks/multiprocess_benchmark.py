@@ -0,0 +1,192 @@
+"""
+Benchmark of the scan latency under heavy websocket client load, comparing running the webserver
+in the same process as the barcode reader to running it in separate delivery processes.
+
+Websocket clients connect from a separate process and keep reconnecting, while scans are emitted
+by fake devices. The scan latency is measured from writing the key events of a barcode until
+the barcode reader hands the event to its listeners.
+
+Run from the repository root:
+
+    python -m benchmarks.multiprocess_benchmark [client count] [delivery process count]
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+import aiohttp
+from aiohttp import web
+from container_app_conf.source.env_source import EnvSource
+
+from barcode_server import const
+from barcode_server.config import AppConfig
+from barcode_server.ipc import EventPublisher, run_delivery_process
+from barcode_server.webserver import Webserver
+from benchmarks.devices import FakeInputDevice, barcode_to_raw_events
+from benchmarks.pipeline import BenchmarkBarcodeReader, summarize
+
+CLIENTS = 500
+PROCESSES = 2
+DEVICES = 4
+SCANS = 300
+SCAN_INTERVAL = 0.01
+# time range a client stays connected before it reconnects, in seconds
+CONNECTION_DURATION = (0.5, 2)
+
+
+def run_clients(port: int, client_count: int, api_token: str, ready):
+    """
+    Entry point of the client process, connecting websocket clients that keep reconnecting
+    :param ready: set once all clients were connected once
+    """
+    asyncio.run(_clients(port, client_count, api_token, ready))
+
+
+async def _clients(port: int, client_count: int, api_token: str, ready):
+    connected = set()
+
+    async def drain(ws):
+        async for msg in ws:
+            pass
+
+    async def client(session: aiohttp.ClientSession, client_id: str):
+        while True:
+            try:
+                async with session.ws_connect(f"http://127.0.0.1:{port}/", headers={
+                    const.Client_Id: client_id,
+                    const.X_Auth_Token: api_token or "",
+                }) as ws:
+                    connected.add(client_id)
+                    if len(connected) >= client_count:
+                        ready.set()
+                    try:
+                        await asyncio.wait_for(drain(ws), random.uniform(*CONNECTION_DURATION))
+                    except asyncio.TimeoutError:
+                        pass
+            except Exception:
+                await asyncio.sleep(0.1)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await asyncio.gather(*map(lambda x: client(session, str(uuid.uuid4())), range(client_count)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def measure(process_count: int, client_count: int) -> dict:
+    """
+    Emits scans while the given number of clients is connected
+    :param process_count: number of delivery processes, 0 to run the webserver in this process
+    :param client_count: number of websocket clients
+    :return: summary of the scan latencies
+    """
+    port = free_port()
+    directory = tempfile.mkdtemp(prefix="barcode-server-bench-")
+    os.environ[EnvSource.env_key(AppConfig.SERVER_PORT)] = str(port)
+    os.environ[EnvSource.env_key(AppConfig.SERVER_PROCESSES)] = str(process_count)
+    os.environ[EnvSource.env_key(AppConfig.SERVER_READER_SOCKET)] = str(Path(directory) / "reader.sock")
+    config = AppConfig()
+    # the delivery processes use the same instance id
+    os.environ[EnvSource.env_key(AppConfig.INSTANCE_ID)] = config.INSTANCE_ID.value
+
+    devices = [FakeInputDevice(i, directory) for i in range(DEVICES)]
+    written: Dict[str, float] = {}
+    decoded: Dict[str, float] = {}
+
+    async def on_decoded(event):
+        decoded[event.barcode] = time.time()
+
+    reader = BenchmarkBarcodeReader(config, devices, directory)
+    # called first, before the event is handed to the webserver
+    reader.add_listener(on_decoded)
+
+    context = multiprocessing.get_context("spawn")
+    processes: List[multiprocessing.Process] = []
+    publisher = None
+    runner = None
+    try:
+        if process_count > 0:
+            publisher = EventPublisher(reader, config.SERVER_READER_SOCKET.value)
+            await publisher.start()
+            for i in range(process_count):
+                # the configured HTTP and MQTT targets are not part of the measurement
+                process = context.Process(
+                    target=run_delivery_process,
+                    args=(i, config.SERVER_READER_SOCKET.value, logging.CRITICAL, False), daemon=True)
+                process.start()
+                processes.append(process)
+            while publisher.connection_count < process_count:
+                await asyncio.sleep(0.1)
+        else:
+            webserver = Webserver(config, reader, external_notifiers=False)
+            runner = web.AppRunner(webserver.create_app(), access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host="127.0.0.1", port=port).start()
+        await reader.start()
+
+        if client_count > 0:
+            ready = context.Event()
+            client_process = context.Process(
+                target=run_clients, args=(port, client_count, config.SERVER_API_TOKEN.value, ready), daemon=True)
+            client_process.start()
+            processes.append(client_process)
+            while not ready.is_set():
+                await asyncio.sleep(0.1)
+
+        while len(reader.devices) < len(devices):
+            await asyncio.sleep(0.01)
+
+        start = time.time()
+        for i in range(SCANS):
+            barcode = f"{i:013d}"
+            written[barcode] = time.time()
+            devices[i % len(devices)].write(barcode_to_raw_events(barcode))
+            await asyncio.sleep(SCAN_INTERVAL)
+        while len(decoded) < SCANS:
+            await asyncio.sleep(0.01)
+        duration = time.time() - start
+
+        return summarize(list(map(lambda x: decoded[x] - written[x], written.keys())), duration)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        await reader.stop()
+        if publisher is not None:
+            await publisher.stop()
+        if runner is not None:
+            await runner.cleanup()
+        # let the device readers finish, before their file descriptors are closed
+        await asyncio.sleep(0)
+        for device in devices:
+            device.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+async def main(client_count: int = CLIENTS, process_count: int = PROCESSES):
+    print(f"{SCANS} scans, {client_count} reconnecting websocket clients, {os.cpu_count()} CPUs")
+    print(f"{'mode':>16} {'clients':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, processes in [("single process", 0), (f"{process_count} delivery", process_count)]:
+        for clients in [0, client_count]:
+            result = await measure(processes, clients)
+            print(f"{name:>16} {clients:>8} " + " ".join(map(
+                lambda x: f"{result[x]:>6.2f} ms", ["p50_ms", "p90_ms", "p99_ms", "max_ms"])))
+
+
+if __name__ == '__main__':
+    # clients disconnecting while an event is sent to them are expected
+    logging.getLogger("barcode_server").setLevel(logging.CRITICAL)
+    asyncio.run(main(*map(int, sys.argv[1:])))
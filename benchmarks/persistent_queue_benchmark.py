@@ -0,0 +1,57 @@
+"""
+Benchmark of the enqueue throughput of the PersistentEventQueue,
+comparing group commit to syncing every event individually.
+
+Run from the repository root:
+
+    python -m benchmarks.persistent_queue_benchmark [directory]
+
+The directory should be located on the disk the queue is meant to be used on,
+it defaults to a temporary directory.
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from barcode_server.notifier.persistent_queue import PersistentEventQueue
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+EVENTS = 2000
+PRODUCERS = 50
+
+
+async def enqueue(path: Path, group_commit: bool) -> float:
+    """
+    Enqueues events from concurrent producers, like multiple devices would
+    :return: events per second, until all of them are durable
+    """
+    queue = PersistentEventQueue(path, group_commit=group_commit)
+    events = [create_barcode_event_mock() for _ in range(EVENTS)]
+
+    async def producer(items):
+        for item in items:
+            await queue.put(item)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[producer(events[i::PRODUCERS]) for i in range(PRODUCERS)])
+    # put() only waits for the sync without group commit
+    await queue.flush()
+    duration = time.perf_counter() - start
+    assert queue.qsize() == EVENTS
+    queue.close()
+    return EVENTS / duration
+
+
+async def main(directory: str = None):
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        results = {}
+        for name, group_commit in [("per-event fsync", False), ("group commit", True)]:
+            results[name] = await enqueue(Path(temp_dir) / name.split()[0], group_commit)
+            print(f"{name:>16}: {results[name]:10.0f} events/s")
+        print(f"{'speedup':>16}: {results['group commit'] / results['per-event fsync']:.1f}x")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*sys.argv[1:]))
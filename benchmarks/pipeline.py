@@ -0,0 +1,268 @@
+"""
+Benchmark of the whole scan pipeline, run by the bench command of the cli.
+
+Scans are emitted by fake devices, decoded by the BarcodeReader and sent by the Webserver
+to local stand-ins of the notification targets.
+"""
+import asyncio
+import logging
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import List, Dict
+
+from aiohttp import web
+
+from barcode_server.barcode import BarcodeReader, BarcodeEvent
+from barcode_server.config import AppConfig
+from barcode_server.notifier.event_queue import EventQueue, OVERFLOW_POLICY_SPILL, OVERFLOW_POLICY_DROP_OLDEST
+from barcode_server.webserver import Webserver
+from benchmarks.devices import FakeInputDevice, barcode_to_raw_events
+from benchmarks.sinks import Sink, HttpSink, MqttBroker, WebsocketSink, UnixSocketSink
+
+LOGGER = logging.getLogger(__name__)
+
+SINK_HTTP = "http"
+SINK_MQTT = "mqtt"
+SINK_WEBSOCKET = "websocket"
+SINK_UNIX = "unix"
+SINKS = [SINK_HTTP, SINK_MQTT, SINK_WEBSOCKET, SINK_UNIX]
+
+STAGE_DECODE = "decode"
+STAGE_NOTIFY = "notify"
+STAGE_DELIVER = "deliver"
+
+PERCENTILES = [50, 90, 99]
+
+
+class BenchmarkBarcodeReader(BarcodeReader):
+    """
+    Barcode reader which detects fake devices instead of the input devices of the system
+    """
+
+    def __init__(self, config: AppConfig, devices: List[FakeInputDevice], directory: str):
+        super().__init__(config)
+        self.fake_devices = {device.path: device for device in devices}
+        self.directory = directory
+
+    def _watched_directories(self) -> List[Path]:
+        return [Path(self.directory)]
+
+    def _list_device_paths(self) -> List[str]:
+        return list(self.fake_devices.keys())
+
+    def _open_device(self, path: str) -> FakeInputDevice:
+        return self.fake_devices[path]
+
+
+class BenchmarkWebserver(Webserver):
+    """
+    Webserver which sends events to local sinks instead of the configured notification targets,
+    recording when an event was handed to all notifiers
+    """
+
+    def __init__(self, config: AppConfig, barcode_reader: BarcodeReader, http_url: str = None,
+                 mqtt_host: str = None, mqtt_port: int = None, unix_path: str = None):
+        """
+        :param http_url: url of the HTTP sink, None to not notify via HTTP
+        :param mqtt_host: host of the MQTT sink, None to not notify via MQTT
+        :param mqtt_port: port of the MQTT sink
+        :param unix_path: path of the Unix socket to listen on, None to not notify via a Unix socket
+        """
+        super().__init__(config, barcode_reader)
+        self.notifiers.pop("http", None)
+        self.notifiers.pop("mqtt", None)
+        self.notifiers.pop("unix", None)
+        if http_url is not None:
+            self.notifiers["http"] = self._create_http_notifier(http_url)
+        if mqtt_host is not None:
+            self.notifiers["mqtt"] = self._create_mqtt_notifier(mqtt_host, mqtt_port)
+        if unix_path is not None:
+            self.notifiers["unix"] = self._create_unix_socket_notifier(unix_path)
+        # barcode -> time.time() when it was handed to all notifiers
+        self.notified: Dict[str, float] = {}
+
+    def _create_event_queue(self, name: str) -> asyncio.Queue:
+        # the event queues of the actual notifiers on disk must not be touched
+        return self._create_memory_event_queue(name, name)
+
+    def _create_memory_event_queue(self, name: str, spill_name: str) -> EventQueue:
+        overflow_policy = self.config.EVENT_QUEUE_OVERFLOW_POLICY.value
+        if overflow_policy == OVERFLOW_POLICY_SPILL:
+            overflow_policy = OVERFLOW_POLICY_DROP_OLDEST
+        return EventQueue(name=name, max_size=self.config.EVENT_QUEUE_MAX_SIZE.value, overflow_policy=overflow_policy)
+
+    async def on_barcode(self, event: BarcodeEvent):
+        await super().on_barcode(event)
+        self.notified[event.barcode] = time.time()
+
+
+def summarize(latencies: List[float], duration: float) -> dict:
+    """
+    :param latencies: latencies of all events in seconds
+    :param duration: time it took to process all events in seconds
+    :return: throughput and latency percentiles in milliseconds
+    """
+    latencies = sorted(latencies)
+    result = {
+        "count": len(latencies),
+        "events_per_second": len(latencies) / duration if duration > 0 else 0,
+    }
+    if len(latencies) <= 0:
+        return result
+
+    result["mean_ms"] = sum(latencies) / len(latencies) * 1000
+    for p in PERCENTILES:
+        # nearest rank
+        index = max(0, -(-p * len(latencies) // 100) - 1)
+        result[f"p{p}_ms"] = latencies[index] * 1000
+    result["max_ms"] = latencies[-1] * 1000
+    return result
+
+
+def _stage(start: Dict[str, float], end: Dict[str, float]) -> dict:
+    """
+    :param start: barcode -> time an event entered a stage
+    :param end: barcode -> time an event left a stage
+    :return: summary of the stage
+    """
+    barcodes = list(filter(lambda x: x in start, end.keys()))
+    if len(barcodes) <= 0:
+        return summarize([], 0)
+    latencies = list(map(lambda x: end[x] - start[x], barcodes))
+    duration = max(map(lambda x: end[x], barcodes)) - min(map(lambda x: start[x], barcodes))
+    return summarize(latencies, duration)
+
+
+async def run_benchmark(config: AppConfig, scans: int = 1000, device_count: int = 4, sinks: List[str] = None,
+                        timeout: float = 60) -> dict:
+    """
+    Feeds synthetic scans from fake devices through the barcode reader and the webserver
+    into local stand-ins of the notification targets, measuring every stage of the pipeline
+    :param config: configuration to run the barcode-server with, notification targets are replaced by local sinks
+    :param scans: number of scans to emit
+    :param device_count: number of fake devices to emit scans from, round-robin
+    :param sinks: notification targets to send events to, defaults to all of them
+    :param timeout: time to wait for all events to arrive at every sink in seconds
+    :return: json serializable results
+    """
+    if sinks is None:
+        sinks = SINKS
+
+    directory = tempfile.mkdtemp(prefix="barcode-server-bench-")
+    devices = [FakeInputDevice(i, directory) for i in range(device_count)]
+    active_sinks: List[Sink] = []
+    runner = None
+    webserver = None
+
+    # barcode -> time.time() when it entered/left a stage
+    written: Dict[str, float] = {}
+    decoded: Dict[str, float] = {}
+    decoded_event = asyncio.Event()
+
+    async def on_decoded(event: BarcodeEvent):
+        decoded[event.barcode] = event.timestamp_us / 1000000
+        decoded_event.set()
+
+    async def wait_for_decoded(count: int):
+        while len(decoded) < count:
+            decoded_event.clear()
+            await decoded_event.wait()
+
+    try:
+        http_sink = None
+        if SINK_HTTP in sinks:
+            http_sink = HttpSink()
+            await http_sink.start()
+            active_sinks.append(http_sink)
+        mqtt_sink = None
+        if SINK_MQTT in sinks:
+            mqtt_sink = MqttBroker()
+            await mqtt_sink.start()
+            active_sinks.append(mqtt_sink)
+
+        reader = BenchmarkBarcodeReader(config, devices, directory)
+        reader.add_listener(on_decoded)
+        webserver = BenchmarkWebserver(
+            config, reader,
+            http_url=http_sink.url if http_sink is not None else None,
+            mqtt_host="127.0.0.1" if mqtt_sink is not None else None,
+            mqtt_port=mqtt_sink.port if mqtt_sink is not None else None,
+            unix_path=str(Path(directory) / "events.sock") if SINK_UNIX in sinks else None)
+        await reader.start()
+        for notifier in webserver.notifiers.values():
+            await notifier.start()
+        runner = web.AppRunner(webserver.create_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host="127.0.0.1", port=0)
+        await site.start()
+
+        if SINK_WEBSOCKET in sinks:
+            websocket_sink = WebsocketSink(
+                f"http://127.0.0.1:{runner.addresses[0][1]}/", str(uuid.uuid4()), config.SERVER_API_TOKEN.value)
+            await websocket_sink.start()
+            active_sinks.append(websocket_sink)
+        if SINK_UNIX in sinks:
+            unix_sink = UnixSocketSink(webserver.notifiers["unix"].path)
+            await unix_sink.start()
+            active_sinks.append(unix_sink)
+
+        async def wait_for_devices():
+            while len(reader.devices) < device_count:
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(wait_for_devices(), timeout)
+        # wait for the websocket client to be registered
+        await asyncio.sleep(0.1)
+
+        LOGGER.info(f"Emitting {scans} scans from {device_count} devices")
+        start = time.time()
+        for i in range(scans):
+            device = devices[i % device_count]
+            barcode = f"{i:013d}"
+            written[barcode] = time.time()
+            device.write(barcode_to_raw_events(barcode))
+            if (i + 1) % device_count == 0:
+                # one scan per device at a time, so the device buffers can't overflow
+                await asyncio.wait_for(wait_for_decoded(i + 1), timeout)
+        await asyncio.wait_for(wait_for_decoded(scans), timeout)
+
+        for sink in active_sinks:
+            try:
+                await sink.wait_for(scans, timeout)
+            except asyncio.TimeoutError:
+                LOGGER.warning(f"Only {len(sink.received)} of {scans} events arrived at the {sink.name} sink")
+        duration = time.time() - start
+
+        return {
+            "parameters": {
+                "scans": scans,
+                "devices": device_count,
+                "sinks": list(map(lambda x: x.name, active_sinks)),
+            },
+            "duration_seconds": duration,
+            "stages": {
+                STAGE_DECODE: _stage(written, decoded),
+                STAGE_NOTIFY: _stage(decoded, webserver.notified),
+                STAGE_DELIVER: {sink.name: _stage(written, sink.received) for sink in active_sinks},
+            },
+        }
+    finally:
+        for sink in active_sinks:
+            if isinstance(sink, (WebsocketSink, UnixSocketSink)):
+                await sink.stop()
+        if webserver is not None:
+            for notifier in webserver.notifiers.values():
+                await notifier.stop()
+            await webserver.barcode_reader.stop()
+        if runner is not None:
+            await runner.cleanup()
+        for sink in active_sinks:
+            if not isinstance(sink, (WebsocketSink, UnixSocketSink)):
+                await sink.stop()
+        await asyncio.sleep(0)
+        for device in devices:
+            device.close()
+        shutil.rmtree(directory, ignore_errors=True)
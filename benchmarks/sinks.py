@@ -0,0 +1,243 @@
+"""
+Local stand-ins of the notification targets, used by the benchmarks and tests
+"""
+import asyncio
+import logging
+import struct
+import time
+from typing import List, Set, Dict
+
+import aiohttp
+import orjson
+from aiohttp import web
+
+from barcode_server import const
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Sink:
+    """
+    Base class for a local stand-in of a notification target, which records when each barcode arrived
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: name of the notifier sending to this sink
+        """
+        self.name = name
+        # barcode -> time.time() when it was received
+        self.received: Dict[str, float] = {}
+        self._received_event = asyncio.Event()
+
+    async def start(self):
+        raise NotImplementedError()
+
+    async def stop(self):
+        raise NotImplementedError()
+
+    def record(self, payload: bytes):
+        """
+        Records the arrival of the barcode events contained in the given payload
+        :param payload: a json event or a json array of events
+        """
+        now = time.time()
+        items = orjson.loads(payload)
+        if not isinstance(items, list):
+            items = [items]
+        for item in items:
+            self.received.setdefault(item["barcode"], now)
+        self._received_event.set()
+
+    async def wait_for(self, count: int, timeout: float):
+        """
+        Waits until the given number of distinct barcodes was received
+        """
+
+        async def wait():
+            while len(self.received) < count:
+                self._received_event.clear()
+                await self._received_event.wait()
+
+        await asyncio.wait_for(wait(), timeout)
+
+
+class HttpSink(Sink):
+    """
+    HTTP server accepting the requests of the HTTP notifier
+    """
+
+    def __init__(self):
+        super().__init__("http")
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host="127.0.0.1", port=0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self._runner.addresses[0][1]}/"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.record(await request.read())
+        return web.Response()
+
+
+class MqttBroker(Sink):
+    """
+    Minimal in-process MQTT 3.1.1 broker, which only accepts published messages
+    """
+
+    def __init__(self):
+        super().__init__("mqtt")
+        self.connection_count = 0
+        self.messages: List[bytes] = []
+        self.message_received = asyncio.Event()
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._server = None
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, host="127.0.0.1", port=0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.disconnect_all()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def disconnect_all(self):
+        for writer in self._writers:
+            writer.close()
+        self._writers.clear()
+
+    @staticmethod
+    async def _read_packet(reader: asyncio.StreamReader) -> (int, int, bytes):
+        header = (await reader.readexactly(1))[0]
+        length, multiplier = 0, 1
+        while True:
+            digit = (await reader.readexactly(1))[0]
+            length += (digit & 0x7f) * multiplier
+            multiplier *= 128
+            if digit & 0x80 == 0:
+                break
+        return header >> 4, header & 0x0f, await reader.readexactly(length)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                packet_type, flags, body = await self._read_packet(reader)
+                if packet_type == 1:
+                    # CONNECT -> CONNACK
+                    self.connection_count += 1
+                    writer.write(bytes([0x20, 0x02, 0x00, 0x00]))
+                elif packet_type == 3:
+                    # PUBLISH
+                    qos = (flags >> 1) & 0x03
+                    topic_length = struct.unpack(">H", body[:2])[0]
+                    offset = 2 + topic_length
+                    if qos > 0:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        # PUBACK or PUBREC
+                        writer.write(bytes([0x40 if qos == 1 else 0x50, 0x02]) + packet_id)
+                    self.messages.append(body[offset:])
+                    self.message_received.set()
+                    self.record(body[offset:])
+                elif packet_type == 6:
+                    # PUBREL -> PUBCOMP
+                    writer.write(bytes([0x70, 0x02]) + body[:2])
+                elif packet_type == 12:
+                    # PINGREQ -> PINGRESP
+                    writer.write(bytes([0xd0, 0x00]))
+                elif packet_type == 14:
+                    # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def wait_for_messages(self, count: int, timeout: float = 10):
+        async def wait():
+            while len(self.messages) < count:
+                self.message_received.clear()
+                await self.message_received.wait()
+
+        await asyncio.wait_for(wait(), timeout)
+
+
+class UnixSocketSink(Sink):
+    """
+    Local process subscribed to the Unix socket of the barcode-server
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the Unix socket of the barcode-server
+        """
+        super().__init__("unix")
+        self.path = path
+        self._writer = None
+        self._task = None
+
+    async def start(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._task = asyncio.create_task(self._receive(reader))
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        while True:
+            length = struct.unpack(">I", await reader.readexactly(4))[0]
+            self.record(await reader.readexactly(length))
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._writer.close()
+
+
+class WebsocketSink(Sink):
+    """
+    Websocket client connected to the barcode-server
+    """
+
+    def __init__(self, url: str, client_id: str, api_token: str = None):
+        """
+        :param url: url of the websocket endpoint of the barcode-server
+        :param client_id: client id to connect with
+        :param api_token: api token of the barcode-server, if any
+        """
+        super().__init__("websocket")
+        self.url = url
+        self.client_id = client_id
+        self.api_token = api_token
+        self._session = None
+        self._task = None
+
+    async def start(self):
+        self._session = aiohttp.ClientSession()
+        headers = {const.Client_Id: self.client_id}
+        if self.api_token is not None:
+            headers[const.X_Auth_Token] = self.api_token
+        websocket = await self._session.ws_connect(self.url, headers=headers)
+        self._task = asyncio.create_task(self._receive(websocket))
+
+    async def _receive(self, websocket):
+        async with websocket:
+            async for msg in websocket:
+                if msg.type in [aiohttp.WSMsgType.BINARY, aiohttp.WSMsgType.TEXT]:
+                    self.record(msg.data)
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self._session.close()
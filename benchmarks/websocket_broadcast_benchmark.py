@@ -0,0 +1,115 @@
+"""
+Load test of the websocket delivery path: connects many local websocket clients
+and measures the latency from a scan to its delivery to every client,
+comparing the broadcast hub to queueing the event for every client individually.
+
+Run from the repository root:
+
+    python -m benchmarks.websocket_broadcast_benchmark [client count]
+"""
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from typing import List, Tuple
+from unittest.mock import MagicMock
+
+import aiohttp
+from aiohttp import web
+
+from barcode_server import const
+from barcode_server.util import barcode_event_to_json
+from barcode_server.webserver import Webserver
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+CLIENTS = 1000
+SCANS = 50
+SCAN_INTERVAL = 0.2
+
+
+class QueueingWebserver(Webserver):
+    """
+    Queues every event for every client, like before the broadcast hub
+    """
+
+    async def on_barcode(self, event):
+        for key, notifier in list(self.notifiers.items()) + list(self.client_notifiers.items()):
+            await notifier.add_event(event)
+
+
+def percentile(values: list, p: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[int(p) - 1] if p < 100 else max(values)
+
+
+async def measure(webserver_type: type, client_count: int) -> Tuple[List[float], List[float]]:
+    """
+    Runs the given webserver, connects clients and emits scans
+    :return: tuple of (scan to delivery latencies, time spent in on_barcode) in milliseconds
+    """
+    config = TestBase.config
+    webserver = webserver_type(config, MagicMock())
+    runner = web.AppRunner(webserver.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host="127.0.0.1", port=0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    # event json -> time of the scan
+    scan_times = {}
+    latencies = []
+    broadcast_times = []
+    received = asyncio.Event()
+
+    async def client(session: aiohttp.ClientSession, connected: asyncio.Future):
+        async with session.ws_connect(f"http://127.0.0.1:{port}/", headers={
+            const.Client_Id: str(uuid.uuid4()),
+            const.X_Auth_Token: config.SERVER_API_TOKEN.value or "",
+        }) as ws:
+            connected.set_result(None)
+            async for msg in ws:
+                latencies.append((time.perf_counter() - scan_times[msg.data]) * 1000)
+                if len(latencies) >= client_count * SCANS:
+                    received.set()
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        connected = [asyncio.get_running_loop().create_future() for _ in range(client_count)]
+        clients = [asyncio.create_task(client(session, c)) for c in connected]
+        await asyncio.gather(*connected)
+        # wait for the server to register all clients
+        await asyncio.sleep(0.5)
+
+        for i in range(SCANS):
+            event = create_barcode_event_mock(f"{i:013d}")
+            # computed upfront, it is cached on the event
+            json = barcode_event_to_json(config.INSTANCE_ID.value, event)
+            start = time.perf_counter()
+            scan_times[json] = start
+            await webserver.on_barcode(event)
+            broadcast_times.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(SCAN_INTERVAL)
+
+        await asyncio.wait_for(received.wait(), 60)
+        for c in clients:
+            c.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+
+    for notifier in list(webserver.notifiers.values()) + list(webserver.client_notifiers.values()):
+        await notifier.stop()
+    await runner.cleanup()
+    return latencies, broadcast_times
+
+
+async def main(client_count: int = CLIENTS):
+    print(f"{client_count} clients, {SCANS} scans")
+    print(f"{'':>10} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'on_barcode':>11}")
+    for name, webserver_type in [("queueing", QueueingWebserver), ("broadcast", Webserver)]:
+        latencies, broadcast_times = await measure(webserver_type, client_count)
+        print(f"{name:>10} " + " ".join(map(
+            lambda p: f"{percentile(latencies, p):>6.2f} ms", [50, 90, 99, 100]))
+              + f" {statistics.median(broadcast_times):>8.2f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*map(int, sys.argv[1:])))
@@ -1,21 +1,28 @@
 from datetime import datetime
 from unittest.mock import Mock
 
+import orjson
+
 from barcode_server.barcode import BarcodeEvent
-from barcode_server.util import barcode_event_to_json
+from barcode_server.util import barcode_event_to_json, barcode_events_to_json
 from tests import TestBase
 
 
 class ApiTest(TestBase):
 
-    def test_json(self):
-        date_str = "2020-08-03T10:00:00+00:00"
-
+    @staticmethod
+    def create_input_device_mock() -> Mock:
         input_device = Mock()
         input_device.name = "Barcode Scanner"
         input_device.path = "/dev/input/event2"
         input_device.info.vendor = 1
         input_device.info.product = 2
+        return input_device
+
+    def test_json(self):
+        date_str = "2020-08-03T10:00:00+00:00"
+
+        input_device = self.create_input_device_mock()
 
         date = datetime.fromisoformat(str(date_str))
         barcode = "4006824000970"
@@ -30,3 +37,21 @@ class ApiTest(TestBase):
         self.assertIn(input_device.path, event_json)
         self.assertIn(barcode, event_json)
         self.assertIsNotNone(event_json)
+
+    def test_json_is_cached_per_server_id(self):
+        event = BarcodeEvent(self.create_input_device_mock(), "4006824000970")
+
+        json = barcode_event_to_json("server-id", event)
+
+        self.assertIs(json, barcode_event_to_json("server-id", event))
+        self.assertNotEqual(json, barcode_event_to_json("other-server-id", event))
+
+    def test_json_array(self):
+        events = [BarcodeEvent(self.create_input_device_mock(), f"{i}") for i in range(3)]
+
+        json = barcode_events_to_json("server-id", events)
+
+        self.assertEqual(
+            list(map(lambda x: orjson.loads(barcode_event_to_json("server-id", x)), events)),
+            orjson.loads(json))
+        self.assertEqual(b"[]", barcode_events_to_json("server-id", []))
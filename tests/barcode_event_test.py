@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+
+from barcode_server.barcode import BarcodeEvent
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class BarcodeEventTest(TestBase):
+
+    async def test_compact(self):
+        event = create_barcode_event_mock()
+        self.assertFalse(hasattr(event, "__dict__"))
+        self.assertIsNone(event.payloads)
+        self.assertIsNone(event.enqueue_times)
+
+    async def test_device_is_interned(self):
+        first = create_barcode_event_mock("1")
+        second = create_barcode_event_mock("2")
+        other = create_barcode_event_mock("3", device_path="/dev/input/event4")
+
+        self.assertIs(first.input_device, second.input_device)
+        self.assertIsNot(first.input_device, other.input_device)
+        self.assertIs(first.input_device, BarcodeEvent(first.input_device, "4").input_device)
+
+    async def test_ids_sort_by_time(self):
+        events = [create_barcode_event_mock() for _ in range(100)]
+        ids = list(map(lambda x: x.id, events))
+
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(100, len(set(ids)))
+        self.assertEqual("7", ids[0][14])
+
+    async def test_date(self):
+        date = datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+        event = BarcodeEvent(create_barcode_event_mock().input_device, "1", date)
+
+        self.assertEqual(date, event.date)
+        self.assertEqual(date.isoformat(), event.date.isoformat())
+        self.assertEqual(round(date.timestamp() * 1000000), event.timestamp_us)
+
+        local = datetime(2026, 1, 2, 3, 4, 5, 678901)
+        event.date = local
+        self.assertEqual(local, event.date)
@@ -1,11 +1,156 @@
+import asyncio
+import os
+import tempfile
+from typing import List
+
 from barcode_server.barcode import BarcodeReader
 from barcode_server.config import AppConfig
+from benchmarks.devices import FakeInputDevice, barcode_to_raw_events
 from tests import TestBase
 
 
 class BarcodeReaderTest(TestBase):
 
+    @staticmethod
+    def _use_fake_devices(reader: BarcodeReader, devices: List[FakeInputDevice], directory: str = None):
+        """
+        Makes the given reader detect the given fake devices
+        :param reader: the reader under test
+        :param devices: fake devices, which might be extended later on to simulate plugging in a device
+        :param directory: directory of the fake device nodes to watch, for hotplug detection
+        """
+        reader._list_device_paths = lambda: list(map(
+            lambda x: x.path, filter(lambda x: os.path.exists(x.path), devices)))
+        reader._open_device = lambda path: next(filter(lambda x: x.path == path, devices))
+        if directory is not None:
+            reader._watched_directories = lambda: [directory]
+
     async def test_initialization(self):
         config = AppConfig()
         reader = BarcodeReader(config)
         self.assertIsNotNone(reader)
+
+    async def test_many_devices(self):
+        # GIVEN
+        device_count = 128
+        rounds = 5
+        devices = [FakeInputDevice(i) for i in range(device_count)]
+        reader = BarcodeReader(AppConfig())
+        self._use_fake_devices(reader, devices)
+
+        received = []
+        received_count = asyncio.Event()
+
+        async def listener(event):
+            received.append((event.input_device.path, event.barcode))
+            if len(received) % device_count == 0:
+                received_count.set()
+
+        reader.add_listener(listener)
+
+        # WHEN
+        await reader.start()
+        expected = []
+        try:
+            await asyncio.sleep(0.1)
+            for i in range(rounds):
+                received_count.clear()
+                for d in devices:
+                    barcode = f"{d.info.product:06d}{i:07d}"
+                    expected.append((d.path, barcode))
+                    d.write(barcode_to_raw_events(barcode))
+                await asyncio.wait_for(received_count.wait(), timeout=10)
+        finally:
+            await reader.stop()
+            await asyncio.sleep(0)
+            for d in devices:
+                d.close()
+                d.unplug()
+
+        # THEN
+        self.assertEqual(sorted(expected), sorted(received))
+        self.assertTrue(all(map(lambda x: not x.grabbed, devices)))
+
+    async def test_concurrent_devices_do_not_interleave(self):
+        # GIVEN
+        device_count = 16
+        devices = [FakeInputDevice(i) for i in range(device_count)]
+        reader = BarcodeReader(AppConfig())
+        self._use_fake_devices(reader, devices)
+
+        received = []
+        all_received = asyncio.Event()
+
+        async def listener(event):
+            received.append((event.input_device.path, event.barcode))
+            if len(received) == device_count:
+                all_received.set()
+
+        reader.add_listener(listener)
+
+        expected = {d.path: f"{d.info.product:04d}{d.info.product:09d}" for d in devices}
+        streams = {d.path: barcode_to_raw_events(expected[d.path]) for d in devices}
+
+        # WHEN
+        await reader.start()
+        try:
+            await asyncio.sleep(0.1)
+            # emit the key events of all devices interleaved, one at a time,
+            # as if all scanners fired simultaneously
+            for i in range(len(streams[devices[0].path])):
+                for d in devices:
+                    d.write([streams[d.path][i]])
+                await asyncio.sleep(0)
+            await asyncio.wait_for(all_received.wait(), timeout=10)
+        finally:
+            await reader.stop()
+            await asyncio.sleep(0)
+            for d in devices:
+                d.close()
+                d.unplug()
+
+        # THEN
+        self.assertEqual(sorted(expected.items()), sorted(received))
+
+    async def test_hotplug(self):
+        # GIVEN
+        with tempfile.TemporaryDirectory() as directory:
+            devices = [FakeInputDevice(0, directory)]
+            reader = BarcodeReader(AppConfig())
+            self._use_fake_devices(reader, devices, directory)
+            opened = []
+            open_device = reader._open_device
+            reader._open_device = lambda path: opened.append(path) or open_device(path)
+
+            received = asyncio.Queue()
+
+            async def listener(event):
+                await received.put((event.input_device.path, event.barcode))
+
+            reader.add_listener(listener)
+
+            # WHEN
+            await reader.start()
+            try:
+                await asyncio.sleep(0.1)
+                self.assertEqual([devices[0].path], list(reader.devices.keys()))
+
+                # plug in a device
+                devices.append(FakeInputDevice(1, directory))
+                await asyncio.sleep(0.1)
+                devices[1].write(barcode_to_raw_events("123"))
+                self.assertEqual((devices[1].path, "123"), await asyncio.wait_for(received.get(), timeout=1))
+
+                # unplug a device
+                devices[0].unplug()
+                await asyncio.sleep(0.1)
+                self.assertEqual([devices[1].path], list(reader.devices.keys()))
+            finally:
+                await reader.stop()
+                await asyncio.sleep(0)
+                for d in devices:
+                    d.close()
+
+            # THEN
+            # only the added device was opened, known devices were not opened again
+            self.assertEqual([devices[0].path, devices[1].path], opened)
@@ -0,0 +1,23 @@
+from benchmarks.pipeline import run_benchmark, summarize, SINKS
+from tests import TestBase
+
+
+class BenchTest(TestBase):
+
+    async def test_summarize(self):
+        result = summarize(list(map(lambda x: x / 1000, range(1, 101))), 2)
+
+        self.assertEqual(100, result["count"])
+        self.assertEqual(50, result["events_per_second"])
+        self.assertAlmostEqual(50, result["p50_ms"])
+        self.assertAlmostEqual(99, result["p99_ms"])
+        self.assertAlmostEqual(100, result["max_ms"])
+
+    async def test_run_benchmark(self):
+        results = await run_benchmark(self.config, scans=8, device_count=2, timeout=10)
+
+        self.assertEqual(SINKS, results["parameters"]["sinks"])
+        self.assertEqual(8, results["stages"]["decode"]["count"])
+        self.assertEqual(8, results["stages"]["notify"]["count"])
+        for sink in SINKS:
+            self.assertEqual(8, results["stages"]["deliver"][sink]["count"])
@@ -0,0 +1,60 @@
+import orjson
+
+from barcode_server.device_registry import DeviceRegistry
+from barcode_server.util import input_device_to_dict
+from tests import TestBase
+
+
+class FakeInputDevice:
+    class Info:
+        def __init__(self, vendor: int, product: int):
+            self.vendor = vendor
+            self.product = product
+
+    def __init__(self, path: str, name: str = "Barcode Scanner", phys: str = "usb-0000:00:14.0-1/input0"):
+        self.name = name
+        self.path = path
+        self.phys = phys
+        self.info = self.Info(vendor=0x0c2e, product=0x0b61)
+
+
+class DeviceRegistryTest(TestBase):
+
+    async def test_known_nodes(self):
+        under_test = DeviceRegistry()
+        under_test.add("/dev/input/event1", 10, FakeInputDevice("/dev/input/event1", name="Keyboard"), False)
+        under_test.add("/dev/input/event2", 11, FakeInputDevice("/dev/input/event2"), True)
+
+        self.assertTrue(under_test.is_known("/dev/input/event1", 10))
+        self.assertFalse(under_test.is_known("/dev/input/event1", 12))
+        self.assertFalse(under_test.is_known("/dev/input/event3", 10))
+        self.assertEqual(["/dev/input/event2"], list(under_test.devices.keys()))
+
+    async def test_devices_json_is_cached(self):
+        under_test = DeviceRegistry()
+        device = FakeInputDevice("/dev/input/event2")
+        under_test.add(device.path, 11, device, True)
+
+        json = under_test.devices_json()
+        self.assertIs(json, under_test.devices_json())
+        self.assertEqual([input_device_to_dict(device)], orjson.loads(json))
+
+        under_test.remove(device.path)
+        self.assertEqual([], orjson.loads(under_test.devices_json()))
+
+    async def test_same_device_on_new_node_keeps_metadata(self):
+        under_test = DeviceRegistry()
+        path = "/dev/input/event2"
+        metadata = under_test.add(path, 11, FakeInputDevice(path), True)
+        json = under_test.devices_json()
+
+        under_test.invalidate(path)
+        self.assertFalse(under_test.is_known(path, 11))
+        self.assertEqual({}, under_test.devices)
+
+        self.assertIs(metadata, under_test.add(path, 12, FakeInputDevice(path), True))
+        self.assertEqual(json, under_test.devices_json())
+
+        # a different device on the same port
+        other = under_test.add(path, 13, FakeInputDevice(path, phys="usb-0000:00:14.0-2/input0"), True)
+        self.assertIsNot(metadata, other)
@@ -0,0 +1,67 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+
+from barcode_server.dispatch import EventDispatcher
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class EventDispatcherTest(TestBase):
+
+    async def asyncSetUp(self):
+        self.under_test = EventDispatcher(max_size=2)
+
+    async def asyncTearDown(self):
+        await self.under_test.stop()
+
+    async def test_events_are_dispatched_in_order(self):
+        events = [create_barcode_event_mock(f"{i}") for i in range(10)]
+        received = []
+
+        async def slow_listener(event):
+            # earlier events take longer, so they would be overtaken if dispatched concurrently
+            await asyncio.sleep(0.001 * (10 - int(event.barcode)))
+            received.append(event)
+
+        self.under_test.add_listener(slow_listener)
+        await self.under_test.start()
+        for event in events:
+            await self.under_test.dispatch(event)
+        await asyncio.wait_for(self.under_test.join(), 1)
+
+        self.assertEqual(events, received)
+
+    async def test_failing_listener(self):
+        received = []
+
+        async def failing_listener(event):
+            raise ValueError(event.barcode)
+
+        async def listener(event):
+            received.append(event)
+
+        self.under_test.add_listener(failing_listener)
+        self.under_test.add_listener(listener)
+        await self.under_test.start()
+        events = [create_barcode_event_mock(f"{i}") for i in range(2)]
+        for event in events:
+            await self.under_test.dispatch(event)
+        await asyncio.wait_for(self.under_test.join(), 1)
+
+        self.assertEqual(events, received)
+        self.assertEqual(2, REGISTRY.get_sample_value(
+            "dispatch_listener_errors_total",
+            {"listener": "EventDispatcherTest.test_failing_listener.<locals>.failing_listener"}))
+
+    async def test_backpressure(self):
+        # the consumer is not started, so the queue fills up
+        for i in range(2):
+            await self.under_test.dispatch(create_barcode_event_mock(f"{i}"))
+
+        blocked = asyncio.create_task(self.under_test.dispatch(create_barcode_event_mock("2")))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked.done())
+
+        await self.under_test.start()
+        await asyncio.wait_for(blocked, 1)
@@ -0,0 +1,134 @@
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from prometheus_client import REGISTRY
+
+from barcode_server.notifier.event_queue import EventQueue, OVERFLOW_POLICY_DROP_OLDEST, \
+    OVERFLOW_POLICY_DROP_NEWEST, OVERFLOW_POLICY_SPILL, COMPACTION_THRESHOLD
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class EventQueueTest(TestBase):
+
+    async def test_drop_oldest(self):
+        under_test = EventQueue(name="test-drop-oldest", max_size=3, overflow_policy=OVERFLOW_POLICY_DROP_OLDEST)
+        events = [create_barcode_event_mock(f"{i}") for i in range(5)]
+
+        for event in events:
+            await under_test.put(event)
+
+        self.assertEqual(events[2:], [under_test.get_nowait() for _ in range(under_test.qsize())])
+        self.assertEqual(2, REGISTRY.get_sample_value("notifier_queue_evictions_total", {"type": "test-drop-oldest"}))
+
+    async def test_drop_newest(self):
+        under_test = EventQueue(name="test-drop-newest", max_size=3, overflow_policy=OVERFLOW_POLICY_DROP_NEWEST)
+        events = [create_barcode_event_mock(f"{i}") for i in range(5)]
+
+        for event in events:
+            await under_test.put(event)
+
+        self.assertEqual(events[:3], [under_test.get_nowait() for _ in range(under_test.qsize())])
+        self.assertEqual(2, REGISTRY.get_sample_value("notifier_queue_evictions_total", {"type": "test-drop-newest"}))
+
+    async def test_spill(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spill_path = Path(directory) / "spill"
+            under_test = EventQueue(name="test-spill", max_size=3, overflow_policy=OVERFLOW_POLICY_SPILL,
+                                    spill_path=spill_path)
+            events = [create_barcode_event_mock(f"{i}") for i in range(10)]
+
+            for event in events[:5]:
+                await under_test.put(event)
+            self.assertEqual(5, under_test.qsize())
+            self.assertEqual(5, REGISTRY.get_sample_value("notifier_queue_depth", {"type": "test-spill"}))
+
+            # events added while some are spilled must not overtake them
+            received = [await under_test.get() for _ in range(4)]
+            for event in events[5:]:
+                await under_test.put(event)
+            while not under_test.empty():
+                received.append(await under_test.get())
+                under_test.task_done()
+
+            self.assertEqual(list(map(lambda x: x.id, events)), list(map(lambda x: x.id, received)))
+            self.assertEqual(0, REGISTRY.get_sample_value("notifier_queue_depth", {"type": "test-spill"}))
+            under_test.close(delete=True)
+            self.assertFalse(spill_path.exists())
+
+    async def test_oldest_event_age(self):
+        under_test = EventQueue(name="test-age")
+        event = create_barcode_event_mock()
+        event.date = datetime.now() - timedelta(minutes=1)
+
+        await under_test.put(event)
+        await under_test.put(create_barcode_event_mock())
+
+        age = REGISTRY.get_sample_value("notifier_queue_oldest_event_age_seconds", {"type": "test-age"})
+        self.assertAlmostEqual(60, age, delta=1)
+
+    async def test_drop_expired(self):
+        under_test = EventQueue(name="test-expired")
+        now = datetime.now()
+        events = [create_barcode_event_mock(f"{i}") for i in range(6)]
+        for i, event in enumerate(events):
+            event.date = now - timedelta(minutes=10 - i)
+        # an event added out of order is sorted in by its date
+        late = events.pop(1)
+        for event in events + [late]:
+            await under_test.put(event)
+        under_test.get_nowait()
+
+        dropped = under_test.drop_expired(now - timedelta(minutes=7))
+
+        self.assertEqual(3, dropped)
+        self.assertEqual(["4", "5"], [under_test.get_nowait().barcode for _ in range(under_test.qsize())])
+        self.assertEqual(0, REGISTRY.get_sample_value("notifier_queue_depth", {"type": "test-expired"}))
+
+    async def test_drop_expired_compacts_lazily(self):
+        under_test = EventQueue()
+        now = datetime.now()
+        events = [create_barcode_event_mock(f"{i}") for i in range(COMPACTION_THRESHOLD * 3)]
+        for i, event in enumerate(events):
+            event.date = now - timedelta(seconds=len(events) - i)
+            await under_test.put(event)
+
+        self.assertEqual(10, under_test.drop_expired(events[9].date))
+        # only the index of the first event moved
+        self.assertEqual(10, under_test._head)
+        self.assertEqual(len(events), len(under_test._events))
+        self.assertEqual("10", under_test.get_nowait().barcode)
+
+        under_test.drop_expired(events[COMPACTION_THRESHOLD * 2].date)
+        # most of the list was consumed, so it is compacted
+        self.assertEqual(0, under_test._head)
+        self.assertEqual(COMPACTION_THRESHOLD - 1, under_test.qsize())
+        self.assertEqual(str(COMPACTION_THRESHOLD * 2 + 1), under_test.get_nowait().barcode)
+
+    async def test_clear(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spill_path = Path(directory) / "spill"
+            under_test = EventQueue(name="test-clear", max_size=2, overflow_policy=OVERFLOW_POLICY_SPILL,
+                                    spill_path=spill_path)
+            for i in range(5):
+                await under_test.put(create_barcode_event_mock(f"{i}"))
+
+            under_test.clear()
+
+            self.assertTrue(under_test.empty())
+            self.assertFalse(spill_path.exists())
+            self.assertEqual(0, REGISTRY.get_sample_value("notifier_queue_depth", {"type": "test-clear"}))
+            await under_test.join()
+
+    async def test_event_ages(self):
+        under_test = EventQueue(name="test-ages")
+        now = datetime.now()
+        for i in range(101):
+            event = create_barcode_event_mock()
+            event.date = now - timedelta(seconds=100 - i)
+            await under_test.put(event)
+
+        self.assertEqual([0, 50, 90, 100], under_test.event_ages([0, 0.5, 0.9, 1], now))
+        age = REGISTRY.get_sample_value("notifier_queue_event_age_seconds", {"type": "test-ages", "quantile": "0.9"})
+        self.assertAlmostEqual(90, age, delta=1)
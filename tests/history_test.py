@@ -0,0 +1,206 @@
+import sqlite3
+import tempfile
+import uuid
+from datetime import timedelta, datetime
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import orjson
+from aiohttp.test_utils import AioHTTPTestCase
+
+from barcode_server import const
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.history import EventHistory
+from barcode_server.webserver import Webserver
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class EventHistoryTest(TestBase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.under_test = EventHistory(
+            str(Path(self.directory.name) / "history.db"), self.config.INSTANCE_ID.value,
+            retention=timedelta(days=1), batch_size=3)
+        await self.under_test.start()
+
+    async def asyncTearDown(self):
+        await self.under_test.stop()
+        self.directory.cleanup()
+
+    async def test_query(self):
+        events = [create_barcode_event_mock(f"{i % 2}") for i in range(4)]
+        events.append(create_barcode_event_mock("0", device_path="/dev/input/event4"))
+        for event in events:
+            self.under_test.add(event)
+
+        found, cursor = await self.under_test.query(barcode="0")
+        self.assertEqual([events[4].id, events[2].id, events[0].id], list(map(lambda x: orjson.loads(x)["id"], found)))
+        self.assertIsNone(cursor)
+
+        found, cursor = await self.under_test.query(barcode="0", device="/dev/input/event3")
+        self.assertEqual([events[2].id, events[0].id], list(map(lambda x: orjson.loads(x)["id"], found)))
+
+        found, cursor = await self.under_test.query(since=events[1].timestamp_us, until=events[3].timestamp_us)
+        self.assertEqual([events[2].id, events[1].id], list(map(lambda x: orjson.loads(x)["id"], found)))
+
+    async def test_query_time_range(self):
+        events = [create_barcode_event_mock(f"{i}") for i in range(6)]
+        for i, event in enumerate(events):
+            event.timestamp_us = events[0].timestamp_us + i * 1000
+            self.under_test.add(event)
+
+        found, cursor = await self.under_test.query(since=events[1].timestamp_us, until=events[3].timestamp_us, limit=1)
+        self.assertEqual([events[2].id], list(map(lambda x: orjson.loads(x)["id"], found)))
+        found, cursor = await self.under_test.query(since=events[1].timestamp_us, until=events[3].timestamp_us,
+                                                    cursor=cursor)
+        self.assertEqual([events[1].id], list(map(lambda x: orjson.loads(x)["id"], found)))
+        self.assertIsNone(cursor)
+
+        found, cursor = await self.under_test.query(since=events[5].timestamp_us + 1)
+        self.assertEqual([], found)
+        found, cursor = await self.under_test.query(until=events[0].timestamp_us)
+        self.assertEqual([], found)
+
+    async def test_events_recorded_after_a_clock_reset(self):
+        before = create_barcode_event_mock("before")
+        # the clock was set back before a restart, so the sequence number and time repeat those of an earlier event
+        after = create_barcode_event_mock("after")
+        after.seq = before.seq
+        after.id = str(uuid.uuid4())
+        after.timestamp_us = before.timestamp_us - 1000
+        self.under_test.add(before)
+        self.under_test.add(after)
+
+        found, cursor = await self.under_test.query()
+        self.assertEqual(["after", "before"], list(map(lambda x: orjson.loads(x)["barcode"], found)))
+        found, cursor = await self.under_test.query(until=before.timestamp_us)
+        self.assertEqual(["after"], list(map(lambda x: orjson.loads(x)["barcode"], found)))
+
+    async def test_reader_does_not_set_up_the_database(self):
+        path = str(Path(self.directory.name) / "reader.db")
+        reader = EventHistory(path, self.config.INSTANCE_ID.value, writer=False)
+        await reader.start()
+        try:
+            with sqlite3.connect(path) as connection:
+                self.assertEqual([], connection.execute("SELECT name FROM sqlite_master").fetchall())
+                self.assertEqual("delete", connection.execute("PRAGMA journal_mode").fetchone()[0])
+
+            writer = EventHistory(path, self.config.INSTANCE_ID.value)
+            await writer.start()
+            try:
+                writer.add(create_barcode_event_mock("0"))
+                await writer.flush()
+                found, cursor = await reader.query()
+                self.assertEqual(["0"], list(map(lambda x: orjson.loads(x)["barcode"], found)))
+            finally:
+                await writer.stop()
+        finally:
+            await reader.stop()
+
+    async def test_pagination(self):
+        events = [create_barcode_event_mock(f"{i}") for i in range(5)]
+        for event in events:
+            self.under_test.add(event)
+
+        pages = []
+        cursor = None
+        while True:
+            found, cursor = await self.under_test.query(cursor=cursor, limit=2)
+            pages.append(list(map(lambda x: orjson.loads(x)["barcode"], found)))
+            if cursor is None:
+                break
+
+        self.assertEqual([["4", "3"], ["2", "1"], ["0"]], pages)
+
+    async def test_retention(self):
+        device = create_barcode_event_mock().input_device
+        old = BarcodeEvent(device, "old", datetime.now() - timedelta(days=2))
+        new = BarcodeEvent(device, "new")
+        self.under_test.add(old)
+        self.under_test.add(new)
+        await self.under_test.flush()
+
+        self.assertEqual(1, await self.under_test.apply_retention())
+        found, cursor = await self.under_test.query()
+        self.assertEqual(["new"], list(map(lambda x: orjson.loads(x)["barcode"], found)))
+
+    async def test_failed_insert_is_retried(self):
+        events = [create_barcode_event_mock(f"{i}") for i in range(2)]
+        for event in events:
+            self.under_test.add(event)
+
+        with patch.object(self.under_test, "_insert", side_effect=sqlite3.OperationalError("database is locked")):
+            with self.assertRaises(sqlite3.OperationalError):
+                await self.under_test.flush()
+
+        found, cursor = await self.under_test.query()
+        self.assertEqual(["1", "0"], list(map(lambda x: orjson.loads(x)["barcode"], found)))
+
+    async def test_events_are_recorded_once(self):
+        event = create_barcode_event_mock()
+        self.under_test.add(event)
+        await self.under_test.flush()
+        self.under_test.add(event)
+
+        found, cursor = await self.under_test.query()
+        self.assertEqual(1, len(found))
+
+
+class EventsEndpointTest(AioHTTPTestCase):
+    from barcode_server.config import AppConfig
+    from container_app_conf.source.yaml_source import YamlSource
+
+    # load config from test folder
+    config = AppConfig(
+        singleton=True,
+        data_sources=[
+            YamlSource("barcode_server", "./tests/")
+        ]
+    )
+
+    async def get_application(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.webserver = Webserver(self.config, MagicMock())
+        self.webserver.history = EventHistory(
+            str(Path(self.directory.name) / "history.db"), self.config.INSTANCE_ID.value)
+        await self.webserver.history.start()
+        return self.webserver.create_app()
+
+    async def asyncTearDown(self):
+        await super().asyncTearDown()
+        await self.webserver.history.stop()
+        self.directory.cleanup()
+
+    def _headers(self) -> dict:
+        return {
+            const.Client_Id: "history-client",
+            const.X_Auth_Token: self.config.SERVER_API_TOKEN.value,
+        }
+
+    async def test_events(self):
+        events = [create_barcode_event_mock(f"{i}") for i in range(3)]
+        for event in events:
+            await self.webserver.on_barcode(event)
+
+        response = await self.client.get(f"/{const.ENDPOINT_EVENTS}", headers=self._headers(), params={"limit": 2})
+        self.assertEqual(200, response.status)
+        page = await response.json()
+        self.assertEqual(["2", "1"], list(map(lambda x: x["barcode"], page["events"])))
+
+        response = await self.client.get(f"/{const.ENDPOINT_EVENTS}", headers=self._headers(),
+                                         params={"limit": 2, "cursor": page["next"]})
+        page = await response.json()
+        self.assertEqual(["0"], list(map(lambda x: x["barcode"], page["events"])))
+        self.assertIsNone(page["next"])
+
+        response = await self.client.get(f"/{const.ENDPOINT_EVENTS}", headers=self._headers(), params={
+            "barcode": "1", "since": events[0].date.isoformat()})
+        page = await response.json()
+        self.assertEqual([events[1].id], list(map(lambda x: x["id"], page["events"])))
+
+    async def test_invalid_parameters(self):
+        response = await self.client.get(f"/{const.ENDPOINT_EVENTS}", headers=self._headers(),
+                                         params={"since": "yesterday"})
+        self.assertEqual(400, response.status)
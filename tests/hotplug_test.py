@@ -0,0 +1,47 @@
+import tempfile
+from pathlib import Path
+
+from barcode_server.hotplug import DeviceNodeWatcher
+from tests import TestBase
+
+
+class DeviceNodeWatcherTest(TestBase):
+
+    async def test_added_and_removed_nodes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            under_test = DeviceNodeWatcher([Path(directory)])
+            self.assertTrue(under_test.start())
+            try:
+                node = Path(directory) / "event0"
+                node.touch()
+                self.assertEqual({str(node)}, await under_test.wait_for_changes(1))
+
+                node.unlink()
+                self.assertEqual({str(node)}, await under_test.wait_for_changes(1))
+            finally:
+                under_test.close()
+
+    async def test_timeout_requests_full_scan(self):
+        with tempfile.TemporaryDirectory() as directory:
+            under_test = DeviceNodeWatcher([Path(directory)])
+            self.assertTrue(under_test.start())
+            try:
+                self.assertIsNone(await under_test.wait_for_changes(0.01))
+            finally:
+                under_test.close()
+
+    async def test_directory_created_later(self):
+        with tempfile.TemporaryDirectory() as directory:
+            by_id = Path(directory) / "by-id"
+            under_test = DeviceNodeWatcher([by_id])
+            self.assertTrue(under_test.start())
+            try:
+                by_id.mkdir()
+                # nodes might have been created before the directory was watched
+                self.assertIsNone(await under_test.wait_for_changes(1))
+
+                node = by_id / "usb-scanner-event-kbd"
+                node.touch()
+                self.assertEqual({str(node)}, await under_test.wait_for_changes(1))
+            finally:
+                under_test.close()
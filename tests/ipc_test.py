@@ -0,0 +1,149 @@
+import asyncio
+import os
+import stat
+import tempfile
+import time
+from pathlib import Path
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from barcode_server.barcode import BarcodeReader
+from barcode_server.ipc import EventPublisher, RemoteBarcodeReader, DeliveryProcesses, reader_socket_path
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class IpcTest(TestBase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = str(Path(self.directory.name) / "reader.sock")
+        self.reader = BarcodeReader(self.config)
+        self.publisher = EventPublisher(self.reader, path)
+        self.remote_reader = RemoteBarcodeReader(path)
+        self.received = []
+        self.received_event = asyncio.Event()
+
+        async def listener(event):
+            self.received.append(event)
+            self.received_event.set()
+
+        self.remote_reader.add_listener(listener)
+        await self.publisher.start()
+        await self.remote_reader.start()
+        await asyncio.wait_for(self._wait_for_connection(), 5)
+
+    async def asyncTearDown(self):
+        await self.remote_reader.stop()
+        await self.publisher.stop()
+        self.directory.cleanup()
+
+    async def _wait_for_connection(self):
+        while self.publisher.connection_count <= 0:
+            await asyncio.sleep(0.01)
+
+    async def _wait_for_events(self, count: int):
+        while len(self.received) < count:
+            self.received_event.clear()
+            await self.received_event.wait()
+
+    async def test_events_are_received_in_order(self):
+        events = [create_barcode_event_mock(f"{i}") for i in range(10)]
+        events[0].first_key_time = 1.5
+        events[0].enter_time = 2.5
+
+        for event in events:
+            await self.publisher.publish(event)
+        await asyncio.wait_for(self._wait_for_events(len(events)), 5)
+
+        self.assertEqual(list(map(lambda x: x.barcode, events)), list(map(lambda x: x.barcode, self.received)))
+        for event, received in zip(events, self.received):
+            self.assertEqual(event.id, received.id)
+            self.assertEqual(event.seq, received.seq)
+            self.assertEqual(event.date, received.date)
+            self.assertEqual(event.input_device.dict, received.input_device.dict)
+        self.assertEqual(1.5, self.received[0].first_key_time)
+        self.assertEqual(2.5, self.received[0].enter_time)
+        # events of the same device share its metadata
+        self.assertIs(self.received[0].input_device, self.received[1].input_device)
+
+    async def test_socket_is_private(self):
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.publisher.path).st_mode))
+
+    async def test_metrics_of_delivery_processes_are_collected(self):
+        remote_reader = RemoteBarcodeReader(self.publisher.path, index=3)
+        await remote_reader.start()
+        try:
+            async def wait_for_metrics():
+                while len(list(self.publisher.metrics._reports)) <= 0:
+                    await asyncio.sleep(0.01)
+
+            await asyncio.wait_for(wait_for_metrics(), 5)
+            registry = CollectorRegistry()
+            registry.register(self.publisher.metrics)
+
+            self.assertIsNotNone(registry.get_sample_value("scan_count_total", {"process": "3"}))
+            self.assertIsNotNone(registry.get_sample_value("scan_count_total", {"process": "reader"}))
+            # every metric is only exported once, with samples of all processes
+            lines = generate_latest(registry).decode().splitlines()
+            self.assertEqual(1, lines.count("# TYPE scan_count_total counter"))
+        finally:
+            await remote_reader.stop()
+
+    async def test_devices_are_synced(self):
+        device = create_barcode_event_mock().input_device
+        self.reader.registry.add(device.path, 1, device, matching=True)
+
+        async def wait_for_devices():
+            while self.remote_reader.registry.devices_json() != self.reader.registry.devices_json():
+                await asyncio.sleep(0.05)
+
+        await asyncio.wait_for(wait_for_devices(), 5)
+        self.assertIn(device.name.encode(), self.remote_reader.registry.devices_json())
+
+
+class SleepingDeliveryProcesses(DeliveryProcesses):
+    """
+    Runs processes that only sleep, instead of delivering events
+    """
+
+    def _start_process(self, index: int):
+        process = self._context.Process(target=time.sleep, args=(60,), daemon=True)
+        process.start()
+        return process
+
+
+class DeliveryProcessesTest(TestBase):
+
+    async def test_default_socket_path_is_private(self):
+        path = Path(reader_socket_path(self.config))
+        try:
+            self.assertEqual(0o700, stat.S_IMODE(os.stat(path.parent).st_mode))
+        finally:
+            path.parent.rmdir()
+
+    async def test_private_directory_is_removed(self):
+        path = Path(reader_socket_path(self.config))
+        publisher = EventPublisher(BarcodeReader(self.config), str(path), private_directory=True)
+        await publisher.start()
+        self.assertTrue(path.exists())
+
+        await publisher.stop()
+
+        self.assertFalse(path.parent.exists())
+
+    async def test_exited_processes_are_restarted(self):
+        under_test = SleepingDeliveryProcesses("/unused", 0, count=2)
+        under_test.start(self.config)
+        try:
+            self.assertEqual(0, under_test.restart_exited())
+
+            exited = under_test.processes[0]
+            exited.kill()
+            exited.join()
+
+            self.assertEqual(1, under_test.restart_exited())
+            self.assertIsNot(exited, under_test.processes[0])
+            self.assertTrue(all(map(lambda x: x.is_alive(), under_test.processes)))
+        finally:
+            under_test.stop()
@@ -24,6 +24,7 @@ class KeyEventReaderTest(TestBase):
         input_event = Mock(spec=InputEvent)
         input_event.type = 1
         input_event.keystate = keystate  # 0: UP, 1: Down, 2: Hold
+        input_event.value = keystate
         input_event.keycode = keycode
         # inverse lookup of the event code in the target structure
         code = next(key for key, value in ecodes.keys.items() if value == keycode)
@@ -165,3 +166,25 @@ class KeyEventReaderTest(TestBase):
 
         # THEN
         self.assertEqual(expected, line)
+
+    async def test_shifted_characters(self):
+        # GIVEN
+        under_test = KeyEventReader()
+        input_events = []
+        for keycode, shift in [("KEY_A", False), ("KEY_B", True), ("KEY_1", True), ("KEY_SLASH", True)]:
+            if shift:
+                input_events.append(self.mock_input_event(keycode="KEY_LEFTSHIFT", keystate=KeyEvent.key_down))
+            input_events.append(self.mock_input_event(keycode=keycode, keystate=KeyEvent.key_down))
+            input_events.append(self.mock_input_event(keycode=keycode, keystate=KeyEvent.key_up))
+            if shift:
+                input_events.append(self.mock_input_event(keycode="KEY_LEFTSHIFT", keystate=KeyEvent.key_up))
+        input_events += self.generate_input_event_sequence("")
+
+        input_device = Mock()
+        input_device.read_loop = self.fake_input_loop(input_events)
+
+        # WHEN
+        line = under_test.read_line(input_device)
+
+        # THEN
+        self.assertEqual("aB!?", line)
@@ -0,0 +1,68 @@
+from unittest.mock import Mock
+
+from evdev import ecodes, KeyEvent, InputEvent
+
+from barcode_server.barcode import BarcodeReader
+from barcode_server.config import AppConfig
+from barcode_server.keyboard_layout import load_keyboard_layout, DEFAULT_KEYBOARD_LAYOUT
+from barcode_server.keyevent_reader import KeyEventReader
+from tests import TestBase
+
+
+class KeyboardLayoutTest(TestBase):
+
+    @staticmethod
+    def type_keys(reader: KeyEventReader, keys: [[str]]) -> str or None:
+        """
+        Presses the given keys, each item being a list of keycodes that are held down together
+        """
+        events = []
+        for combination in keys + [["KEY_ENTER"]]:
+            for keycode in combination:
+                events.append(InputEvent(0, 0, ecodes.EV_KEY, ecodes.ecodes[keycode], KeyEvent.key_down))
+            for keycode in reversed(combination):
+                events.append(InputEvent(0, 0, ecodes.EV_KEY, ecodes.ecodes[keycode], KeyEvent.key_up))
+
+        for event in events:
+            line = reader.process_event(event)
+            if line is not None:
+                return line
+        return None
+
+    def test_default_layout(self):
+        self.assertEqual("us", DEFAULT_KEYBOARD_LAYOUT.name)
+        line = self.type_keys(KeyEventReader(), [["KEY_Y"], ["KEY_LEFTSHIFT", "KEY_2"], ["KEY_KP4"]])
+        self.assertEqual("y@4", line)
+
+    def test_german_layout(self):
+        under_test = KeyEventReader(load_keyboard_layout("de"))
+        line = self.type_keys(under_test, [
+            ["KEY_Y"], ["KEY_Z"], ["KEY_LEFTSHIFT", "KEY_2"], ["KEY_RIGHTALT", "KEY_Q"], ["KEY_SLASH"],
+            ["KEY_SEMICOLON"]
+        ])
+        self.assertEqual("zy\"@-ö", line)
+
+    def test_french_layout(self):
+        under_test = KeyEventReader(load_keyboard_layout("fr"))
+        line = self.type_keys(under_test, [["KEY_Q"], ["KEY_LEFTSHIFT", "KEY_1"], ["KEY_1"], ["KEY_M"]])
+        self.assertEqual("a1&,", line)
+
+    def test_unknown_layout(self):
+        with self.assertRaises(ValueError):
+            load_keyboard_layout("does-not-exist")
+
+    def test_layout_per_device_pattern(self):
+        config = AppConfig()
+        config.KEYBOARD_LAYOUTS.value = {".*German.*": "de"}
+        try:
+            reader = BarcodeReader(config)
+        finally:
+            config.KEYBOARD_LAYOUTS.value = {}
+
+        german_device = Mock()
+        german_device.name = "German Barcode Scanner"
+        other_device = Mock()
+        other_device.name = "Barcode Scanner"
+
+        self.assertEqual("de", reader._find_keyboard_layout(german_device).name)
+        self.assertEqual("us", reader._find_keyboard_layout(other_device).name)
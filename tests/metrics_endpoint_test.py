@@ -0,0 +1,49 @@
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+from aiohttp.test_utils import AioHTTPTestCase
+
+from barcode_server import const
+from barcode_server.stats import SCAN_COUNT
+from barcode_server.webserver import Webserver
+
+
+class MetricsEndpointTest(AioHTTPTestCase):
+    from barcode_server.config import AppConfig
+    from container_app_conf.source.yaml_source import YamlSource
+
+    # load config from test folder
+    config = AppConfig(
+        singleton=True,
+        data_sources=[
+            YamlSource("barcode_server", "./tests/")
+        ]
+    )
+
+    async def get_application(self):
+        webserver = Webserver(self.config, MagicMock())
+        self.config.STATS_WEBSERVER.value = True
+        self.config.STATS_CACHE_DURATION.value = timedelta(minutes=1)
+        return webserver.create_app()
+
+    async def asyncTearDown(self):
+        await super().asyncTearDown()
+        self.config.STATS_WEBSERVER.value = False
+        self.config.STATS_CACHE_DURATION.value = timedelta(seconds=1)
+
+    async def test_requires_api_token(self):
+        response = await self.client.get(f"/{const.ENDPOINT_METRICS}")
+
+        self.assertEqual(401, response.status)
+
+    async def test_metrics_are_cached(self):
+        headers = {const.X_Auth_Token: self.config.SERVER_API_TOKEN.value}
+
+        response = await self.client.get(f"/{const.ENDPOINT_METRICS}", headers=headers)
+        self.assertEqual(200, response.status)
+        metrics = await response.read()
+        self.assertIn(b"scan_count_total", metrics)
+
+        SCAN_COUNT.inc()
+        response = await self.client.get(f"/{const.ENDPOINT_METRICS}", headers=headers)
+        self.assertEqual(metrics, await response.read())
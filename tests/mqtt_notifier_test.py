@@ -0,0 +1,68 @@
+import asyncio
+from datetime import timedelta
+
+from barcode_server.notifier.mqtt import MQTTNotifier
+from barcode_server.notifier.retry import RetryPolicy
+from benchmarks.sinks import MqttBroker
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class MqttNotifierTest(TestBase):
+
+    async def asyncSetUp(self):
+        self.broker = MqttBroker()
+        await self.broker.start()
+        self.under_test = MQTTNotifier(host="127.0.0.1", port=self.broker.port, qos=2,
+                                       retry_policy=RetryPolicy(initial_delay=timedelta(milliseconds=10)))
+
+    async def asyncTearDown(self):
+        await self.under_test.stop()
+        await self.broker.stop()
+
+    async def test_single_connection(self):
+        # GIVEN
+        events = [create_barcode_event_mock() for _ in range(10)]
+
+        # WHEN
+        await self.under_test.start()
+        for event in events:
+            await self.under_test.add_event(event)
+        await self.broker.wait_for_messages(len(events))
+
+        # THEN
+        self.assertEqual(1, self.broker.connection_count)
+        for event, message in zip(events, self.broker.messages):
+            self.assertIn(event.id.encode(), message)
+
+    async def test_reconnect(self):
+        # GIVEN
+        await self.under_test.start()
+        await self.under_test.add_event(create_barcode_event_mock())
+        await self.broker.wait_for_messages(1)
+
+        # WHEN
+        self.broker.disconnect_all()
+        await asyncio.sleep(0.1)
+        for _ in range(3):
+            await self.under_test.add_event(create_barcode_event_mock())
+        await self.broker.wait_for_messages(4)
+
+        # THEN
+        self.assertEqual(2, self.broker.connection_count)
+
+    async def test_single_connection_in_flight(self):
+        # GIVEN
+        self.under_test.max_in_flight = 8
+        # events of different devices are sent concurrently
+        events = [create_barcode_event_mock(device_path=f"/dev/input/event{i}") for i in range(8)]
+
+        # WHEN
+        for event in events:
+            await self.under_test.add_event(event)
+        await self.under_test.start()
+        await self.broker.wait_for_messages(len(events))
+
+        # THEN
+        self.assertEqual(1, self.broker.connection_count)
+        self.assertEqual(len(events), len(self.broker.messages))
@@ -1,5 +1,59 @@
+import asyncio
+from datetime import timedelta
+from unittest.mock import patch
+
+import orjson
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from prometheus_client import REGISTRY
+
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.notifier import BarcodeNotifier
 from barcode_server.notifier.http import HttpNotifier
 from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class SlowNotifier(BarcodeNotifier):
+    """
+    Notifier with a high latency target
+    """
+
+    def __init__(self, max_in_flight: int):
+        super().__init__()
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.max_observed_in_flight = 0
+        self.delivered = []
+
+    async def _send_event(self, event: BarcodeEvent):
+        self.in_flight += 1
+        self.max_observed_in_flight = max(self.max_observed_in_flight, self.in_flight)
+        # later events of a device are faster, so they would overtake earlier ones
+        await asyncio.sleep(0.05 / (1 + int(event.barcode)))
+        self.delivered.append(event)
+        self.in_flight -= 1
+
+
+class BlockingNotifier(BarcodeNotifier):
+    """
+    Notifier with a target that doesn't respond until it is released
+    """
+
+    def __init__(self, max_in_flight: int):
+        super().__init__()
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.released = asyncio.Event()
+        self.delivered = []
+
+    async def _send_event(self, event: BarcodeEvent):
+        self.in_flight += 1
+        try:
+            await self.released.wait()
+            self.delivered.append(event)
+        finally:
+            self.in_flight -= 1
 
 
 class NotifierTest(TestBase):
@@ -11,3 +65,202 @@ class NotifierTest(TestBase):
 
         reader = HttpNotifier(method, url, headers)
         self.assertIsNotNone(reader)
+
+    async def test_http_connection_reuse(self):
+        # GIVEN
+        received = []
+
+        async def handler(request):
+            received.append(await request.read())
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post("/barcode", handler)
+        server = TestServer(app)
+        await server.start_server()
+
+        def connections(state: str) -> float:
+            return REGISTRY.get_sample_value("http_notifier_connections_total", {"state": state}) or 0
+
+        created, reused = connections("created"), connections("reused")
+        under_test = HttpNotifier("POST", str(server.make_url("/barcode")), ["X-Test: 1"])
+
+        # WHEN
+        try:
+            for _ in range(3):
+                await under_test._send_event(create_barcode_event_mock())
+        finally:
+            await under_test.stop()
+            await server.close()
+
+        # THEN
+        self.assertEqual(3, len(received))
+        self.assertEqual(1, connections("created") - created)
+        self.assertEqual(2, connections("reused") - reused)
+
+    async def test_http_batch_is_put_back_when_stopped(self):
+        # GIVEN
+        received = asyncio.Event()
+        released = asyncio.Event()
+
+        async def handler(request):
+            received.set()
+            await released.wait()
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post("/barcode", handler)
+        server = TestServer(app)
+        await server.start_server()
+
+        under_test = HttpNotifier("POST", str(server.make_url("/barcode")), [],
+                                  batch_size=5, batch_timeout=timedelta(milliseconds=10))
+        events = [create_barcode_event_mock() for _ in range(3)]
+
+        # WHEN
+        try:
+            for event in events:
+                await under_test.add_event(event)
+            await under_test.start()
+            await asyncio.wait_for(received.wait(), timeout=5)
+            processor_task = under_test.processor_task
+            await under_test.stop()
+            await asyncio.wait([processor_task], timeout=5)
+        finally:
+            released.set()
+            await server.close()
+
+        # THEN
+        self.assertEqual(len(events), under_test.event_queue.qsize())
+        self.assertEqual(1, under_test.max_in_flight)
+
+    async def test_http_batch(self):
+        # GIVEN
+        requests = []
+
+        async def handler(request):
+            requests.append(orjson.loads(await request.read()))
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post("/barcode", handler)
+        server = TestServer(app)
+        await server.start_server()
+
+        under_test = HttpNotifier("POST", str(server.make_url("/barcode")), [],
+                                  batch_size=5, batch_timeout=timedelta(milliseconds=50))
+        events = [create_barcode_event_mock() for _ in range(12)]
+
+        # WHEN
+        try:
+            for event in events:
+                await under_test.add_event(event)
+            await under_test.start()
+            await asyncio.wait_for(under_test.event_queue.join(), timeout=5)
+        finally:
+            await under_test.stop()
+            await server.close()
+
+        # THEN
+        self.assertEqual([5, 5, 2], list(map(len, requests)))
+        self.assertEqual(
+            list(map(lambda x: x.id, events)),
+            [item["id"] for request in requests for item in request]
+        )
+
+    async def test_in_flight_window(self):
+        # GIVEN
+        under_test = SlowNotifier(max_in_flight=8)
+        events = []
+        for i in range(4):
+            for device in range(8):
+                event = create_barcode_event_mock(str(i), device_path=f"/dev/input/event{device}")
+                events.append(event)
+
+        # WHEN
+        for event in events:
+            await under_test.add_event(event)
+        await under_test.start()
+        try:
+            await asyncio.wait_for(under_test.event_queue.join(), timeout=5)
+        finally:
+            await under_test.stop()
+
+        # THEN
+        self.assertEqual(8, under_test.max_observed_in_flight)
+        self.assertEqual(len(events), len(under_test.delivered))
+        for device in range(8):
+            path = f"/dev/input/event{device}"
+            self.assertEqual(
+                ["0", "1", "2", "3"],
+                [x.barcode for x in under_test.delivered if x.input_device.path == path]
+            )
+
+    async def _stop_in_flight(self, under_test: BlockingNotifier, events: list):
+        for event in events:
+            await under_test.add_event(event)
+        await under_test.start()
+        while under_test.in_flight < len(events):
+            await asyncio.sleep(0.01)
+
+        processor_task = under_test.processor_task
+        await under_test.stop()
+        await asyncio.wait([processor_task], timeout=5)
+
+    async def test_stop_waits_for_events_in_flight(self):
+        # GIVEN
+        under_test = BlockingNotifier(max_in_flight=4)
+        events = [create_barcode_event_mock(device_path=f"/dev/input/event{i}") for i in range(4)]
+        asyncio.get_running_loop().call_later(0.1, under_test.released.set)
+
+        # WHEN
+        await self._stop_in_flight(under_test, events)
+
+        # THEN
+        self.assertEqual(events, under_test.delivered)
+        self.assertTrue(under_test.event_queue.empty())
+        await asyncio.wait_for(under_test.event_queue.join(), timeout=1)
+
+    async def test_stop_puts_back_events_in_flight(self):
+        # GIVEN
+        under_test = BlockingNotifier(max_in_flight=4)
+        events = [create_barcode_event_mock(device_path=f"/dev/input/event{i}") for i in range(4)]
+
+        # WHEN
+        with patch("barcode_server.notifier.STOP_TIMEOUT", 0.1):
+            await self._stop_in_flight(under_test, events)
+
+        # THEN
+        self.assertEqual(len(events), under_test.event_queue.qsize())
+        under_test.released.set()
+        await under_test.start()
+        try:
+            await asyncio.wait_for(under_test.event_queue.join(), timeout=5)
+        finally:
+            await under_test.stop()
+        self.assertEqual(set(map(lambda x: x.id, events)), set(map(lambda x: x.id, under_test.delivered)))
+
+    async def test_stop_puts_back_event_in_flight_of_single_flight_processor(self):
+        # GIVEN
+        under_test = BlockingNotifier(max_in_flight=1)
+        events = [create_barcode_event_mock(device_path="/dev/input/event0") for _ in range(2)]
+
+        # WHEN
+        for event in events:
+            await under_test.add_event(event)
+        await under_test.start()
+        while under_test.in_flight < 1:
+            await asyncio.sleep(0.01)
+        processor_task = under_test.processor_task
+        await under_test.stop()
+        await asyncio.wait([processor_task], timeout=5)
+
+        # THEN
+        self.assertEqual(len(events), under_test.event_queue.qsize())
+        under_test.released.set()
+        await under_test.start()
+        try:
+            await asyncio.wait_for(under_test.event_queue.join(), timeout=5)
+        finally:
+            await under_test.stop()
+        self.assertEqual(set(map(lambda x: x.id, events)), set(map(lambda x: x.id, under_test.delivered)))
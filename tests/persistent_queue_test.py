@@ -0,0 +1,168 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from barcode_server.notifier.persistent_queue import PersistentEventQueue
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class PersistentEventQueueTest(TestBase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self._temp_dir.name)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    async def test_put_get(self):
+        # GIVEN
+        under_test = PersistentEventQueue(self.path)
+        event = create_barcode_event_mock("abcdefg")
+
+        # WHEN
+        await under_test.put(event)
+        restored = await under_test.get()
+        under_test.task_done()
+        under_test.close()
+
+        # THEN
+        self.assertEqual(event.id, restored.id)
+        self.assertEqual(event.date, restored.date)
+        self.assertEqual(event.barcode, restored.barcode)
+        self.assertEqual(event.input_device.name, restored.input_device.name)
+        self.assertEqual(event.input_device.path, restored.input_device.path)
+        self.assertEqual(event.input_device.info.vendor, restored.input_device.info.vendor)
+        self.assertEqual(event.input_device.info.product, restored.input_device.info.product)
+
+    async def test_restart(self):
+        # GIVEN
+        events = [create_barcode_event_mock() for _ in range(4)]
+        under_test = PersistentEventQueue(self.path)
+        for event in events:
+            await under_test.put(event)
+
+        # WHEN
+        # one event is delivered, one is in flight while the process stops
+        await under_test.get()
+        under_test.task_done()
+        await under_test.get()
+        under_test.close()
+
+        under_test = PersistentEventQueue(self.path)
+
+        # THEN
+        self.assertEqual(3, under_test.qsize())
+        for event in events[1:]:
+            self.assertEqual(event.id, (await under_test.get()).id)
+            under_test.task_done()
+        self.assertTrue(under_test.empty())
+        under_test.close()
+
+    async def test_compaction(self):
+        # GIVEN
+        under_test = PersistentEventQueue(self.path, group_commit=False, segment_size=1024)
+        events = [create_barcode_event_mock() for _ in range(100)]
+        for event in events:
+            await under_test.put(event)
+        self.assertGreater(len(list(self.path.glob("*.log"))), 2)
+
+        # WHEN
+        for event in events:
+            self.assertEqual(event.id, (await under_test.get()).id)
+            under_test.task_done()
+        await under_test.flush()
+
+        # THEN
+        self.assertEqual(1, len(list(self.path.glob("*.log"))))
+        under_test.close()
+
+    async def test_torn_write(self):
+        # GIVEN
+        under_test = PersistentEventQueue(self.path)
+        event = create_barcode_event_mock()
+        await under_test.put(event)
+        under_test.close()
+
+        # a crash while writing the next record
+        segment = next(self.path.glob("*.log"))
+        with open(segment, "ab") as f:
+            f.write(b"\x00\x00\x01\x00garbage")
+
+        # WHEN
+        under_test = PersistentEventQueue(self.path)
+        await under_test.put(create_barcode_event_mock())
+
+        # THEN
+        self.assertEqual(2, under_test.qsize())
+        self.assertEqual(event.id, (await under_test.get()).id)
+        under_test.close()
+
+    async def test_put_does_not_wait_for_sync(self):
+        # GIVEN
+        under_test = PersistentEventQueue(self.path, commit_delay=0.5)
+
+        # WHEN
+        await asyncio.wait_for(under_test.put(create_barcode_event_mock()), 0.1)
+
+        # THEN
+        self.assertFalse(under_test._commit_task.done())
+        await asyncio.wait_for(under_test.flush(), 2)
+        under_test.close()
+
+    async def test_sync_without_group_commit_does_not_block_the_loop(self):
+        # GIVEN
+        under_test = PersistentEventQueue(self.path, group_commit=False)
+        threads = []
+        fsync = os.fsync
+
+        def record_thread(fd):
+            threads.append(threading.current_thread())
+            fsync(fd)
+
+        # WHEN
+        with patch("os.fsync", side_effect=record_thread):
+            await under_test.put(create_barcode_event_mock())
+            await under_test.get()
+            under_test.task_done()
+            await under_test.flush()
+
+        # THEN
+        self.assertGreater(len(threads), 0)
+        self.assertNotIn(threading.main_thread(), threads)
+        under_test.close()
+
+    async def test_close_while_syncing(self):
+        # GIVEN
+        under_test = PersistentEventQueue(self.path)
+        events = [create_barcode_event_mock() for _ in range(2)]
+        syncing = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        fsync = os.fsync
+
+        def slow_fsync(fd):
+            loop.call_soon_threadsafe(syncing.set)
+            time.sleep(0.2)
+            fsync(fd)
+
+        with patch("os.fsync", slow_fsync):
+            for event in events:
+                await under_test.put(event)
+            await under_test.get()
+            under_test.task_done()
+            await syncing.wait()
+
+            # WHEN
+            under_test.close()
+            await asyncio.sleep(0.3)
+
+        # THEN
+        under_test = PersistentEventQueue(self.path)
+        self.assertEqual(1, under_test.qsize())
+        self.assertEqual(events[1].id, (await under_test.get()).id)
+        under_test.close()
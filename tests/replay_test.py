@@ -0,0 +1,40 @@
+from barcode_server.notifier.replay import ReplayBuffer
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class ReplayBufferTest(TestBase):
+
+    async def test_sequence_numbers_increase(self):
+        events = [create_barcode_event_mock() for _ in range(3)]
+        self.assertEqual(sorted(map(lambda x: x.seq, events)), list(map(lambda x: x.seq, events)))
+        self.assertEqual(3, len(set(map(lambda x: x.seq, events))))
+
+    async def test_since(self):
+        under_test = ReplayBuffer(capacity=3)
+        events = [create_barcode_event_mock(f"{i}") for i in range(5)]
+        for event in events:
+            under_test.append(event)
+
+        self.assertEqual(3, len(under_test))
+        self.assertEqual(events[2].seq, under_test.oldest_seq)
+        self.assertEqual(events[4:], under_test.since(events[3].seq))
+        self.assertEqual([], under_test.since(events[4].seq))
+        # events that were already dropped from the buffer are skipped
+        self.assertEqual(events[2:], under_test.since(events[0].seq))
+
+    async def test_missed_events_are_reported(self):
+        under_test = ReplayBuffer(capacity=2)
+        events = [create_barcode_event_mock(f"{i}") for i in range(3)]
+        under_test.append(events[0])
+        under_test.append(events[1])
+
+        # the client missed nothing, even though sequence numbers are not contiguous
+        with self.assertNoLogs("barcode_server.notifier.replay", level="WARNING"):
+            self.assertEqual(events[:2], under_test.since(events[0].seq - 1000))
+
+        under_test.append(events[2])
+        with self.assertLogs("barcode_server.notifier.replay", level="WARNING"):
+            self.assertEqual(events[1:], under_test.since(events[0].seq - 1000))
+        with self.assertNoLogs("barcode_server.notifier.replay", level="WARNING"):
+            self.assertEqual(events[1:], under_test.since(events[0].seq))
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from prometheus_client import REGISTRY
+
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.notifier import BarcodeNotifier
+from barcode_server.notifier.retry import RetryPolicy, CircuitBreaker
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class FailingNotifier(BarcodeNotifier):
+    """
+    Notifier with a target that fails a given number of times
+    """
+
+    def __init__(self, failures: int, retry_policy: RetryPolicy, circuit_breaker: CircuitBreaker):
+        super().__init__(retry_policy=retry_policy, circuit_breaker=circuit_breaker)
+        self.failures = failures
+        self.attempts = 0
+        self.delivered = []
+
+    async def _send_event(self, event: BarcodeEvent):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("target unreachable")
+        self.delivered.append(event)
+
+
+class RetryTest(TestBase):
+
+    async def test_exponential_backoff(self):
+        policy = RetryPolicy(initial_delay=timedelta(seconds=1), max_delay=timedelta(seconds=10),
+                             multiplier=2, jitter=0)
+
+        delays = list(map(policy.delay, range(6)))
+
+        self.assertEqual([1, 2, 4, 8, 10, 10], delays)
+        self.assertEqual(10, policy.delay(10000))
+
+    async def test_jitter(self):
+        policy = RetryPolicy(initial_delay=timedelta(seconds=10), jitter=0.5)
+
+        delays = list(map(lambda x: policy.delay(0), range(100)))
+
+        self.assertTrue(all(map(lambda x: 5 <= x <= 10, delays)))
+        self.assertGreater(len(set(delays)), 1)
+
+    async def test_circuit_breaker_opens_and_probes(self):
+        breaker = CircuitBreaker(name="test", failure_threshold=3, reset_timeout=timedelta(milliseconds=50))
+
+        for _ in range(3):
+            await breaker.acquire()
+            breaker.on_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertEqual(CircuitBreaker.OPEN,
+                         REGISTRY.get_sample_value("notifier_circuit_breaker_state", {"type": "test"}))
+
+        # only a single probe is let through once the reset timeout elapsed
+        attempts = [asyncio.create_task(breaker.acquire()) for _ in range(2)]
+        done, pending = await asyncio.wait(attempts, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+        self.assertEqual(1, len(done))
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        await asyncio.sleep(0.01)
+        self.assertEqual(1, len(list(filter(lambda x: not x.done(), attempts))))
+
+        breaker.on_success()
+        await asyncio.wait_for(asyncio.gather(*pending), 1)
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        self.assertEqual(CircuitBreaker.CLOSED,
+                         REGISTRY.get_sample_value("notifier_circuit_breaker_state", {"type": "test"}))
+
+    async def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=timedelta(milliseconds=10))
+
+        await breaker.acquire()
+        breaker.on_failure()
+        await asyncio.wait_for(breaker.acquire(), 1)
+        breaker.on_failure()
+
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+    async def test_cancelled_probe_releases(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=timedelta(milliseconds=10))
+
+        await breaker.acquire()
+        breaker.on_failure()
+        self.assertTrue(await asyncio.wait_for(breaker.acquire(), 1))
+        waiting = asyncio.create_task(breaker.acquire())
+        await asyncio.sleep(0.01)
+        self.assertFalse(waiting.done())
+
+        # the probe is abandoned, f.ex. because the notifier stopped
+        breaker.release()
+
+        self.assertTrue(await asyncio.wait_for(waiting, 1))
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+
+    async def test_notifier_retries_with_backoff(self):
+        under_test = FailingNotifier(
+            failures=4,
+            retry_policy=RetryPolicy(initial_delay=timedelta(milliseconds=5), jitter=0),
+            circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=timedelta(milliseconds=10)),
+        )
+        under_test.name = "test-retry"
+        event = create_barcode_event_mock("retried")
+        event.first_key_time = time.time()
+
+        await under_test.start()
+        try:
+            await under_test.add_event(event)
+            await asyncio.wait_for(under_test.event_queue.join(), 5)
+        finally:
+            await under_test.stop()
+
+        self.assertEqual(5, under_test.attempts)
+        self.assertEqual([event], under_test.delivered)
+        self.assertEqual(CircuitBreaker.CLOSED, under_test.circuit_breaker.state)
+        self.assertEqual(4, REGISTRY.get_sample_value("notifier_retries_total", {"type": "test-retry"}))
+        self.assertEqual(1, REGISTRY.get_sample_value("scan_latency_seconds_count", {
+            "device": event.input_device.name, "notifier": "test-retry", "stage": "end_to_end"}))
@@ -0,0 +1,55 @@
+import os
+
+from prometheus_client import REGISTRY
+
+from barcode_server import stats
+from barcode_server.barcode import BarcodeEvent
+from barcode_server.const import DEFAULT_LATENCY_BUCKETS
+from barcode_server.keyevent_reader import KeyEventReader
+from barcode_server.stats import observe_scan, observe_delivery, configure_latency_buckets
+from benchmarks.devices import FakeInputDevice, barcode_to_raw_events
+from tests import TestBase
+
+
+class StatsTest(TestBase):
+
+    async def test_scan_timestamps(self):
+        device = FakeInputDevice(0)
+        try:
+            device.write(barcode_to_raw_events("123"))
+            under_test = KeyEventReader()
+            lines = list(filter(lambda x: x is not None, map(under_test.process_event, device.read())))
+        finally:
+            device.close()
+            device.unplug()
+
+        self.assertEqual(["123"], lines)
+        self.assertIsNotNone(under_test.line_start_time)
+        self.assertLessEqual(under_test.line_start_time, under_test.line_end_time)
+
+    async def test_observe_latencies(self):
+        device = FakeInputDevice(1)
+        os.unlink(device.path)
+        event = BarcodeEvent(device, "123", first_key_time=100.0, enter_time=100.5)
+        event.enqueue_times = {"test-stats": 101.0}
+        labels = {"device": device.name, "notifier": "test-stats"}
+
+        observe_scan(event)
+        observe_delivery(event, "test-stats")
+
+        self.assertEqual(0.5, REGISTRY.get_sample_value("scan_input_duration_seconds_sum", {"device": device.name}))
+        self.assertEqual(0.5, REGISTRY.get_sample_value("scan_latency_seconds_sum", {**labels, "stage": "enqueue"}))
+        for stage in ["queue", "end_to_end"]:
+            self.assertEqual(1, REGISTRY.get_sample_value("scan_latency_seconds_count", {**labels, "stage": stage}))
+
+    async def test_configure_latency_buckets(self):
+        try:
+            configure_latency_buckets([1, 10])
+            stats.SCAN_INPUT_DURATION.labels(device="test-buckets").observe(5)
+
+            self.assertEqual(0, REGISTRY.get_sample_value(
+                "scan_input_duration_seconds_bucket", {"device": "test-buckets", "le": "1.0"}))
+            self.assertEqual(1, REGISTRY.get_sample_value(
+                "scan_input_duration_seconds_bucket", {"device": "test-buckets", "le": "10.0"}))
+        finally:
+            configure_latency_buckets(DEFAULT_LATENCY_BUCKETS)
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import socket
+import stat
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+import orjson
+
+from barcode_server.notifier.retry import RetryPolicy, CircuitBreaker
+from barcode_server.notifier.unix import UnixSocketNotifier, FRAME_HEADER
+from barcode_server.util import barcode_event_to_json
+from tests import TestBase
+from tests.websocket_notifier_test import create_barcode_event_mock
+
+
+class UnixSocketNotifierTest(TestBase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.directory.name) / "events.sock")
+        self.under_test = UnixSocketNotifier(
+            self.path, mode=0o600,
+            retry_policy=RetryPolicy(initial_delay=timedelta(milliseconds=10), max_delay=timedelta(milliseconds=10)),
+            circuit_breaker=CircuitBreaker(failure_threshold=0))
+        await self.under_test.start()
+
+    async def asyncTearDown(self):
+        await self.under_test.stop()
+        self.directory.cleanup()
+
+    async def _subscribe(self) -> asyncio.StreamReader:
+        count = self.under_test.subscriber_count
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self.addAsyncCleanup(self._close, writer)
+        while self.under_test.subscriber_count <= count:
+            await asyncio.sleep(0.01)
+        return reader
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter):
+        writer.close()
+
+    @staticmethod
+    async def _read_event(reader: asyncio.StreamReader) -> bytes:
+        length, = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        return await asyncio.wait_for(reader.readexactly(length), 5)
+
+    async def test_socket_permissions(self):
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+
+    async def test_refuses_to_replace_other_files(self):
+        path = str(Path(self.directory.name) / "file")
+        Path(path).write_text("data")
+
+        with self.assertRaises(FileExistsError):
+            await UnixSocketNotifier(path).start()
+
+        self.assertEqual("data", Path(path).read_text())
+
+    async def test_replaces_stale_socket(self):
+        await self.under_test.stop()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+
+        await self.under_test.start()
+
+        await self._subscribe()
+
+    async def test_events_are_sent_to_all_subscribers(self):
+        subscribers = [await self._subscribe() for _ in range(2)]
+        events = [create_barcode_event_mock(f"{i}") for i in range(3)]
+
+        for event in events:
+            await self.under_test.add_event(event)
+
+        for subscriber in subscribers:
+            for event in events:
+                payload = await asyncio.wait_for(self._read_event(subscriber), 5)
+                self.assertEqual(barcode_event_to_json(self.config.INSTANCE_ID.value, event), payload)
+                self.assertEqual(event.barcode, orjson.loads(payload)["barcode"])
+
+    async def test_events_are_kept_until_a_subscriber_connects(self):
+        event = create_barcode_event_mock()
+        await self.under_test.add_event(event)
+        await asyncio.sleep(0.05)
+
+        subscriber = await self._subscribe()
+        payload = await asyncio.wait_for(self._read_event(subscriber), 5)
+
+        self.assertEqual(event.id, orjson.loads(payload)["id"])
+        await asyncio.wait_for(self.under_test.event_queue.join(), 5)
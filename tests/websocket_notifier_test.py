@@ -1,9 +1,10 @@
 import asyncio
 import random
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock
 
 import aiohttp
 from aiohttp.test_utils import AioHTTPTestCase
+from prometheus_client import REGISTRY
 
 from barcode_server import const
 from barcode_server.barcode import BarcodeEvent
@@ -11,11 +12,11 @@ from barcode_server.util import barcode_event_to_json
 from barcode_server.webserver import Webserver
 
 
-def create_barcode_event_mock(barcode: str = None):
+def create_barcode_event_mock(barcode: str = None, device_path: str = "/dev/input/event3"):
     device = lambda: None
     device.info = lambda: None
     device.name = "BARCODE SCANNER BARCODE SCANNER"
-    device.path = "/dev/input/event3"
+    device.path = device_path
     device.info.vendor = 1
     device.info.product = 1
 
@@ -205,3 +206,203 @@ class WebsocketNotifierTest(AioHTTPTestCase):
                     self.fail("No event received")
 
         assert False
+
+    async def test_ws_resume_from_last_event_seq(self):
+        server_id = self.config.INSTANCE_ID.value
+        events = [create_barcode_event_mock(f"{i}") for i in range(3)]
+        live_event = create_barcode_event_mock("123456")
+
+        import uuid
+        client_id = str(uuid.uuid4())
+
+        # events the client has seen (events[0]) or missed, while not even having connected before
+        for event in events:
+            await self.webserver.on_barcode(event)
+
+        async with self.client.ws_connect(
+            path='/',
+            headers={
+                const.Client_Id: client_id,
+                const.Last_Event_Seq: str(events[0].seq),
+                const.X_Auth_Token: self.config.SERVER_API_TOKEN.value or ""
+            }) as ws:
+            await asyncio.sleep(0.1)
+            await self.webserver.on_barcode(live_event)
+
+            received = []
+            for _ in range(3):
+                msg = await asyncio.wait_for(ws.receive(), 1)
+                received.append(msg.data)
+            await ws.close()
+
+        self.assertEqual(list(map(lambda x: barcode_event_to_json(server_id, x), events[1:] + [live_event])),
+                         received)
+        await asyncio.sleep(0.1)
+        # no events are queued for clients resuming from the replay buffer
+        self.assertNotIn(client_id, self.webserver.client_notifiers)
+
+    async def test_ws_broadcast_to_many_clients(self):
+        server_id = self.config.INSTANCE_ID.value
+        event = create_barcode_event_mock("abcdefg")
+        expected_json = barcode_event_to_json(server_id, event)
+        direct_before = REGISTRY.get_sample_value("websocket_broadcast_deliveries_total", {"mode": "direct"}) or 0
+
+        import uuid
+        clients = []
+        for _ in range(10):
+            clients.append(await self.client.ws_connect(
+                path='/',
+                headers={
+                    const.Client_Id: str(uuid.uuid4()),
+                    const.X_Auth_Token: self.config.SERVER_API_TOKEN.value or ""
+                }))
+        try:
+            await asyncio.sleep(0.1)
+            await self.webserver.on_barcode(event)
+
+            for ws in clients:
+                msg = await asyncio.wait_for(ws.receive(), 1)
+                self.assertEqual(aiohttp.WSMsgType.BINARY, msg.type)
+                self.assertEqual(expected_json, msg.data)
+        finally:
+            for ws in clients:
+                await ws.close()
+
+        direct_after = REGISTRY.get_sample_value("websocket_broadcast_deliveries_total", {"mode": "direct"})
+        self.assertEqual(10, direct_after - direct_before)
+
+    async def test_ws_broadcast_does_not_overtake_queued_events(self):
+        server_id = self.config.INSTANCE_ID.value
+        queued_event = create_barcode_event_mock("abcdefg")
+        second_event = create_barcode_event_mock("123456")
+
+        import uuid
+        client_id = str(uuid.uuid4())
+
+        async with self.client.ws_connect(
+            path='/',
+            headers={
+                const.Client_Id: client_id,
+                const.X_Auth_Token: self.config.SERVER_API_TOKEN.value or ""
+            }) as ws:
+            await asyncio.sleep(0.1)
+            # the client is behind, while an event is still queued for it
+            await self.webserver.client_notifiers[client_id].add_event(queued_event)
+            await self.webserver.on_barcode(second_event)
+
+            received = []
+            for _ in range(2):
+                msg = await asyncio.wait_for(ws.receive(), 1)
+                received.append(msg.data)
+            await ws.close()
+
+        self.assertEqual([
+            barcode_event_to_json(server_id, queued_event),
+            barcode_event_to_json(server_id, second_event),
+        ], received)
+
+    async def test_idle_client_eviction(self):
+        import uuid
+        client_id = str(uuid.uuid4())
+
+        async with self.client.ws_connect(
+            path='/',
+            headers={
+                const.Client_Id: client_id,
+                const.X_Auth_Token: self.config.SERVER_API_TOKEN.value or ""
+            }) as ws:
+            await ws.close()
+        await asyncio.sleep(0.1)
+        await self.webserver.on_barcode(create_barcode_event_mock("abcdefg"))
+
+        # recently disconnected clients are kept, to catch up on missed events
+        await self.webserver._evict_idle_clients()
+        self.assertIn(client_id, self.webserver.client_notifiers)
+
+        self.webserver._client_last_seen[client_id] -= self.config.SERVER_CLIENT_IDLE_TIMEOUT.value
+        await self.webserver._evict_idle_clients()
+        self.assertNotIn(client_id, self.webserver.client_notifiers)
+
+    async def test_client_id_of_notifier(self):
+        http_notifier = AsyncMock()
+        self.webserver.notifiers["http"] = http_notifier
+        event = create_barcode_event_mock("abcdefg")
+
+        async with self.client.ws_connect(
+            path='/',
+            headers={
+                const.Client_Id: "http",
+                const.X_Auth_Token: self.config.SERVER_API_TOKEN.value or ""
+            }) as ws:
+            await asyncio.sleep(0.1)
+            await self.webserver.on_barcode(event)
+            msg = await asyncio.wait_for(ws.receive(), 1)
+            self.assertEqual(aiohttp.WSMsgType.BINARY, msg.type)
+            await ws.close()
+        await asyncio.sleep(0.1)
+
+        # the client has its own notifier, which is evicted without affecting the HTTP notifier
+        http_notifier.add_event.assert_awaited_once_with(event)
+        self.webserver._client_last_seen["http"] -= self.config.SERVER_CLIENT_IDLE_TIMEOUT.value
+        await self.webserver._evict_idle_clients()
+        self.assertNotIn("http", self.webserver.client_notifiers)
+        self.assertIs(http_notifier, self.webserver.notifiers["http"])
+        http_notifier.stop.assert_not_awaited()
+
+    async def test_ws_resume_with_client_id_of_notifier(self):
+        mqtt_notifier = AsyncMock()
+        self.webserver.notifiers["mqtt"] = mqtt_notifier
+        event = create_barcode_event_mock("abcdefg")
+        await self.webserver.on_barcode(event)
+
+        async with self.client.ws_connect(
+            path='/',
+            headers={
+                const.Client_Id: "mqtt",
+                const.Last_Event_Seq: str(event.seq - 1),
+                const.X_Auth_Token: self.config.SERVER_API_TOKEN.value or ""
+            }) as ws:
+            msg = await asyncio.wait_for(ws.receive(), 1)
+            self.assertEqual(aiohttp.WSMsgType.BINARY, msg.type)
+            await ws.close()
+        await asyncio.sleep(0.1)
+
+        self.assertIs(mqtt_notifier, self.webserver.notifiers["mqtt"])
+        mqtt_notifier.stop.assert_not_awaited()
+
+    async def test_ws_resume_while_event_is_delivered(self):
+        server_id = self.config.INSTANCE_ID.value
+        seen_event = create_barcode_event_mock("123456")
+        event = create_barcode_event_mock("abcdefg")
+        await self.webserver.on_barcode(seen_event)
+
+        # the event is still being handed to a slow notifier, while the client resumes
+        delivering = asyncio.Event()
+        resumed = asyncio.Event()
+
+        async def add_event(e):
+            delivering.set()
+            await resumed.wait()
+
+        slow_notifier = AsyncMock()
+        slow_notifier.add_event.side_effect = add_event
+        self.webserver.notifiers["http"] = slow_notifier
+        on_barcode = asyncio.create_task(self.webserver.on_barcode(event))
+        await delivering.wait()
+
+        async with self.client.ws_connect(
+            path='/',
+            headers={
+                const.Client_Id: "resuming-client",
+                const.Last_Event_Seq: str(seen_event.seq),
+                const.X_Auth_Token: self.config.SERVER_API_TOKEN.value or ""
+            }) as ws:
+            msg = await asyncio.wait_for(ws.receive(), 1)
+            self.assertEqual(barcode_event_to_json(server_id, event), msg.data)
+            resumed.set()
+            await on_barcode
+
+            # the event is received only once
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(ws.receive(), 0.2)
+            await ws.close()